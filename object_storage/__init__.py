@@ -16,13 +16,18 @@ def get_client(*args, **kwargs):
     @param auth_url: Auth URL for Object Storage
     @param auth_token: If provided, bypasses authentication and uses the given
                        auth_token
+    @param lazy: If True, authenticates on the first request instead of
+                 before returning
+    @param prewarm: Number of keep-alive connections to open in the
+                    background while authenticating; implies lazy
     @return: `object_storage.client.Client`
     """
     return get_httplib2_client(*args, **kwargs)
 
 
 def get_httplib2_client(username, password,
-                        auth_url=None, auth_token=None, **kwargs):
+                        auth_url=None, auth_token=None, lazy=False, prewarm=0,
+                        **kwargs):
     """ Returns an Object Storage client (using httplib2)
 
     @param username: username for Object Storage
@@ -30,6 +35,10 @@ def get_httplib2_client(username, password,
     @param auth_url: Auth URL for Object Storage
     @param auth_token: If provided, bypasses authentication and uses the given
                        auth_token
+    @param lazy: If True, authenticates on the first request instead of
+                 before returning
+    @param prewarm: Number of keep-alive connections to open in the
+                    background while authenticating; implies lazy
     @return: `object_storage.client.Client`
     """
     from object_storage.client import Client
@@ -38,14 +47,16 @@ def get_httplib2_client(username, password,
 
     auth = Authentication(username, password,
                           auth_url=auth_url, auth_token=auth_token, **kwargs)
-    conn = AuthenticatedConnection(auth)
+    conn = AuthenticatedConnection(auth, lazy=lazy, prewarm=prewarm)
     client = Client(username, password, connection=conn)
     return client
 
 
 def get_requests_client(username, password,
-                        auth_url=None, auth_token=None, **kwargs):
-    """ Returns an Object Storage client (using Requests) """
+                        auth_url=None, auth_token=None, lazy=False, prewarm=0,
+                        **kwargs):
+    """ Returns an Object Storage client (using Requests). Takes the same
+        arguments as get_httplib2_client() """
     from object_storage.client import Client
     from object_storage.transport.requestsconn import (
         AuthenticatedConnection, Authentication)
@@ -53,7 +64,7 @@ def get_requests_client(username, password,
     auth = Authentication(username, password,
                           auth_url=auth_url,
                           auth_token=auth_token, **kwargs)
-    conn = AuthenticatedConnection(auth)
+    conn = AuthenticatedConnection(auth, lazy=lazy, prewarm=prewarm)
     client = Client(username, password, connection=conn)
     return client
 
@@ -72,3 +83,20 @@ def get_twisted_client(username, password,
 
     d = conn.authenticate().addCallback(lambda r: client)
     return d
+
+
+def get_asyncio_client(username, password,
+                       auth_url=None, auth_token=None, **kwargs):
+    """ Returns an awaitable that authenticates and returns an Object Storage
+        client (using asyncio and aiohttp, Python 3 only)
+
+        client = await get_asyncio_client(username, password)
+
+    @param limit: max number of pooled connections
+    @param limit_per_host: max number of pooled connections per host
+    @return: awaitable of `object_storage.aio.AsyncClient`
+    """
+    from object_storage.aio import get_client
+
+    return get_client(username, password,
+                      auth_url=auth_url, auth_token=auth_token, **kwargs)
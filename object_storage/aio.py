@@ -0,0 +1,567 @@
+"""
+    asyncio variants of Client, Container and StorageObject. Python 3 only.
+
+    These are meant to be used with
+    `object_storage.transport.asyncioconn.AuthenticatedConnection`, whose
+    make_request() is a coroutine. Methods that make a single request and
+    return the result of its formatter (create(), delete(), objects(), ...)
+    are inherited as is and return awaitables; the methods overridden here
+    are the ones that need to await more than one step. Properties that
+    would have to load the model first (properties, headers, meta, len())
+    raise ObjectStorageError until load() has been awaited.
+
+    The threaded bulk transfer methods of the synchronous classes have no
+    asyncio version and are absent from these classes: read_parallel(),
+    send_segments() and upload_directory() on objects, walk() and
+    download_prefix() on containers, and iter_listing_partitioned() and
+    container_index() on the client. save_to_filename() takes no workers,
+    range_size or resume arguments. The metadata and content caches are
+    not used.
+
+    See COPYING for license information
+"""
+import asyncio
+from hashlib import md5
+
+import six
+
+from object_storage import consts
+from object_storage.client import Client
+from object_storage.container import Container, ContainerModel
+from object_storage.storage_object import StorageObject, StorageObjectModel
+from object_storage import errors
+from object_storage.utils import iter_json_response
+
+
+class _Absent(object):
+    """ Removes a method inherited from a synchronous class: looking it up
+        raises AttributeError, as if it wasn't defined """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        raise AttributeError('%s has no attribute %r; it has no asyncio '
+                             'version' % (objtype.__name__, self.name))
+
+
+class _AsyncModel(object):
+    """ Model accessors for resources whose load() is a coroutine """
+    async def get_info(self):
+        """ loads data if not already available and returns the properties
+
+        @raises ResponseError
+        """
+        if not self.model:
+            await self.load()
+        return self.model.properties
+
+    def _loaded_model(self):
+        if not self.model:
+            raise errors.ObjectStorageError(
+                'the model is not loaded; await load() first')
+        return self.model
+
+    @property
+    def properties(self):
+        """ returns the properties; load() has to be awaited first
+
+        @raises ObjectStorageError if the model isn't loaded
+        """
+        return self._loaded_model().properties
+    props = properties
+
+    @property
+    def headers(self):
+        """ returns the raw headers; load() has to be awaited first
+
+        @raises ObjectStorageError if the model isn't loaded
+        """
+        return self._loaded_model().headers
+
+    @property
+    def meta(self):
+        """ returns the metadata; load() has to be awaited first
+
+        @raises ObjectStorageError if the model isn't loaded
+        """
+        return self._loaded_model().meta
+
+    # listings are async iterators, see __aiter__
+    __iter__ = None
+
+
+class AsyncStorageObject(_AsyncModel, StorageObject):
+    """
+        StorageObject whose network methods are coroutines
+    """
+    async def exists(self):
+        """ Tries to load the object to check existance
+
+        @raises ResponseError
+        @return: boolean, true if exists else false
+        """
+        try:
+            await self.load()
+            return True
+        except errors.NotFound:
+            return False
+
+    async def load(self, cdn=False):
+        """ load data for the object
+
+        @param cdn: True if you want CDN information; default=False
+        @return: object_storage.aio.AsyncStorageObject, self
+        """
+        headers = {}
+        if cdn:
+            headers['X-Context'] = 'cdn'
+        res = await self.make_request('HEAD', headers=headers)
+        self.model = StorageObjectModel(self, self.container, self.name,
+                                        res.headers)
+        return self
+
+    async def read(self, size=None, offset=None, headers=None):
+        """ Reads object content. Takes the same arguments as
+            StorageObject.read()
+
+        @raises ResponseError
+        @return: bytes
+        """
+        headers = dict(headers or {})
+        if offset is not None and size:
+            headers['Range'] = 'bytes=%s-%s' % (offset, offset + size - 1)
+        elif offset is None and size is not None and size < 0:
+            headers['Range'] = 'bytes=%s' % (size, )
+        elif offset is None and size:
+            headers['Range'] = 'bytes=0-%s' % (size - 1, )
+        elif offset is not None and size is None:
+            headers['Range'] = 'bytes=%s-' % (offset, )
+        res = await self.make_request('GET', headers=headers)
+        return res.content
+
+    async def iter_list(self, marker=None, base_only=False,
+                        page_size=10000):
+        """ Lists all children objects using the sudo-hierarchical
+            structure. Async generator of AsyncStorageObject instances.
+            See StorageObject.iter_list()
+
+        @raises ResponseError
+        """
+        params = {'prefix': self.name + self.client.delimiter}
+        if base_only:
+            params['delimiter'] = self.client.delimiter
+        async for item in self.client.iter_listing([self.container],
+                                                   params=params,
+                                                   marker=marker,
+                                                   page_size=page_size):
+            yield self._listing_object(item)
+
+    async def is_dir(self):
+        """ returns True if content_type is 'text/directory' or
+            'application/directory', loading the object if needed
+
+        @raises ResponseError
+        """
+        if not self.model:
+            await self.load()
+        return self.model['content_type'] in ['text/directory',
+                                              'application/directory']
+
+    def __len__(self):
+        return int(self._loaded_model()['size'])
+
+    def chunk_download(self, chunk_size=None, headers=None):
+        """ Returns an async iterator over the object data
+
+        @param chunk_size: size of the chunks to read in.
+            If not defined uses self.chunk_size
+        @param headers: extra headers to use with this request
+        @raises: ResponseError
+        """
+        chunk_size = chunk_size or self.chunk_size
+        return self.client.chunk_download([self.container, self.name],
+                                          chunk_size=chunk_size,
+                                          headers=headers)
+    iter_content = chunk_download
+    __aiter__ = chunk_download
+
+    async def save_to_filename(self, filename):
+        """ Streams object content into a file. The file is opened and
+            written in the loop's default executor so that disk I/O doesn't
+            block the event loop. Parallel ranged and resumable downloads
+            aren't available on the asyncio client.
+
+        @param filename: filename
+        @raises ResponseError, IOError
+        """
+        loop = asyncio.get_event_loop()
+        f = await loop.run_in_executor(None, open, filename, 'wb')
+        try:
+            async for data in self.chunk_download():
+                await loop.run_in_executor(None, f.write, data)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    async def send(self, data, check_md5=True):
+        """ Uploads object data as it's read
+
+        @param data: bytes, a file-like object or an async iterable of
+            bytes
+        @param check_md5: check if hash of uploaded data matches
+        @raises: ResponseError
+        @return: AsyncStorageObject, self
+        """
+        size = None
+        if isinstance(data, six.binary_type):
+            size = len(data)
+            data = six.BytesIO(data)
+        elif not hasattr(data, '__aiter__'):
+            size = self._data_size(data)
+
+        headers = {'Content-Type': self._content_type(data)}
+        checksum = md5()
+        transfered = 0
+        conn = self.chunk_upload(size=size, headers=headers)
+
+        async def _chunks():
+            if hasattr(data, '__aiter__'):
+                async for buff in data:
+                    yield buff
+                return
+            while True:
+                buff = data.read(self.chunk_size)
+                if not buff:
+                    return
+                yield buff
+
+        async for buff in _chunks():
+            await conn.send(buff)
+            if check_md5:
+                checksum.update(buff)
+            transfered += len(buff)
+        res = await conn.finish()
+
+        if check_md5 and checksum.hexdigest() != res.headers.get('etag'):
+            raise errors.ChecksumMismatch('md5 hashes do not match')
+        res.headers['content-length'] = transfered
+        self.model = StorageObjectModel(self, self.container, self.name,
+                                        res.headers)
+        self.client._index_add(self.container, self.name, self.model)
+        return self
+    write = send
+
+    async def rename(self, new_obj, *args, **kwargs):
+        """ Copies content to a new object and deletes the current object
+
+        @param new_obj: AsyncStorageObject instance to copy data to
+        @raises: ResponseError
+        """
+        await new_obj.make_request('PUT', headers={'Content-Length': '0'})
+        await new_obj.copy_from(self, *args, **kwargs)
+        return await self.delete()
+
+    async def load_from_filename(self, filename):
+        """ Uploads a file from the local filename
+
+        @param filename: path of the file to upload
+        @raises: ResponseError, IOError
+        """
+        with open(filename, 'rb') as f:
+            return await self.send(f)
+
+    read_parallel = _Absent('read_parallel')
+    send_segments = _Absent('send_segments')
+    upload_directory = _Absent('upload_directory')
+
+
+class AsyncContainer(_AsyncModel, Container):
+    """
+        Container whose network methods are coroutines
+    """
+    async def exists(self):
+        """ Tries to load the container to check existance
+
+        @raises ResponseError
+        @return: boolean, true if exists else false
+        """
+        try:
+            await self.load()
+            return True
+        except errors.NotFound:
+            return False
+
+    async def load(self, cdn=False):
+        """ load data for the container
+
+        @param cdn: True if you want CDN information; default=False
+        @return: object_storage.aio.AsyncContainer, self
+        """
+        headers = {}
+        if cdn:
+            headers['X-Context'] = 'cdn'
+        res = await self.make_request('HEAD', headers=headers)
+        self.model = ContainerModel(self, self.name, res.headers)
+        return self
+
+    async def iter_objects(self, marker=None, prefix=None, base_only=False,
+                           headers=None, page_size=10000):
+        """ Lists all objects in the container, following the listing
+            across pages. Async generator of AsyncStorageObject instances.
+            See Container.iter_objects()
+
+        @raises ResponseError
+        """
+        params = {}
+        if base_only:
+            params['delimiter'] = self.client.delimiter
+        if prefix:
+            params['prefix'] = prefix
+        async for item in self.client.iter_listing([self.name],
+                                                   params=params,
+                                                   marker=marker,
+                                                   headers=headers,
+                                                   page_size=page_size):
+            yield self._listing_object(item)
+
+    def __aiter__(self):
+        return self.iter_objects()
+
+    async def delete_all_objects(self, workers=consts.WORKERS):
+        """ Deletes all objects in the container. See
+            AsyncClient.delete_objects()
+
+        @param workers: number of requests to run at the same time
+        @raises ResponseError
+        @return: dict with the number of objects 'deleted' and 'not_found'
+            and a list of (name, reason) 'errors'
+        """
+        summary = {'deleted': 0, 'not_found': 0, 'errors': []}
+
+        async def _delete(names):
+            result = await self.client.delete_objects(self.name, names,
+                                                      workers=workers)
+            summary['deleted'] += result['deleted']
+            summary['not_found'] += result['not_found']
+            summary['errors'].extend(result['errors'])
+
+        # names are deleted in batches as the listing pages arrive
+        names = []
+        async for obj in self.iter_objects():
+            names.append(obj.name)
+            if len(names) >= self.client.bulk_delete_size:
+                await _delete(names)
+                names = []
+        if names:
+            await _delete(names)
+        return summary
+
+    async def rename(self, new_container):
+        """ Rename container. Will not work if container is not empty.
+
+        @param new_container: new container name
+        @raises ResponseError
+        """
+        await self.delete()
+        await new_container.create()
+
+    walk = _Absent('walk')
+    download_prefix = _Absent('download_prefix')
+
+
+class AsyncClient(_AsyncModel, Client):
+    """
+        Client whose network methods are coroutines
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('container_class', AsyncContainer)
+        kwargs.setdefault('object_class', AsyncStorageObject)
+        super(AsyncClient, self).__init__(*args, **kwargs)
+        self.metadata_cache = self.content_cache = None
+
+    async def iter_listing(self, path, params=None, marker=None,
+                           headers=None, page_size=10000, end_marker=None):
+        """ Follows marker pagination of an account or container listing.
+            Async generator of the raw listing entries.
+            See Client.iter_listing()
+
+        @raises ResponseError
+        """
+        def _formatter(res):
+            return list(iter_json_response(res))
+
+        page_size = min(page_size, self.listing_limit)
+        while True:
+            _params = {'format': 'json', 'limit': page_size}
+            _params.update(params or {})
+            if marker:
+                _params['marker'] = marker
+            if end_marker:
+                _params['end_marker'] = end_marker
+            page = await self.make_request('GET', path, params=_params,
+                                           headers=headers,
+                                           formatter=_formatter)
+            for item in page:
+                yield item
+            if len(page) < page_size:
+                return
+            marker = page[-1].get('name') or page[-1].get('subdir')
+
+    async def iter_containers(self, marker=None, headers=None,
+                              page_size=10000):
+        """ Lists all containers. Async generator of AsyncContainer
+            instances
+
+        @raises ResponseError
+        """
+        async for item in self.iter_listing(None, marker=marker,
+                                            headers=headers,
+                                            page_size=page_size):
+            yield self.container(item['name'], item)
+
+    def __aiter__(self):
+        return self.iter_containers()
+
+    async def set_metadata(self, meta, headers={}):
+        """ Sets metadata for the account
+
+        @param meta: dict of metadata on the account
+        @raises ResponseError
+        """
+        meta_headers = dict(headers)
+        for k, v in meta.items():
+            meta_headers["x-account-meta-%s" % (k, )] = v
+        await self.make_request('POST', headers=meta_headers)
+
+    iter_listing_partitioned = _Absent('iter_listing_partitioned')
+    container_index = _Absent('container_index')
+
+    async def delete_container(self, name, recursive=False):
+        """ Deletes a container.
+
+        @param name: container name
+        @param recursive: delete all of the objects in the container first
+        @raises ResponseError
+        @raises ContainerNotEmpty if container is not empty
+        """
+        if recursive:
+            await self.container(name).delete_all_objects()
+        try:
+            return await self.make_request('DELETE', [name],
+                                           formatter=lambda r: True)
+        except errors.ResponseError as ex:
+            if ex.status == 409:
+                raise errors.ContainerNotEmpty(ex.status,
+                                               "ContainerNotEmpty Error")
+            raise
+
+    async def get_object(self, container, name):
+        """ Load an object from swift
+
+        @raises ResponseError
+        """
+        return await self.storage_object(container, name).load()
+
+    async def delete_object(self, container, name):
+        """ Delete an object from swift
+
+        @raises ResponseError
+        """
+        try:
+            await self.make_request('DELETE', [container, name])
+        except errors.NotFound:
+            self._index_remove(container, name)
+            raise
+        self._index_remove(container, name)
+        return True
+
+    async def _gather(self, func, items, limit):
+        """ Runs func on every item with at most `limit` in flight. Object
+            storage errors are returned with the item; any other exception
+            cancels the remaining calls and is raised. """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def _run(item):
+            async with semaphore:
+                try:
+                    return item, await func(item), None
+                except errors.ObjectStorageError as error:
+                    return item, None, error
+        tasks = [asyncio.ensure_future(_run(item)) for item in items]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def delete_objects(self, container, names, workers=consts.WORKERS):
+        """ Deletes many objects from a container with concurrent DELETE
+            requests. The bulk delete middleware isn't used.
+
+        @param container: container name
+        @param names: iterable of object names
+        @param workers: number of requests to run at the same time
+        @raises ResponseError
+        @return: dict with the number of objects 'deleted' and 'not_found'
+            and a list of (name, reason) 'errors'
+        """
+        summary = {'deleted': 0, 'not_found': 0, 'errors': []}
+
+        async def _delete(name):
+            return await self.delete_object(container, name)
+        for name, _, error in await self._gather(_delete, names, workers):
+            if isinstance(error, errors.NotFound):
+                summary['not_found'] += 1
+            elif isinstance(error, errors.ResponseError):
+                summary['errors'].append((name, str(error)))
+            elif error:
+                raise error
+            else:
+                summary['deleted'] += 1
+        return summary
+
+    async def get_objects(self, pairs, limit=100):
+        """ Loads many objects concurrently
+
+        @param pairs: iterable of (container, name) pairs
+        @param limit: number of requests in flight at a time
+        @return: list of ((container, name), storage_object, error) in
+            input order
+        """
+        async def _load(pair):
+            return await self.get_object(*pair)
+        return await self._gather(_load, pairs, limit)
+
+    async def read_objects(self, pairs, limit=100):
+        """ Reads many objects concurrently
+
+        @param pairs: iterable of (container, name) pairs
+        @param limit: number of requests in flight at a time
+        @return: list of ((container, name), data, error) in input order
+        """
+        async def _read(pair):
+            return await self.storage_object(*pair).read()
+        return await self._gather(_read, pairs, limit)
+
+    async def close(self):
+        """ Closes the connection's pooled connections """
+        await self.conn.close()
+
+
+async def get_client(username, password, auth_url=None, auth_token=None,
+                     limit=100, limit_per_host=0, **kwargs):
+    """ Authenticates and returns an AsyncClient using aiohttp. See
+        object_storage.get_asyncio_client() """
+    from object_storage.transport.asyncioconn import (
+        AuthenticatedConnection, Authentication)
+
+    auth = Authentication(username, password,
+                          auth_url=auth_url, auth_token=auth_token, **kwargs)
+    conn = AuthenticatedConnection(auth, limit=limit,
+                                   limit_per_host=limit_per_host)
+    if auth.load_cached_token():
+        conn._authenticate()
+    else:
+        await conn.authenticate()
+    return AsyncClient(username, password, connection=conn)
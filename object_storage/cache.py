@@ -0,0 +1,408 @@
+"""
+    Client-side caches
+
+    See COPYING for license information
+"""
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from object_storage import errors
+from object_storage.utils import json
+
+
+class MetadataCache(object):
+    """
+        LRU cache of HEAD responses for containers and objects.
+
+        Entries expire after `ttl` seconds; expired entries are revalidated
+        with If-None-Match so an unchanged object only costs a 304. 404s are
+        remembered for `negative_ttl` seconds.
+    """
+    def __init__(self, max_entries=10000, ttl=60, negative_ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns (fresh, headers) for a cached key or None. headers is
+            None for a cached 404. """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.entries[key] = entry
+        expires, headers = entry
+        return time.time() < expires, headers
+
+    def set(self, key, headers):
+        """ Caches the headers of a HEAD response """
+        self._store(key, headers, self.ttl)
+
+    def set_missing(self, key):
+        """ Caches a 404 """
+        self._store(key, None, self.negative_ttl)
+
+    def invalidate(self, key):
+        """ Forgets a key, if cached """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _store(self, key, headers, ttl):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, headers)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def fetch(self, key, head):
+        """ Returns the headers for key from the cache, or by calling
+            head(headers), which makes the HEAD request with the given extra
+            headers and returns (status_code, headers).
+
+        @raises NotFound
+        @raises ResponseError
+        """
+        cached = self.get(key)
+        if cached:
+            fresh, headers = cached
+            if fresh:
+                if headers is None:
+                    raise errors.NotFound('Not found')
+                return headers
+
+        extra = {}
+        if cached and cached[1] and cached[1].get('etag'):
+            extra['If-None-Match'] = cached[1]['etag']
+
+        try:
+            status, headers = head(extra)
+        except errors.NotFound:
+            self.set_missing(key)
+            raise
+        except errors.ResponseError as ex:
+            if ex.status != 304 or not extra:
+                raise
+            status = 304
+
+        if status == 304 and extra:
+            headers = cached[1]
+        self.set(key, headers)
+        return headers
+
+
+class ContentCache(object):
+    """
+        Read-through cache of object content in a local directory.
+
+        Every object is stored in a file named after the hash of its path
+        next to a small JSON file with its ETag. Cached objects are
+        revalidated with If-None-Match and served through mmap. Least
+        recently used files are evicted once the cache grows over
+        `max_bytes`.
+    """
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, container, name):
+        key = hashlib.sha1(('%s/%s' % (container, name)).encode('utf8'))
+        return os.path.join(self.directory, key.hexdigest())
+
+    def lookup(self, container, name):
+        """ Returns the cached entry ({'etag': .., 'size': ..}) or None """
+        path = self._path(container, name)
+        try:
+            f = open(path + '.json', 'r')
+            try:
+                entry = json.load(f)
+            finally:
+                f.close()
+            if os.path.getsize(path) != entry['size']:
+                return None
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def touch(self, container, name):
+        """ Marks an entry as recently used """
+        try:
+            os.utime(self._path(container, name), None)
+        except OSError:
+            pass
+
+    def open(self, container, name):
+        """ Returns a read-only mmap of the cached content """
+        path = self._path(container, name)
+        f = open(path, 'rb')
+        try:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def store(self, container, name, etag, chunks):
+        """ Writes content to the cache and evicts old entries """
+        path = self._path(container, name)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        size = 0
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump({'container': container, 'name': name,
+                       'etag': etag, 'size': size}, f)
+        finally:
+            f.close()
+        os.rename(tmp, path + '.json')
+        self.evict(keep=path)
+
+    def invalidate(self, container, name):
+        """ Removes an object from the cache """
+        path = self._path(container, name)
+        for filename in (path + '.json', path):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def evict(self, keep=None):
+        """ Removes least recently used entries until the cache fits in
+            max_bytes """
+        with self.lock:
+            entries = []
+            total = 0
+            for filename in os.listdir(self.directory):
+                if '.' in filename:
+                    continue
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                if path != keep:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                for filename in (path + '.json', path):
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                total -= size
+
+
+def _stat_key(filename):
+    """ Returns (size, mtime_ns, inode) of a file """
+    stat = os.stat(filename)
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1000000000)
+    return stat.st_size, mtime_ns, stat.st_ino
+
+
+class HashCache(object):
+    """
+        MD5s of local files, kept in a SQLite database and keyed by path,
+        size, mtime and inode so that files that haven't changed don't have
+        to be hashed again.
+    """
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            md5 TEXT)""")
+
+    def get(self, filename):
+        """ Returns the cached MD5 of a file or None if the file changed
+            since it was hashed """
+        path = os.path.abspath(filename)
+        try:
+            key = _stat_key(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                'SELECT size, mtime_ns, inode, md5 FROM hashes '
+                'WHERE path = ?', (path, )).fetchone()
+        if row and tuple(row[:3]) == key:
+            return row[3]
+        return None
+
+    def key(self, filename):
+        """ Returns the (size, mtime_ns, inode) key of a file as it is now;
+            take it before hashing and pass it to set() """
+        return _stat_key(os.path.abspath(filename))
+
+    def set(self, filename, md5, key=None):
+        """ Caches the MD5 of a file
+
+        @param key: (size, mtime_ns, inode) of the file when it was hashed;
+            defaults to its current stat
+        """
+        path = os.path.abspath(filename)
+        key = key or _stat_key(path)
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                    (path, ) + tuple(key) + (md5, ))
+
+    def md5(self, filename):
+        """ Returns the MD5 of a file, hashing it only if it isn't cached """
+        cached = self.get(filename)
+        if cached:
+            return cached
+        key = _stat_key(filename)
+        checksum = hashlib.md5()
+        f = open(filename, 'rb')
+        try:
+            for buff in iter(lambda: f.read(64 * 1024), b''):
+                checksum.update(buff)
+        finally:
+            f.close()
+        self.set(filename, checksum.hexdigest(), key=key)
+        return checksum.hexdigest()
+
+    def compact(self):
+        """ Drops the entries of files that were removed or changed and
+            shrinks the database
+
+        @return: number of entries dropped
+        """
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT path, size, mtime_ns, inode FROM hashes').fetchall()
+        stale = []
+        for row in rows:
+            try:
+                if _stat_key(row[0]) == tuple(row[1:]):
+                    continue
+            except OSError:
+                pass
+            stale.append((row[0], ))
+        with self.lock:
+            with self.db:
+                self.db.executemany('DELETE FROM hashes WHERE path = ?',
+                                    stale)
+            if self.path != ':memory:':
+                self.db.execute('VACUUM')
+        return len(stale)
+
+    def close(self):
+        self.db.close()
+
+
+class TokenCache(object):
+    """
+        Auth tokens and storage URLs shared between processes through a
+        JSON file, keyed by auth URL and username. The file is locked with
+        fcntl while it's read or written and is only readable by its owner.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _key(self, auth_url, username):
+        return '%s %s' % (auth_url, username)
+
+    def _open(self, lock, write=True):
+        if write:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            f = os.fdopen(fd, 'r+')
+        else:
+            f = open(self.path, 'r')
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), lock)
+        return f
+
+    def _read(self, f):
+        f.seek(0)
+        try:
+            entries = json.loads(f.read() or '{}')
+        except ValueError:
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _update(self, update):
+        f = self._open(fcntl.LOCK_EX if fcntl else None)
+        try:
+            entries = self._read(f)
+            update(entries)
+            f.seek(0)
+            f.truncate()
+            json.dump(entries, f)
+            f.flush()
+        finally:
+            f.close()
+
+    def get(self, auth_url, username):
+        """ Returns the cached (auth_token, storage_url) or None """
+        try:
+            f = self._open(fcntl.LOCK_SH if fcntl else None, write=False)
+        except (IOError, OSError):
+            # nothing has been cached yet
+            return None
+        try:
+            entry = self._read(f).get(self._key(auth_url, username))
+        finally:
+            f.close()
+        if not entry:
+            return None
+        return entry['auth_token'], entry['storage_url']
+
+    def set(self, auth_url, username, auth_token, storage_url):
+        """ Caches a token and storage URL """
+        def _set(entries):
+            entries[self._key(auth_url, username)] = {
+                'auth_token': auth_token, 'storage_url': storage_url}
+        self._update(_set)
+
+    def invalidate(self, auth_url, username, auth_token=None):
+        """ Forgets a token; if auth_token is given, only if it's still the
+            cached one """
+        def _invalidate(entries):
+            key = self._key(auth_url, username)
+            entry = entries.get(key)
+            if entry and auth_token in (None, entry['auth_token']):
+                del entries[key]
+        self._update(_invalidate)
@@ -7,10 +7,14 @@ from object_storage.utils import json, Model
 
 from object_storage.container import Container
 from object_storage.storage_object import StorageObject
-from object_storage.utils import get_path
+from object_storage.index import ContainerIndex
+from object_storage.utils import get_path, concurrent_map, iter_pages, \
+    iter_json_response, split_keyspace, concurrent_chain
 
+from object_storage import consts
 from object_storage import errors
 
+from itertools import chain, islice
 import six
 import logging
 logger = logging.getLogger(__name__)
@@ -81,10 +85,26 @@ class Client(object):
             for objects.
         @param container_class: factory or class for Container constructing
         @param object_class: factory or class for StorageObject constructing
+        @param bulk_delete_size: max number of objects per bulk delete
+        @param metadata_cache: `object_storage.cache.MetadataCache` used by
+            StorageObject.load() and Container.load()
+        @param content_cache: `object_storage.cache.ContentCache` used by
+            StorageObject.read() and StorageObject.chunk_download()
+        @param hash_cache: `object_storage.cache.HashCache` used to skip
+            hashing unchanged local files on upload and sync
+        @param listing_limit: the most entries the server returns per
+            listing request (Swift's container_listing_limit); larger page
+            sizes are reduced to it
         """
         self.username = username
         self.api_key = api_key
         self.delimiter = delimiter
+        self.bulk_delete_size = kwargs.get('bulk_delete_size', 10000)
+        self.listing_limit = kwargs.get('listing_limit', 10000)
+        self.metadata_cache = kwargs.get('metadata_cache')
+        self.content_cache = kwargs.get('content_cache')
+        self.hash_cache = kwargs.get('hash_cache')
+        self.indexes = {}
         self.container_class = kwargs.get('container_class', Container)
         self.object_class = kwargs.get('object_class', StorageObject)
         self.storage_url = None
@@ -183,9 +203,8 @@ class Client(object):
         def _formatter(response):
             """ Formats search results. """
             headers = response.headers
-            items = json.loads(response.content if isinstance(response.content, six.string_types) else response.content.decode('utf8'))
             objs = []
-            for item in items:
+            for item in iter_json_response(response):
                 if 'type' not in item or item['type'] == 'container':
                     objs.append(self.container(item['name'], headers=item))
                 elif item['type'] == 'object':
@@ -203,7 +222,8 @@ class Client(object):
         return self.make_request('GET', _path,
                                  headers=headers,
                                  params=params,
-                                 formatter=_formatter)
+                                 formatter=_formatter,
+                                 stream=True)
 
     def set_delimiter(self, delimiter):
         """ Sets the delimiter for pseudo hierarchical directory structure.
@@ -259,16 +279,17 @@ class Client(object):
         """ Deletes a container.
 
         @param name: container name
+        @param recursive: delete all of the objects in the container first
         @raises ResponseError
         @raises ContainerNotEmpty if container is not empty
         """
-        params = {}
         if recursive:
-            params['recursive'] = True
+            self.container(name).delete_all_objects()
 
+        self._invalidate((name, ))
         try:
             return self.make_request('DELETE', [name],
-                                     params=params, formatter=lambda r: True)
+                                     formatter=lambda r: True)
         except errors.ResponseError as ex:
             if ex.status == 409:
                 raise errors.ContainerNotEmpty(ex.status,
@@ -288,16 +309,152 @@ class Client(object):
 
         def _formatter(res):
             containers = []
-            if res.content:
-                items = json.loads(res.content if isinstance(res.content, six.string_types) else res.content.decode('utf8'))
-                for item in items:
-                    name = item.get('name', None)
-                    containers.append(self.container(name, item))
+            for item in iter_json_response(res):
+                name = item.get('name', None)
+                containers.append(self.container(name, item))
             return containers
         return self.make_request('GET',
                                  params=params,
                                  headers=headers,
-                                 formatter=_formatter)
+                                 formatter=_formatter,
+                                 stream=True)
+
+    def iter_containers(self, marker=None, headers=None, page_size=10000,
+                        prefetch=True):
+        """ Lazily lists all containers, following the listing across pages
+            in the order returned by the server
+
+        @param marker: start listing after this container name
+        @param headers: extra headers to use when making the listing calls
+        @param page_size: number of containers to request per page
+        @param prefetch: fetch the next page in the background
+        @raises ResponseError
+        @return: generator of Container instances
+        """
+        for item in self.iter_listing(None, marker=marker, headers=headers,
+                                      page_size=page_size,
+                                      prefetch=prefetch):
+            yield self.container(item.get('name', None), item)
+
+    def iter_listing(self, path, params=None, marker=None, headers=None,
+                     page_size=10000, prefetch=True, end_marker=None):
+        """ Follows marker pagination of an account or container listing and
+            yields the raw listing entries. See utils.iter_pages()
+
+        @param path: path to list
+        @param params: extra query parameters (prefix, delimiter, ...)
+        @param marker: start listing after this name
+        @param end_marker: stop listing before this name
+        @param headers: extra headers to use when making the listing calls
+        @param page_size: number of entries to request per page, at most
+            listing_limit
+        @param prefetch: fetch the next page in the background
+        @raises ResponseError
+        @return: generator of dicts
+        """
+        # a page shorter than requested is taken as the last one, so never
+        # ask for more than the server will return
+        page_size = min(page_size, self.listing_limit)
+
+        def _formatter(res):
+            for item in iter_json_response(res):
+                yield item.get('name') or item.get('subdir'), item
+
+        def _fetch_page(marker):
+            _params = {'format': 'json', 'limit': page_size}
+            _params.update(params or {})
+            if marker:
+                _params['marker'] = marker
+            if end_marker:
+                _params['end_marker'] = end_marker
+            return self.make_request('GET', path,
+                                     params=_params,
+                                     headers=headers,
+                                     formatter=_formatter,
+                                     stream=True)
+        return iter_pages(_fetch_page, marker=marker, page_size=page_size,
+                          prefetch=prefetch)
+
+    def iter_listing_partitioned(self, path, params=None, marker=None,
+                                 headers=None, page_size=10000,
+                                 partitions=None, workers=consts.WORKERS):
+        """ Lists a container by splitting its keyspace into ranges that are
+            listed concurrently. Yields the same entries, in the same order,
+            as iter_listing().
+
+            The first page is listed on its own. If there's more, the last
+            name is found with a reverse listing and the names in between
+            are split into ranges with utils.split_keyspace(), using the
+            names of the first page as a sample. Each range is listed with
+            marker/end_marker; up to `workers` ranges are listed ahead, each
+            holding at most two pages in memory.
+
+        @param path: path to list
+        @param params: extra query parameters (prefix, delimiter, ...)
+        @param marker: start listing after this name
+        @param headers: extra headers to use when making the listing calls
+        @param page_size: number of entries to request per page
+        @param partitions: number of ranges; defaults to 4 * workers
+        @param workers: number of ranges listed in parallel
+        @raises ResponseError
+        @return: generator of dicts
+        """
+        def _name(item):
+            return item.get('name') or item.get('subdir')
+
+        page_size = min(page_size, self.listing_limit)
+        sample = list(islice(self.iter_listing(path, params=params,
+                                               marker=marker,
+                                               headers=headers,
+                                               page_size=page_size,
+                                               prefetch=False), page_size))
+        for item in sample:
+            yield item
+        if len(sample) < page_size:
+            return
+
+        low = _name(sample[-1])
+        high = self._last_name(path, params, headers) or u''
+        if high <= low:
+            high = u'~'
+        points = split_keyspace(low, high, partitions or 4 * workers,
+                                sample=[_name(item) for item in sample])
+        del sample
+
+        # (marker, end_marker) pairs; names can't contain NUL, so an
+        # end_marker of name + '\x01' includes name itself.
+        ranges = zip([low] + points,
+                     [point + u'\x01' for point in points] + [None])
+
+        def _pages(bounds):
+            listing = self.iter_listing(path, params=params,
+                                        marker=bounds[0],
+                                        end_marker=bounds[1],
+                                        headers=headers,
+                                        page_size=page_size,
+                                        prefetch=False)
+            while True:
+                page = list(islice(listing, page_size))
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    return
+
+        for page in concurrent_chain(_pages, ranges, workers=workers):
+            for item in page:
+                yield item
+
+    def _last_name(self, path, params=None, headers=None):
+        """ Returns the last name of a listing using a reverse listing, or
+            None """
+        _params = {'format': 'json', 'limit': 1, 'reverse': 'true'}
+        _params.update(params or {})
+
+        def _formatter(res):
+            for item in iter_json_response(res):
+                return item.get('name') or item.get('subdir')
+        return self.make_request('GET', path, params=_params,
+                                 headers=headers, formatter=_formatter)
 
     def public_containers(self, *args, **kwargs):
         """ Lists public containers. Same interface as self.containers()
@@ -327,6 +484,34 @@ class Client(object):
         """
         return self.storage_object(container, name).load()
 
+    def get_objects(self, pairs, workers=consts.WORKERS, ordered=True):
+        """ Loads many objects concurrently
+
+        @param pairs: iterable of (container, name) pairs
+        @param workers: number of parallel HEAD requests
+        @param ordered: yield results in input order instead of as they
+            complete
+        @return: generator of ((container, name), storage_object, error)
+            tuples. Errors are reported per object; one failure does not
+            stop the rest of the batch.
+        """
+        def _load(pair):
+            return self.get_object(*pair)
+        return concurrent_map(_load, pairs, workers=workers, ordered=ordered)
+
+    def read_objects(self, pairs, workers=consts.WORKERS, ordered=True):
+        """ Reads the content of many objects concurrently
+
+        @param pairs: iterable of (container, name) pairs
+        @param workers: number of parallel GET requests
+        @param ordered: yield results in input order instead of as they
+            complete
+        @return: generator of ((container, name), data, error) tuples
+        """
+        def _read(pair):
+            return self.storage_object(*pair).read()
+        return concurrent_map(_read, pairs, workers=workers, ordered=ordered)
+
     def delete_object(self, container, name):
         """ Delete an object from swift
 
@@ -334,8 +519,181 @@ class Client(object):
         @param name: object name
         @raises ResponseError
         """
-        return self.make_request('DELETE', [container, name],
-                                 formatter=lambda r: True)
+        try:
+            result = self.make_request('DELETE', [container, name],
+                                       formatter=lambda r: True)
+        except errors.NotFound:
+            self._index_remove(container, name)
+            raise
+        finally:
+            self._invalidate((container, name))
+        self._index_remove(container, name)
+        return result
+
+    def container_index(self, name, path=':memory:'):
+        """ Returns a local index of a container's listing, kept up to date
+            with the objects written and deleted through this client. Call
+            refresh() on it to fill it in.
+
+        @param name: container name
+        @param path: SQLite database file for the index
+        @return: `object_storage.index.ContainerIndex` instance
+        """
+        index = self.indexes.get(name)
+        if index is None or index.path != path:
+            index = ContainerIndex(self, name, path=path)
+            self.indexes[name] = index
+        return index
+
+    def _index_add(self, container, name, model):
+        """ Records an uploaded object in the container's index """
+        index = self.indexes.get(container)
+        if index is not None:
+            index.add(name, model['size'], hash=model['hash'],
+                      last_modified=model['last_modified'],
+                      content_type=model['content_type'])
+
+    def _index_remove(self, container, name):
+        """ Drops a deleted object from the container's index """
+        index = self.indexes.get(container)
+        if index is not None:
+            index.remove(name)
+
+    def _index_bulk_delete(self, container, names, result):
+        """ Drops the objects of a bulk delete that didn't fail from the
+            container's index """
+        if not result or container not in self.indexes:
+            return
+        failed = set(path for path, _ in result['errors'])
+        for name in names:
+            if '/%s' % (get_path([container, name]), ) not in failed:
+                self._index_remove(container, name)
+
+    def _invalidate(self, key):
+        """ Drops a container or object from the metadata and content
+            caches """
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(key)
+        if self.content_cache is not None and len(key) == 2:
+            self.content_cache.invalidate(*key)
+
+    def delete_objects(self, container, names, bulk=True,
+                       workers=consts.WORKERS):
+        """ Deletes many objects from a container
+
+        Names are sent to the bulk delete middleware in batches of
+        bulk_delete_size. If the middleware isn't available, objects are
+        deleted with parallel DELETE requests instead.
+
+        @param container: container name
+        @param names: iterable of object names
+        @param bulk: try the bulk delete middleware first
+        @param workers: number of requests to run at the same time
+        @raises ResponseError
+        @return: dict with the number of objects 'deleted' and 'not_found'
+            and a list of (name, reason) 'errors'
+        """
+        summary = {'deleted': 0, 'not_found': 0, 'errors': []}
+        names = iter(names)
+
+        def _batches():
+            while True:
+                batch = list(islice(names, self.bulk_delete_size))
+                if not batch:
+                    return
+                yield batch
+
+        def _bulk_delete(batch):
+            result = self._bulk_delete(container, batch)
+            for name in batch:
+                self._invalidate((container, name))
+            self._index_bulk_delete(container, batch, result)
+            if result is None:
+                return self.delete_objects(container, batch, bulk=False,
+                                           workers=workers)
+            return result
+
+        def _delete(name):
+            try:
+                self.delete_object(container, name)
+            except errors.NotFound:
+                return 'not_found'
+            return 'deleted'
+
+        def _merge(result):
+            summary['deleted'] += result['deleted']
+            summary['not_found'] += result['not_found']
+            summary['errors'].extend(result['errors'])
+
+        if bulk:
+            batch = list(islice(names, self.bulk_delete_size))
+            result = batch and self._bulk_delete(container, batch)
+            for name in batch:
+                self._invalidate((container, name))
+            self._index_bulk_delete(container, batch, result)
+            if result is None:
+                names = chain(batch, names)
+            else:
+                if result:
+                    _merge(result)
+                for batch, result, error in concurrent_map(
+                        _bulk_delete, _batches(), workers=workers,
+                        ordered=False):
+                    if error:
+                        raise error
+                    _merge(result)
+                return summary
+
+        for name, result, error in concurrent_map(_delete, names,
+                                                  workers=workers,
+                                                  ordered=False):
+            if isinstance(error, errors.ResponseError):
+                summary['errors'].append((name, str(error)))
+            elif error:
+                raise error
+            else:
+                summary[result] += 1
+        return summary
+
+    def _bulk_delete(self, container, names):
+        """ Deletes up to bulk_delete_size objects with one request
+
+        @return: dict in the format of delete_objects() or None if the bulk
+            delete middleware isn't available
+        @raises ResponseError for other failures
+        """
+        body = '\n'.join('/%s' % (get_path([container, name]), )
+                         for name in names)
+        headers = {'Content-Type': 'text/plain',
+                   'Accept': 'application/json'}
+
+        def _formatter(res):
+            try:
+                result = json.loads(
+                    res.content if isinstance(res.content, six.string_types)
+                    else res.content.decode('utf8'))
+            except ValueError:
+                return None
+            if not isinstance(result, dict) or \
+                    'Number Deleted' not in result:
+                return None
+            _errors = [tuple(error) for error in result.get('Errors', [])]
+            status = result.get('Response Status', '')
+            if not _errors and not status.startswith('2'):
+                _errors.append(('', status))
+            return {'deleted': int(result['Number Deleted']),
+                    'not_found': int(result.get('Number Not Found', 0)),
+                    'errors': _errors}
+        try:
+            return self.make_request('POST', params={'bulk-delete': ''},
+                                     headers=headers, data=body,
+                                     formatter=_formatter)
+        except errors.NotFound:
+            return None
+        except errors.ResponseError as ex:
+            if ex.status in (404, 405):
+                return None
+            raise
 
     def get_url(self, path=None):
         """ Returns the url of the resource
@@ -344,6 +702,9 @@ class Client(object):
         """
         url = self.storage_url
         if not url:
+            if self.conn.storage_url is None:
+                # lazy connections authenticate on first use
+                self.conn.ensure_authenticated()
             self.storage_url = self.conn.storage_url
             url = self.storage_url
         if path:
@@ -370,7 +731,8 @@ class Client(object):
         @raises ResponseError
         """
         url = self.get_url(path)
-        return self.conn.chunk_download(url, chunk_size=chunk_size)
+        return self.conn.chunk_download(url, chunk_size=chunk_size,
+                                        headers=headers)
 
     def chunk_upload(self, path, size=None, headers=None):
         """ Returns a chunkable connection object at the given path
@@ -388,7 +750,5 @@ class Client(object):
         return self.container(name)
 
     def __iter__(self):
-        """ Returns an interator based on results of self.containers() """
-        listing = self.containers()
-        for obj in listing:
-            yield obj
+        """ Returns an interator based on results of self.iter_containers() """
+        return self.iter_containers()
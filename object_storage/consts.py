@@ -9,6 +9,11 @@ __version__ = "0.5.4"
 
 USER_AGENT = "sl-object-storage-python/%s" % __version__
 
+# Defaults for parallel transfers
+WORKERS = 4
+SEGMENT_SIZE = 100 * 1024 * 1024
+RANGE_SIZE = 16 * 1024 * 1024
+
 DATACENTERS = [
     'ams01',  # NL - North Holland - Amsterdam
     'che01',  # IN - Tamil Nadu - Chennai
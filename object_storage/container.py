@@ -4,12 +4,13 @@
     See COPYING for license information
 """
 import os
-import six
 
-from object_storage.utils import json, Model
+from object_storage.utils import Model
+from object_storage import consts
 from object_storage import errors
-from object_storage.storage_object import StorageObject
-from object_storage.utils import get_path
+from object_storage.storage_object import StorageObject, listing_object
+from object_storage.utils import get_path, iter_json_response, \
+    concurrent_map, file_md5, listing_time
 
 
 class ContainerModel(Model):
@@ -84,6 +85,13 @@ class Container:
         @raises ResponseError
         @return: boolean, true if exists else false
         """
+        if self.client.metadata_cache is not None:
+            try:
+                self.load()
+                return True
+            except errors.NotFound:
+                return False
+
         def _formatter(res):
             self.model = ContainerModel(self, self.name, res.headers)
             return True
@@ -101,12 +109,24 @@ class Container:
         headers = {}
         if cdn:
             headers.setdefault('X-Context', 'cdn')
+        elif self.client.metadata_cache is not None:
+            headers = self.client.metadata_cache.fetch((self.name, ),
+                                                       self._head)
+            self.model = ContainerModel(self, self.name, headers)
+            return self
 
         def _formatter(res):
             self.model = ContainerModel(self, self.name, res.headers)
             return self
         return self.make_request('HEAD', headers=headers, formatter=_formatter)
 
+    def _head(self, headers):
+        """ HEAD request for the metadata cache """
+        def _formatter(res):
+            return res.status_code, dict((k.lower(), v)
+                                         for k, v in res.headers.items())
+        return self.make_request('HEAD', headers=headers, formatter=_formatter)
+
     def get_info(self):
         """ loads data if not already available and returns the properties """
         if not self.model:
@@ -184,15 +204,19 @@ class Container:
         """
         return self.client.delete_container(self.name, recursive=recursive)
 
-    def delete_all_objects(self):
-        """ Deletes all objects in the container
+    def delete_all_objects(self, bulk=True, workers=consts.WORKERS):
+        """ Deletes all objects in the container, following the listing
+            across all pages. See Client.delete_objects()
 
+        @param bulk: use the bulk delete middleware if it's available
+        @param workers: number of requests to run at the same time
         @raises ResponseError
+        @return: dict with the number of objects 'deleted' and 'not_found'
+            and a list of (name, reason) 'errors'
         """
-        resps = []
-        for item in self.objects():
-            resps.append(item.delete())
-        return resps
+        names = (obj.name for obj in self.iter_objects())
+        return self.client.delete_objects(self.name, names,
+                                          bulk=bulk, workers=workers)
 
     def delete_object(self, obj):
         """ Deletes an object in the container
@@ -233,23 +257,196 @@ class Container:
             params['marker'] = marker
 
         def _formatter(res):
-            objects = {}
-            if res.content:
-                items = json.loads(res.content if isinstance(res.content, six.string_types) else res.content.decode('utf8'))
-                for item in items:
-                    if 'name' in item:
-                        objects[item['name']] = self.storage_object(
-                            item['name'], item)
-                    elif 'subdir' in item:
-                        item['name'] = item['subdir'].rstrip('/')
-                        item['content_type'] = 'application/directory'
-                        objects[item['name']] = self.storage_object(
-                            item['name'], item)
-            return objects.values()
+            objects = []
+            for item in iter_json_response(res):
+                objects.append(self._listing_object(item))
+            return objects
         return self.make_request('GET',
                                  params=params,
                                  headers=headers,
-                                 formatter=_formatter)
+                                 formatter=_formatter,
+                                 stream=True)
+
+    def iter_objects(self, marker=None, prefix=None, base_only=False,
+                     headers=None, page_size=10000, prefetch=True,
+                     partitions=None, workers=consts.WORKERS):
+        """ Lazily lists all objects in the container, following the listing
+            across pages in the order returned by the server.
+
+        @param marker: start listing after this object name
+        @param prefix: only list objects starting with this prefix
+        @param base_only: only return the base objects.
+            container/object not container/dir/object
+        @param headers: extra headers to use in the requests
+        @param page_size: number of objects to request per page
+        @param prefetch: fetch the next page in the background
+        @param partitions: list the container as this many key ranges in
+            parallel. See Client.iter_listing_partitioned()
+        @param workers: number of ranges listed in parallel
+        @raises ResponseError
+        @return: generator of StorageObject instances
+        """
+        params = {}
+        if base_only:
+            params['delimiter'] = self.client.delimiter
+        if prefix:
+            params['prefix'] = prefix
+        if partitions:
+            items = self.client.iter_listing_partitioned(
+                [self.name], params=params, marker=marker, headers=headers,
+                page_size=page_size, partitions=partitions, workers=workers)
+        else:
+            items = self.client.iter_listing([self.name], params=params,
+                                             marker=marker, headers=headers,
+                                             page_size=page_size,
+                                             prefetch=prefetch)
+        for item in items:
+            yield self._listing_object(item)
+
+    def _listing_object(self, item):
+        """ Makes a StorageObject from a listing entry """
+        return listing_object(self.client, self.name, item)
+
+    def walk(self, prefix=None, workers=consts.WORKERS, max_depth=None,
+             prune=None, page_size=10000):
+        """ Walks the pseudo-directory tree like os.walk(), one level at a
+            time, listing the directories of a level concurrently.
+
+            Yields (dirpath, dirnames, objects) tuples top-down. As with
+            os.walk(), removing names from dirnames keeps walk() from
+            descending into them.
+
+        @param prefix: directory to start from; defaults to the container root
+        @param workers: number of directories listed in parallel
+        @param max_depth: number of levels to descend below prefix; None
+            walks the whole tree
+        @param prune: callable that gets a directory path and returns True
+            to skip it
+        @param page_size: number of entries to request per listing page
+        @raises ResponseError
+        @return: generator of (dirpath, dirnames, objects) tuples
+        """
+        delimiter = self.client.delimiter
+
+        def _list(dirpath):
+            params = {'delimiter': delimiter}
+            if dirpath:
+                params['prefix'] = dirpath + delimiter
+            dirnames, objects = [], []
+            start = len(params.get('prefix', ''))
+            for item in self.client.iter_listing([self.name], params=params,
+                                                 page_size=page_size,
+                                                 prefetch=False):
+                if 'subdir' in item:
+                    dirnames.append(item['subdir'][start:].rstrip(delimiter))
+                else:
+                    objects.append(self._listing_object(item))
+            return dirnames, objects
+
+        level = [(prefix or '').rstrip(delimiter)]
+        depth = 0
+        while level:
+            walked = []
+            for dirpath, result, error in concurrent_map(_list, level,
+                                                         workers=workers):
+                if error:
+                    raise error
+                dirnames, objects = result
+                yield dirpath, dirnames, objects
+                walked.append((dirpath, dirnames))
+
+            depth += 1
+            if max_depth is not None and depth > max_depth:
+                break
+            level = []
+            for dirpath, dirnames in walked:
+                for dirname in dirnames:
+                    path = delimiter.join([dirpath, dirname]) \
+                        if dirpath else dirname
+                    if prune is None or not prune(path):
+                        level.append(path)
+
+    def download_prefix(self, prefix, dest, workers=consts.WORKERS,
+                        set_mtime=False):
+        """ Mirrors the objects under a prefix to a local directory. Only
+            objects whose size or ETag differ from the local file are
+            downloaded.
+
+            Each object is written to a temporary file next to its
+            destination and renamed into place once complete, so a local
+            file is never left half-written.
+
+        @param prefix: object name prefix; an object named <prefix>a/b is
+            saved as <dest>/a/b
+        @param dest: local directory
+        @param workers: number of downloads to run at the same time
+        @param set_mtime: set the mtime of downloaded files to the object's
+            last_modified
+        @raises ResponseError
+        @return: dict with the 'downloaded' and 'skipped' names and a list
+            of (name, reason) 'errors'. Objects whose names would resolve
+            outside of dest are not downloaded and reported as errors.
+        """
+        summary = {'downloaded': [], 'skipped': [], 'errors': []}
+        hash_cache = self.client.hash_cache
+        root = os.path.realpath(dest)
+        changed = []
+        for obj in self.iter_objects(prefix=prefix):
+            relative = obj.name[len(prefix or ''):].lstrip('/')
+            if not relative:
+                continue
+            filename = os.path.normpath(
+                os.path.join(dest, *relative.split('/')))
+            real = os.path.realpath(filename)
+            if real == root or not real.startswith(root + os.sep):
+                # names with '..' components would be written outside dest
+                summary['errors'].append((obj.name, 'unsafe path'))
+                continue
+            if obj.model['content_type'] == 'application/directory' or \
+                    obj.name.endswith('/'):
+                if not os.path.isdir(filename):
+                    os.makedirs(filename)
+                continue
+            if os.path.isfile(filename) and \
+                    os.path.getsize(filename) == obj.model['size'] and \
+                    file_md5(filename, hash_cache) == \
+                    (obj.model['hash'] or '').strip('"'):
+                summary['skipped'].append(obj.name)
+            else:
+                changed.append((obj, filename))
+
+        def _download(item):
+            obj, filename = item
+            directory = os.path.dirname(filename)
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            tmp = os.path.join(directory, '.%s.%d.part' % (
+                os.path.basename(filename), os.getpid()))
+            try:
+                obj.save_to_filename(tmp)
+                if set_mtime and obj.model['last_modified']:
+                    mtime = listing_time(obj.model['last_modified'])
+                    os.utime(tmp, (mtime, mtime))
+                os.rename(tmp, filename)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+        for item, result, error in concurrent_map(_download, changed,
+                                                  workers=workers,
+                                                  ordered=False):
+            if isinstance(error, (errors.ResponseError, IOError, OSError)):
+                summary['errors'].append((item[0].name, str(error)))
+            elif error:
+                raise error
+            else:
+                summary['downloaded'].append(item[0].name)
+        return summary
 
     def set_ttl(self, ttl):
         """ Set time to live for CDN
@@ -322,7 +519,12 @@ class Container:
     def make_request(self, method, path=None, *args, **kwargs):
         """ Makes a request on the resource. """
         path = [self.name]
-        return self.client.make_request(method, path, *args, **kwargs)
+        if method in ('GET', 'HEAD') or self.client.metadata_cache is None:
+            return self.client.make_request(method, path, *args, **kwargs)
+        try:
+            return self.client.make_request(method, path, *args, **kwargs)
+        finally:
+            self.client.metadata_cache.invalidate((self.name, ))
 
     def __getitem__(self, name):
         """ Returns object corresponding to the given name """
@@ -335,7 +537,5 @@ class Container:
         return 'Container(%s)' % (self.name.encode("utf-8"), )
 
     def __iter__(self):
-        """ Returns an interator based on results of self.objects() """
-        listing = self.objects()
-        for obj in listing:
-            yield obj
+        """ Returns an interator based on results of self.iter_objects() """
+        return self.iter_objects()
@@ -47,6 +47,11 @@ class ContainerNotFound(NotFound):
     pass
 
 
+class ChecksumMismatch(ObjectStorageError):
+    """ Uploaded data doesn't match the ETag returned by the server """
+    pass
+
+
 class ResponseError(ObjectStorageError):
     """ Response error """
     def __init__(self, status, reason):
@@ -0,0 +1,209 @@
+"""
+    Local index of container listings
+
+    See COPYING for license information
+"""
+import sqlite3
+import threading
+import time
+from email.utils import parsedate
+
+import six
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    container TEXT NOT NULL,
+    name TEXT NOT NULL,
+    bytes INTEGER,
+    hash TEXT,
+    last_modified TEXT,
+    content_type TEXT,
+    PRIMARY KEY (container, name)
+);
+CREATE TABLE IF NOT EXISTS markers (
+    container TEXT PRIMARY KEY,
+    marker TEXT
+);
+"""
+
+_COLUMNS = ('name', 'bytes', 'hash', 'last_modified', 'content_type')
+
+
+def _listing_date(value):
+    """ Converts a Last-Modified header to the format used in listings """
+    parsed = parsedate(value) if value else None
+    if parsed is None:
+        parsed = time.gmtime()
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000', parsed)
+
+
+def _prefix_end(prefix):
+    """ Returns the smallest string greater than every string starting with
+        prefix, or None """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10ffff:
+            # skip the surrogates, which can't be encoded
+            last = 0xe000 if 0xd800 <= last + 1 < 0xe000 else last + 1
+            return prefix[:-1] + six.unichr(last)
+        prefix = prefix[:-1]
+    return None
+
+
+class ContainerIndex(object):
+    """
+        Listing entries of a container (name, bytes, hash, last_modified and
+        content_type) kept in a SQLite database so that prefix, size and
+        glob queries don't need a listing request.
+
+        refresh() lists the container from the last name it has seen, so it
+        picks up new objects that sort after it. Objects written or deleted
+        through the client that owns the index are updated as they happen;
+        use refresh(full=True) to catch up on other changes.
+    """
+    def __init__(self, client, container, path=':memory:'):
+        """ constructor for ContainerIndex
+
+        @param client: `object_storage.client` instance
+        @param container: container name
+        @param path: SQLite database file; several containers can share one
+        """
+        self.client = client
+        self.container = container
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+
+    def refresh(self, full=False, page_size=10000):
+        """ Adds the objects listed after the last indexed name
+
+        @param full: drop the index and list the whole container again
+        @param page_size: number of objects to request per page
+        @raises ResponseError
+        @return: number of entries added
+        """
+        marker = None
+        if full:
+            self.clear()
+        else:
+            marker = self.marker()
+
+        count = 0
+        batch = []
+        listing = self.client.iter_listing([self.container], marker=marker,
+                                           page_size=page_size)
+        for item in listing:
+            if 'name' not in item:
+                continue
+            batch.append(item)
+            if len(batch) >= page_size:
+                count += self._add(batch)
+                batch = []
+        if batch:
+            count += self._add(batch)
+        return count
+
+    def _add(self, items):
+        rows = [(self.container, item['name'], int(item.get('bytes') or 0),
+                 item.get('hash'), item.get('last_modified'),
+                 item.get('content_type')) for item in items]
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                    rows)
+                self.db.execute(
+                    'INSERT OR REPLACE INTO markers VALUES (?, ?)',
+                    (self.container, max(items[-1]['name'],
+                                         self.marker() or u'')))
+        return len(rows)
+
+    def marker(self):
+        """ Returns the last name listed by refresh() """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT marker FROM markers WHERE container = ?',
+                (self.container, )).fetchone()
+        return row[0] if row else None
+
+    def add(self, name, size, hash=None, last_modified=None,
+            content_type=None):
+        """ Adds or replaces a single entry, e.g. after an upload """
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                    (self.container, name, size, hash,
+                     _listing_date(last_modified), content_type))
+
+    def remove(self, name):
+        """ Removes an entry, e.g. after a delete """
+        with self.lock:
+            with self.db:
+                self.db.execute(
+                    'DELETE FROM objects WHERE container = ? AND name = ?',
+                    (self.container, name))
+
+    def clear(self):
+        """ Removes every entry of the container """
+        with self.lock:
+            with self.db:
+                self.db.execute('DELETE FROM objects WHERE container = ?',
+                                (self.container, ))
+                self.db.execute('DELETE FROM markers WHERE container = ?',
+                                (self.container, ))
+
+    def _where(self, prefix=None, min_size=None, max_size=None, glob=None):
+        clauses = ['container = ?']
+        args = [self.container]
+        if prefix:
+            clauses.append('name >= ?')
+            args.append(prefix)
+            end = _prefix_end(prefix)
+            if end is not None:
+                clauses.append('name < ?')
+                args.append(end)
+        if min_size is not None:
+            clauses.append('bytes >= ?')
+            args.append(min_size)
+        if max_size is not None:
+            clauses.append('bytes <= ?')
+            args.append(max_size)
+        if glob:
+            clauses.append('name GLOB ?')
+            args.append(glob)
+        return ' AND '.join(clauses), args
+
+    def query(self, prefix=None, min_size=None, max_size=None, glob=None):
+        """ Returns the indexed listing entries matching all of the given
+            conditions, ordered by name
+
+        @param prefix: names starting with prefix
+        @param min_size: objects of at least this many bytes
+        @param max_size: objects of at most this many bytes
+        @param glob: names matching a SQLite GLOB pattern ('logs/*.gz')
+        @return: list of listing dicts
+        """
+        where, args = self._where(prefix, min_size, max_size, glob)
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT %s FROM objects WHERE %s ORDER BY name' %
+                (', '.join(_COLUMNS), where), args).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def stats(self, prefix=None, min_size=None, max_size=None, glob=None):
+        """ Returns the number of matching objects and their total size.
+            Takes the same arguments as query()
+
+        @return: dict with 'count' and 'bytes'
+        """
+        where, args = self._where(prefix, min_size, max_size, glob)
+        with self.lock:
+            count, size = self.db.execute(
+                'SELECT COUNT(*), SUM(bytes) FROM objects WHERE %s' % where,
+                args).fetchone()
+        return {'count': count, 'bytes': size or 0}
+
+    def close(self):
+        self.db.close()
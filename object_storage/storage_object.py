@@ -7,8 +7,8 @@ from object_storage.utils import json, Model
 import mimetypes
 import os
 import six
+import time
 import logging
-from io import IOBase
 try:
     import StringIO
 except ImportError:
@@ -18,12 +18,97 @@ try:
 except ImportError:
     from md5 import md5
 
+from object_storage import consts
 from object_storage import errors
-from object_storage.utils import get_path
+from object_storage.utils import get_path, concurrent_map, pwrite, \
+    preallocate, iter_json_response, listing_time, file_md5
+from six.moves.urllib.parse import unquote
 
 logger = logging.getLogger(__name__)
 
 
+def _json_formatter(res):
+    """ Parses a JSON response body """
+    if not res.content:
+        return []
+    return json.loads(res.content if isinstance(res.content, six.string_types)
+                      else res.content.decode('utf8'))
+
+
+def _merge_ranges(ranges):
+    """ Merges overlapping or adjacent [offset, length] ranges """
+    merged = []
+    for offset, length in sorted(ranges):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            end = max(merged[-1][0] + merged[-1][1], offset + length)
+            merged[-1][1] = end - merged[-1][0]
+        else:
+            merged.append([offset, length])
+    return merged
+
+
+def _missing_parts(parts, completed):
+    """ Cuts the completed [offset, length] ranges out of the download parts
+        returned by StorageObject._ranges() """
+    missing = []
+    for offset, path, start, length in parts:
+        end = offset + length
+        for done_offset, done_length in completed:
+            done_end = done_offset + done_length
+            if done_end <= offset or done_offset >= end:
+                continue
+            if done_offset > offset:
+                missing.append((offset, path, start, done_offset - offset))
+            start += max(done_end, offset) - offset
+            offset = max(done_end, offset)
+            if offset >= end:
+                break
+        if offset < end:
+            missing.append((offset, path, start, end - offset))
+    return missing
+
+
+def _load_checkpoint(filename):
+    """ Returns the contents of a download checkpoint, if there is one """
+    try:
+        f = open(filename, 'r')
+    except IOError:
+        return None
+    try:
+        return json.load(f)
+    except ValueError:
+        return None
+    finally:
+        f.close()
+
+
+def _save_checkpoint(filename, state):
+    """ Atomically replaces a download checkpoint """
+    tmp = '%s.tmp' % (filename, )
+    f = open(tmp, 'w')
+    try:
+        json.dump(state, f)
+    finally:
+        f.close()
+    os.rename(tmp, filename)
+
+
+def _file_changed(filename, item, hash_cache=None):
+    """ Returns True if a local file differs from its listing entry. Files
+        of the same size are unchanged if the object was last modified after
+        the file or if their MD5 matches the object's ETag """
+    if item is None:
+        return True
+    stat = os.stat(filename)
+    if stat.st_size != int(item.get('bytes') or 0):
+        return True
+    if item.get('last_modified') and \
+            stat.st_mtime <= listing_time(item['last_modified']):
+        return False
+    return file_md5(filename, hash_cache) != \
+        (item.get('hash') or '').strip('"')
+
+
 class StorageObjectModel(Model):
     def __init__(self, controller, container, name, headers={}):
         self.container = container
@@ -48,7 +133,8 @@ class StorageObjectModel(Model):
                                         self.headers.get('last-modified'))
         _properties['hash'] = (self.headers.get('etag') or
                                self.headers.get('hash'))
-        _properties['manifest'] = self.headers.get('manifest')
+        _properties['manifest'] = (self.headers.get('manifest') or
+                                   self.headers.get('x-object-manifest'))
         _properties['content_encoding'] = (
             self.headers.get('content_encoding') or
             self.headers.get('content-encoding'))
@@ -77,11 +163,98 @@ class StorageObjectModel(Model):
     def __iter__(self):
         return iter(self.properties)
 
+
+class ListingModel(Model):
+    """
+        Compact model for an entry of a container listing. The raw listing
+        entry is kept as-is and properties (including url, path and meta)
+        are only computed when they are accessed. Instances are slotted on
+        Python 3; Python 2's DictMixin is an old-style class, so they keep
+        a __dict__ there.
+    """
+    __slots__ = ('controller', 'container', 'name', 'headers',
+                 '_properties', '_meta')
+
+    _getters = {
+        'container': lambda m: m.container,
+        'name': lambda m: m.name,
+        'size': lambda m: int(m.headers.get('bytes') or
+                              m.headers.get('size') or 0),
+        'content_type': lambda m: m.headers.get('content_type'),
+        'last_modified': lambda m: m.headers.get('last_modified'),
+        'hash': lambda m: m.headers.get('hash'),
+        'manifest': lambda m: m.headers.get('manifest'),
+        'content_encoding': lambda m: m.headers.get('content_encoding'),
+        'cache_control': lambda m: m.headers.get('cache-control'),
+        'cdn_url': lambda m: m.headers.get('x-cdn-url'),
+        'cdn_ssl_url': lambda m: m.headers.get('x-cdn-ssl-url'),
+        'path': lambda m: m.controller.path,
+        'url': lambda m: m.controller.url,
+        'meta': lambda m: m.meta,
+    }
+
+    def __init__(self, controller, container, name, item):
+        self.controller = controller
+        self.container = container
+        self.name = name
+        # Listing keys are already lowercase
+        self.headers = item
+        self._properties = None
+        self._meta = None
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            meta = {}
+            for key, value in self.headers.items():
+                if key.startswith('meta_'):
+                    meta[key[5:]] = value
+            self._meta = meta
+        return self._meta
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = dict((key, getter(self))
+                                    for key, getter in self._getters.items())
+        return self._properties
+    data = properties
+
+    def __getitem__(self, key):
+        if self._properties is not None:
+            return self._properties[key]
+        if key not in self._getters:
+            raise KeyError(key)
+        return self._getters[key](self)
+
+    def keys(self):
+        return self._getters.keys()
+
+    def __len__(self):
+        return len(self._getters)
+
+    def __iter__(self):
+        return iter(self._getters)
+
+
+def listing_object(client, container, item):
+    """ Makes a StorageObject with a compact ListingModel from an entry of a
+        container listing """
+    if 'name' not in item and 'subdir' in item:
+        item['name'] = item['subdir'].rstrip('/')
+        item['content_type'] = 'application/directory'
+    obj = client.storage_object(container, item['name'])
+    obj.model = ListingModel(obj, container, item['name'], item)
+    return obj
+
+
 class StorageObject:
     """
         Representation of a Object Storage object.
     """
     chunk_size = 10 * 1024
+    segment_size = consts.SEGMENT_SIZE
+    range_size = consts.RANGE_SIZE
 
     def __init__(self, container, name, headers=None, client=None):
         """ constructor for StorageObject
@@ -106,6 +279,13 @@ class StorageObject:
         @raises ResponseError
         @return: boolean, true if exists else false
         """
+        if self.client.metadata_cache is not None:
+            try:
+                self.load()
+                return True
+            except errors.NotFound:
+                return False
+
         def _formatter(res):
             self.model = StorageObjectModel(
                 self, self.container, self.name, res.headers)
@@ -124,6 +304,12 @@ class StorageObject:
         headers = {}
         if cdn:
             headers.setdefault('X-Context', 'cdn')
+        elif self.client.metadata_cache is not None:
+            headers = self.client.metadata_cache.fetch(
+                (self.container, self.name), self._head)
+            self.model = StorageObjectModel(
+                self, self.container, self.name, headers)
+            return self
 
         def _formatter(res):
             self.model = StorageObjectModel(
@@ -131,6 +317,21 @@ class StorageObject:
             return self
         return self.make_request('HEAD', headers=headers, formatter=_formatter)
 
+    def _head(self, headers):
+        """ HEAD request for the metadata cache """
+        def _formatter(res):
+            return res.status_code, dict((k.lower(), v)
+                                         for k, v in res.headers.items())
+        return self.make_request('HEAD', headers=headers, formatter=_formatter)
+
+    def _invalidate(self):
+        """ Drops this object from the metadata and content caches after a
+            write """
+        if self.client.metadata_cache is not None:
+            self.client.metadata_cache.invalidate((self.container, self.name))
+        if self.client.content_cache is not None:
+            self.client.content_cache.invalidate(self.container, self.name)
+
     def get_info(self):
         """ loads data if not already available and returns the properties """
         if not self.model:
@@ -189,28 +390,47 @@ class StorageObject:
             params['marker'] = marker
 
         def _formatter(res):
-            objects = {}
-            if res.content:
-                items = json.loads(res.content if isinstance(res.content, six.string_types) else res.content.decode('utf8'))
-                for item in items:
-                    if 'name' in item:
-                        objects[item['name']] = self.client.storage_object(
-                            self.container, item['name'], headers=item)
-                    elif 'subdir' in item:
-                        name = item['subdir'].rstrip('/')
-                        item['name'] = name
-                        item['content_type'] = 'application/directory'
-                        objects[item['name']] = self.client.storage_object(
-                            self.container, item['name'], headers=item)
-            return objects.values()
+            objects = []
+            for item in iter_json_response(res):
+                objects.append(self._listing_object(item))
+            return objects
         return self.client.make_request('GET', [self.container],
                                         params=params,
-                                        formatter=_formatter)
+                                        formatter=_formatter,
+                                        stream=True)
+
+    def iter_list(self, marker=None, base_only=False, page_size=10000,
+                  prefetch=True):
+        """ Lazily lists all children objects using the sudo-hierarchical
+            structure, following the listing across pages in the order
+            returned by the server.
+
+        @param marker: start listing after this object name
+        @param base_only: only return the direct children
+        @param page_size: number of objects to request per page
+        @param prefetch: fetch the next page in the background
+        @raises ResponseError
+        @return: generator of StorageObject instances
+        """
+        params = {'prefix': self.name + self.client.delimiter}
+        if base_only:
+            params['delimiter'] = self.client.delimiter
+        for item in self.client.iter_listing([self.container], params=params,
+                                             marker=marker,
+                                             page_size=page_size,
+                                             prefetch=prefetch):
+            yield self._listing_object(item)
+
+    def _listing_object(self, item):
+        """ Makes a StorageObject from a listing entry """
+        return listing_object(self.client, self.container, item)
 
     def is_dir(self):
         """ returns True if content_type is 'text/directory' or
             'application/directory' """
-        return self.properties['content_type'] in ['text/directory',
+        if not self.model:
+            self.load()
+        return self.model['content_type'] in ['text/directory',
                                               'application/directory']
 
     def update(self, headers):
@@ -266,6 +486,14 @@ class StorageObject:
         @raises ResponseError
         @return: str, data
         """
+        if self._use_content_cache(size, offset, headers):
+            data = self._cached_content()
+            try:
+                return data[:]
+            finally:
+                if data:
+                    data.close()
+
         headers = headers or {}
         if all([offset, size]):
             end = (offset + size) - 1
@@ -282,12 +510,111 @@ class StorageObject:
             return res.content
         return self.make_request('GET', headers=headers, formatter=_formatter)
 
-    def save_to_filename(self, filename):
+    def _use_content_cache(self, size=None, offset=None, headers=None):
+        """ Only whole-object reads go through the content cache """
+        return (self.client.content_cache is not None and not headers and
+                size is None and offset is None)
+
+    def _cached_content(self):
+        """ Returns the object content from the content cache as an mmap,
+            downloading it first if it's missing or out of date.
+
+        @raises ResponseError
+        """
+        cache = self.client.content_cache
+        entry = cache.lookup(self.container, self.name)
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+
+        def _formatter(res):
+            if res.status_code == 304:
+                return False
+            cache.store(self.container, self.name, res.headers.get('etag'),
+                        res.iter_content(self.chunk_size))
+            return True
+        try:
+            modified = self.make_request('GET', headers=headers,
+                                         formatter=_formatter, stream=True)
+        except errors.ResponseError as ex:
+            if ex.status != 304 or not headers:
+                raise
+            modified = False
+
+        if not modified:
+            cache.touch(self.container, self.name)
+        try:
+            return cache.open(self.container, self.name)
+        except (IOError, OSError):
+            if modified:
+                raise
+            # evicted after the 304, download it again
+            cache.invalidate(self.container, self.name)
+            return self._cached_content()
+
+    def _iter_cached(self, chunk_size):
+        data = self._cached_content()
+        try:
+            for offset in six.moves.range(0, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+        finally:
+            if data:
+                data.close()
+
+    def save_to_filename(self, filename, workers=None, range_size=None,
+                         resume=False):
         """ Reads object content into a file
 
         @param filename: filename
+        @param workers: if given, download byte ranges of the object with
+            this many parallel requests
+        @param range_size: size in bytes of each range
+        @param resume: keep track of the finished ranges in a
+            '<filename>.checkpoint' file so that an interrupted download
+            only fetches the missing ranges when it's run again. The
+            download starts over if the object changed in the meantime.
         @raises ResponseError
         """
+        if workers or resume:
+            size, parts = self._ranges(range_size)
+            checkpoint = None
+            completed = []
+            if resume:
+                checkpoint = '%s.checkpoint' % (filename, )
+                state = {'etag': self.model['hash'],
+                         'last_modified': self.model['last_modified'],
+                         'size': size}
+                previous = _load_checkpoint(checkpoint)
+                if previous and os.path.exists(filename) and \
+                        all(previous.get(k) == v for k, v in state.items()):
+                    completed = _merge_ranges(previous.get('completed', []))
+                    parts = _missing_parts(parts, completed)
+                state['completed'] = completed
+                _save_checkpoint(checkpoint, state)
+
+            flags = os.O_RDWR | os.O_CREAT
+            if not completed:
+                flags |= os.O_TRUNC
+            fd = os.open(filename, flags, 0o666)
+            try:
+                if size and not completed:
+                    preallocate(fd, size)
+
+                def _write(offset, data):
+                    pwrite(fd, data, offset)
+
+                def _done(part):
+                    state['completed'] = _merge_ranges(
+                        state['completed'] + [[part[0], part[3]]])
+                    _save_checkpoint(checkpoint, state)
+                self._download_ranges(_write, parts, workers or 1,
+                                      done=_done if checkpoint else None)
+            finally:
+                os.close(fd)
+            if checkpoint:
+                os.remove(checkpoint)
+            return
+
         f = open(filename, 'wb')
         conn = self.chunk_download()
         try:
@@ -296,17 +623,107 @@ class StorageObject:
         finally:
             f.close()
 
-    def chunk_download(self, chunk_size=None):
+    def read_parallel(self, workers=consts.WORKERS, range_size=None):
+        """ Reads object content using parallel ranged requests
+
+        @param workers: number of ranges to download at the same time
+        @param range_size: size in bytes of each range
+        @raises ResponseError
+        @return: bytearray, data
+        """
+        size, parts = self._ranges(range_size)
+        buff = bytearray(size)
+
+        def _write(offset, data):
+            buff[offset:offset + len(data)] = data
+        self._download_ranges(_write, parts, workers)
+        return buff
+
+    def _ranges(self, range_size=None):
+        """ Splits the object into byte ranges. Large objects are split
+            along their segments so that the segments are fetched directly.
+
+        @param range_size: maximum size in bytes of each range
+        @raises ResponseError
+        @return: (size, [(offset, path, start, length), ...])
+        """
+        range_size = range_size or self.range_size
+        self.load()
+        sources = []
+        if str(self.headers.get('x-static-large-object')).lower() == 'true':
+            segments = self.make_request(
+                'GET', params={'multipart-manifest': 'get', 'format': 'json'},
+                formatter=_json_formatter)
+            for segment in segments:
+                container, name = segment['name'].lstrip('/').split('/', 1)
+                sources.append(([container, name], int(segment['bytes'])))
+        elif self.model['manifest']:
+            container, prefix = unquote(self.model['manifest']).split('/', 1)
+            for item in self._list_segments(container, prefix):
+                sources.append(([container, item['name']],
+                                int(item['bytes'])))
+        else:
+            sources.append(([self.container, self.name],
+                            int(self.model['size'])))
+
+        parts = []
+        offset = 0
+        for path, size in sources:
+            for start in range(0, size, range_size):
+                parts.append((offset + start, path, start,
+                              min(range_size, size - start)))
+            offset += size
+        return offset, parts
+
+    def _list_segments(self, container, prefix):
+        """ Lists all segments of a dynamic large object in order """
+        return self.client.iter_listing([container],
+                                        params={'prefix': prefix},
+                                        prefetch=False)
+
+    def _download_ranges(self, write, parts, workers, done=None):
+        """ Fetches byte ranges in parallel and hands the data to
+            write(offset, data) as it streams in. done(part) is called once
+            a range has been fully written. """
+        def _fetch(part):
+            offset, path, start, length = part
+            headers = {'Range': 'bytes=%s-%s' % (start, start + length - 1)}
+            received = 0
+            for data in self.client.chunk_download(
+                    path, chunk_size=self.chunk_size, headers=headers):
+                if received + len(data) > length:
+                    raise errors.ResponseError(
+                        0, 'Range request returned too much data')
+                write(offset + received, data)
+                received += len(data)
+            if received != length:
+                raise errors.ResponseError(0, 'Incomplete range: %s of %s '
+                                              'bytes' % (received, length))
+            return part
+
+        for part, result, error in concurrent_map(_fetch, parts,
+                                                  workers=workers,
+                                                  ordered=False):
+            if error:
+                raise error
+            if done:
+                done(part)
+
+    def chunk_download(self, chunk_size=None, headers=None):
         """ Returns an iterator to read the object data.
 
         @param chunk_size: size of the chunks to read in.
             If not defined uses self.chunk_size
+        @param headers: extra headers to use with this request
         @raises: ResponseError
         @return: iterable
         """
         chunk_size = chunk_size or self.chunk_size
+        if self._use_content_cache(headers=headers):
+            return self._iter_cached(chunk_size)
         return self.client.chunk_download([self.container, self.name],
-                                          chunk_size=chunk_size)
+                                          chunk_size=chunk_size,
+                                          headers=headers)
     iter_content = chunk_download
     __iter__ = chunk_download
 
@@ -320,37 +737,34 @@ class StorageObject:
         @return: object that responds to o.send('data') to send data
             and o.finish() to finish the upload.
         """
+        self._invalidate()
         chunkable = self.client.chunk_upload([self.container, self.name],
                                              size=size, headers=headers)
         return chunkable
 
-    def send(self, data, check_md5=True):
-        """ Uploads object data
-
-        @param data: either a file-like object or a string.
-        @param check_md5: check if hash of uploaded file matches
-        @raises: ResponseError
-        @return: StorageObject, self
-        """
-        size = None
-        if isinstance(data, IOBase):
+    def _data_size(self, data):
+        """ Returns the size of data, if it can be determined """
+        if hasattr(data, 'seek') and hasattr(data, 'tell'):
+            # not only io.IOBase: Python 2 files and StringIO seek too
             try:
                 data.flush()
-            except IOError:
+            except (AttributeError, IOError):
                 pass
-            # edit for jupyter
-            # size = int(os.fstat(data.fileno())[6])
-            position = data.tell()
-            size = data.seek(0, os.SEEK_END)
-            data.seek(position, os.SEEK_SET)
-        else:
-            if hasattr(data, '__len__'):
-                size = len(data)
-
-        if isinstance(data, six.binary_type):
-            data = six.BytesIO(data)
-
-        headers = {}
+            try:
+                position = data.tell()
+                data.seek(0, os.SEEK_END)
+                size = data.tell()
+                data.seek(position, os.SEEK_SET)
+                return size
+            except (IOError, OSError, ValueError):
+                # pipes and sockets can't seek
+                return None
+        if hasattr(data, '__len__'):
+            return len(data)
+        return None
+
+    def _content_type(self, data):
+        """ Guesses the content type from the data or the object name """
         content_type = self.content_type
         if not content_type:
             _type = None
@@ -359,36 +773,349 @@ class StorageObject:
             content_type = (_type or
                             mimetypes.guess_type(self.name)[0] or
                             'application/octet-stream')
+        return content_type
+
+    def send(self, data, check_md5=True, segment_size=None,
+             workers=consts.WORKERS):
+        """ Uploads object data
+
+        @param data: either a file-like object or a string.
+        @param check_md5: check if hash of uploaded file matches
+        @param segment_size: if given and the data is larger, upload it as
+            a segmented large object (see send_segments)
+        @param workers: number of segments to upload at the same time
+        @raises: ResponseError, ChecksumMismatch
+        @return: StorageObject, self (a Deferred firing with it when the
+            connection is a Twisted one)
+        """
+        size = self._data_size(data)
+        if segment_size and size and size > segment_size:
+            return self.send_segments(data, segment_size=segment_size,
+                                      workers=workers)
+
+        if isinstance(data, six.binary_type):
+            data = six.BytesIO(data)
+
+        headers = {}
+        content_type = self._content_type(data)
         headers['Content-Type'] = content_type
 
+        # a whole file whose MD5 is in the hash cache doesn't need hashing
+        hash_cache = self.client.hash_cache
+        filename = getattr(data, 'name', None)
+        expected = None
+        if check_md5 and hash_cache is not None and \
+                isinstance(filename, six.string_types) and \
+                os.path.isfile(filename) and data.tell() == 0:
+            # keyed by the file as it was before reading, so that an MD5
+            # isn't cached for a file changed during the upload
+            stat_key = hash_cache.key(filename)
+            expected = hash_cache.get(filename)
+        else:
+            hash_cache = None
+
         checksum = md5()
-        transfered = 0
+        transfered = [0]
+
+        def _chunks():
+            buff = data.read(4096)
+            while len(buff) > 0:
+                if check_md5 and expected is None:
+                    checksum.update(buff)
+                transfered[0] += len(buff)
+                yield buff
+                buff = data.read(4096)
+
+        def _finished(res):
+            self._invalidate()
+            if check_md5:
+                if (expected or checksum.hexdigest()) != \
+                        res.headers.get('etag'):
+                    raise errors.ChecksumMismatch('md5 hashes do not match')
+                if hash_cache is not None and expected is None:
+                    hash_cache.set(filename, checksum.hexdigest(),
+                                   key=stat_key)
+            res.headers['content-length'] = transfered[0]
+            self.model = StorageObjectModel(
+                self, self.container, self.name, res.headers)
+            self.client._index_add(self.container, self.name, self.model)
+            headers['Content-Type'] = content_type
+            return self
+
         conn = self.chunk_upload(size=size, headers=headers)
-        buff = data.read(4096)
-        while len(buff) > 0:
+        if hasattr(conn, 'send_from'):
+            # Twisted: each chunk is read once the previous write's Deferred
+            # has fired, so the producer's flow control applies. Returns a
+            # Deferred firing with self.
+            d = conn.send_from(_chunks())
+            d.addCallback(_finished)
+            return d
+        for buff in _chunks():
             conn.send(buff)
-            if check_md5:
-                checksum.update(buff)
-            transfered += len(buff)
-            buff = data.read(4096)
-        res = conn.finish()
-
-        if check_md5:
-            assert checksum.hexdigest() == res.headers.get('etag'), \
-                'md5 hashes do not match'
-        res.headers['content-length'] = transfered
-        self.model = StorageObjectModel(
-            self, self.container, self.name, res.headers)
-        headers['Content-Type'] = content_type
-        return self
+        return _finished(conn.finish())
+
+    def send_segments(self, data, segment_size=None, workers=consts.WORKERS,
+                      segment_container=None, static=False, journal=None):
+        """ Uploads object data as a large object. The data is split into
+            segments which are uploaded in parallel, then a manifest
+            pointing at the segments is written to this object.
+
+        @param data: either a file-like object or a string.
+        @param segment_size: size of each segment in bytes
+        @param workers: number of segments to upload at the same time
+        @param segment_container: container to upload the segments to;
+            defaults to '<container>_segments'
+        @param static: write a static large object manifest instead of a
+            dynamic one
+        @param journal: filename of a local journal recording the segments
+            that have been uploaded. When the same data is sent again with
+            the same journal, segments that are still in the segment
+            container are not uploaded again. Segments of data that isn't
+            a file are only skipped if their MD5 matches the journal.
+            If the upload fails, the segments are kept to resume from;
+            without a journal they are deleted.
+        @raises: ResponseError, ChecksumMismatch
+        @return: StorageObject, self
+        """
+        segment_size = segment_size or self.segment_size
+        segment_container = (segment_container or
+                             '%s_segments' % (self.container, ))
+        if isinstance(data, six.binary_type):
+            data = six.BytesIO(data)
+
+        content_type = self._content_type(data)
+        filename = getattr(data, 'name', None)
+        if not isinstance(filename, six.string_types) or \
+                not os.path.isfile(filename):
+            filename = None
+
+        start = 0
+        size = self._data_size(data)
+        if filename:
+            start = data.tell()
+            size = size - start
+            timestamp = os.path.getmtime(filename)
+        else:
+            timestamp = time.time()
+        if size == 0:
+            return self.send(data)
+        prefix = '%s/%f/%s/%s' % (self.name, timestamp, size or 0,
+                                  segment_size)
+
+        state = None
+        uploaded = {}
+        if journal:
+            state = {'container': self.container,
+                     'name': self.name,
+                     'segment_container': segment_container,
+                     'segment_size': segment_size,
+                     'size': size}
+            if filename:
+                state['mtime'] = timestamp
+            previous = _load_checkpoint(journal)
+            if previous and \
+                    all(previous.get(k) == v for k, v in state.items()):
+                prefix = previous['prefix']
+                uploaded = self._verify_journal(segment_container, prefix,
+                                                previous.get('segments', []))
+            state['prefix'] = prefix
+            state['segments'] = sorted(uploaded.values(),
+                                       key=lambda s: s['index'])
+            _save_checkpoint(journal, state)
+
+        def _segments():
+            """ Yields (index, offset, length, data) for each segment that
+                still has to be uploaded. Data is only read up front when it
+                can't be re-read from a file by the worker uploading the
+                segment. """
+            index = 0
+            offset = 0
+            while not failed:
+                chunk = None
+                if index in uploaded:
+                    length = uploaded[index]['length']
+                    if filename:
+                        index += 1
+                        offset += length
+                        continue
+                    # streams have no mtime, so check that the journaled
+                    # segment was made from the same data
+                    chunk = data.read(length)
+                    if md5(chunk).hexdigest() == uploaded[index]['etag']:
+                        index += 1
+                        offset += length
+                        continue
+                    del uploaded[index]
+                    state['segments'] = [
+                        segment for segment in state['segments']
+                        if segment['index'] != index]
+                if chunk is not None:
+                    if not chunk:
+                        break
+                    length = len(chunk)
+                elif filename:
+                    if offset >= size:
+                        break
+                    length = min(segment_size, size - offset)
+                    chunk = None
+                else:
+                    chunk = data.read(segment_size)
+                    if not chunk:
+                        break
+                    length = len(chunk)
+                yield index, offset, length, chunk
+                index += 1
+                offset += length
+
+        def _upload(segment):
+            index, offset, length, chunk = segment
+            name = '%s/%08d' % (prefix, index)
+            checksum = md5()
+            conn = self.client.chunk_upload(
+                [segment_container, name], size=length,
+                headers={'Content-Type': 'application/octet-stream'})
+            if chunk is None:
+                f = open(filename, 'rb')
+                try:
+                    f.seek(start + offset)
+                    remaining = length
+                    while remaining > 0:
+                        buff = f.read(min(self.chunk_size, remaining))
+                        if not buff:
+                            break
+                        conn.send(buff)
+                        checksum.update(buff)
+                        remaining -= len(buff)
+                finally:
+                    f.close()
+            else:
+                for i in range(0, length, self.chunk_size):
+                    buff = chunk[i:i + self.chunk_size]
+                    conn.send(buff)
+                    checksum.update(buff)
+            res = conn.finish()
+
+            etag = checksum.hexdigest()
+            if (res.headers.get('etag') or '').strip('"') != etag:
+                raise errors.ChecksumMismatch(
+                    'md5 hashes do not match for segment %s' % (name, ))
+            return {'index': index, 'offset': offset, 'length': length,
+                    'etag': etag}
+
+        self.client.container(segment_container).create()
+
+        # at most `workers` segments of a stream are held in memory
+        failed = []
+        for segment, result, error in concurrent_map(_upload, _segments(),
+                                                     workers=workers,
+                                                     ordered=False,
+                                                     pending=workers):
+            if error:
+                failed.append((segment[0], error))
+                continue
+            uploaded[result['index']] = result
+            if journal:
+                state['segments'].append(result)
+                _save_checkpoint(journal, state)
+        if failed:
+            if not journal:
+                indexes = list(uploaded) + [index for index, _ in failed]
+                self._delete_segments(segment_container, prefix, indexes,
+                                      workers)
+            raise failed[0][1]
+
+        manifest = []
+        for index in sorted(uploaded):
+            segment = uploaded[index]
+            manifest.append({'path': '/%s/%s/%08d' % (segment_container,
+                                                      prefix, index),
+                             'etag': segment['etag'],
+                             'size_bytes': segment['length']})
+        result = self._send_manifest(manifest, content_type, static=static,
+                                     prefix=get_path([segment_container,
+                                                      prefix]) + '/')
+        if journal:
+            os.remove(journal)
+        return result
+
+    def _delete_segments(self, segment_container, prefix, indexes, workers):
+        """ Removes the segments of a failed upload that can't be resumed """
+        names = ['%s/%08d' % (prefix, index) for index in sorted(indexes)]
+        try:
+            self.client.delete_objects(segment_container, names,
+                                       workers=workers)
+        except errors.ResponseError as ex:
+            logger.warning('Could not delete segments of %s/%s: %s',
+                           self.container, self.name, ex)
+
+    def _verify_journal(self, segment_container, prefix, segments):
+        """ Returns the journaled segments, by index, that are still in the
+            segment container with the same size and ETag """
+        listed = {}
+        for item in self._list_segments(segment_container, prefix + '/'):
+            listed[item['name']] = item
+        verified = {}
+        for segment in segments:
+            item = listed.get('%s/%08d' % (prefix, segment['index']))
+            if item and int(item['bytes']) == segment['length'] and \
+                    item['hash'] == segment['etag']:
+                verified[segment['index']] = segment
+        return verified
+
+    def _send_manifest(self, manifest, content_type, static=False,
+                       prefix=None):
+        """ Writes a large object manifest for the given segments
+
+        @param manifest: list of dicts with path, etag and size_bytes
+        @param content_type: content type of the large object
+        @param static: write a static manifest instead of a dynamic one
+        @param prefix: quoted <container>/<prefix> for a dynamic manifest
+        @raises: ResponseError
+        @return: StorageObject, self
+        """
+        headers = {'Content-Type': content_type}
+        params = None
+        data = None
+        if static:
+            params = {'multipart-manifest': 'put'}
+            data = json.dumps(manifest)
+            headers['Content-Length'] = str(len(data))
+        else:
+            headers['X-Object-Manifest'] = prefix
+            headers['Content-Length'] = '0'
+
+        def _formatter(res):
+            _headers = dict(res.headers)
+            _headers['content-length'] = sum(segment['size_bytes']
+                                             for segment in manifest)
+            _headers['content-type'] = content_type
+            if not static:
+                _headers['x-object-manifest'] = prefix
+            self.model = StorageObjectModel(
+                self, self.container, self.name, _headers)
+            self.client._index_add(self.container, self.name, self.model)
+            return self
+        return self.make_request('PUT', headers=headers, params=params,
+                                 data=data, formatter=_formatter)
 
     write = send
 
-    def upload_directory(self, directory):
+    def upload_directory(self, directory, sync=False, delete=False,
+                         workers=consts.WORKERS):
         """ Uploads an entire directory
 
         @param directory: path of the directory to upload
+        @param sync: only upload files that are new or changed. Files are
+            compared with a listing of the container by size and mtime,
+            using the MD5 of the file as a tie-breaker when the local file
+            is newer.
+        @param delete: in sync mode, delete objects under the directory that
+            no longer exist locally
+        @param workers: number of uploads to run at the same time in sync
+            mode
         @raises: ResponseError
+        @return: in sync mode, a dict with the 'uploaded', 'skipped' and
+            'deleted' names and a list of (name, reason) 'errors'
         """
         directories = []
         files = []
@@ -398,6 +1125,10 @@ class StorageObject:
             for _file in filenames:
                 files.append(os.path.relpath(os.path.join(root, _file)))
 
+        if sync:
+            return self._sync_directory(directory, directories, files,
+                                        delete=delete, workers=workers)
+
         for _dir in directories:
             obj = self.__class__(self.container, _dir, client=self.client)
             obj.content_type = 'application/directory'
@@ -407,6 +1138,67 @@ class StorageObject:
             obj = self.__class__(self.container, _file, client=self.client)
             obj.load_from_filename(_file)
 
+    def _sync_directory(self, directory, directories, files, delete=False,
+                        workers=consts.WORKERS):
+        """ Uploads the new and changed files of a directory.
+            See upload_directory() """
+        prefix = os.path.relpath(directory)
+        params = {}
+        if prefix != os.curdir:
+            params['prefix'] = prefix + '/'
+        remote = {}
+        for item in self.client.iter_listing([self.container], params=params):
+            if 'name' in item:
+                remote[item['name']] = item
+
+        summary = {'uploaded': [], 'skipped': [], 'deleted': [], 'errors': []}
+        changed = []
+        for _file in files:
+            if _file_changed(_file, remote.get(_file),
+                             self.client.hash_cache):
+                changed.append(_file)
+            else:
+                summary['skipped'].append(_file)
+        markers = [_dir for _dir in directories if _dir not in remote]
+
+        def _create_marker(name):
+            obj = self.__class__(self.container, name, client=self.client)
+            obj.content_type = 'application/directory'
+            return obj.create()
+
+        def _upload(name):
+            obj = self.__class__(self.container, name, client=self.client)
+            f = open(name, 'rb')
+            try:
+                return obj.send(f)
+            finally:
+                f.close()
+
+        # directory markers first, all in one batch, then the files
+        for func, names in ((_create_marker, markers), (_upload, changed)):
+            for name, result, error in concurrent_map(func, names,
+                                                      workers=workers,
+                                                      ordered=False):
+                if isinstance(error, (errors.ResponseError,
+                                      errors.ChecksumMismatch, IOError)):
+                    summary['errors'].append((name, str(error)))
+                elif error:
+                    raise error
+                elif func is _upload:
+                    summary['uploaded'].append(name)
+
+        if delete:
+            local = set(files) | set(directories)
+            orphans = [name for name in remote if name not in local]
+            result = self.client.delete_objects(self.container, orphans,
+                                                workers=workers)
+            failed = set(path for path, _ in result['errors'])
+            summary['deleted'] = [
+                name for name in orphans
+                if '/%s' % (get_path([self.container, name]), ) not in failed]
+            summary['errors'].extend(result['errors'])
+        return summary
+
     def load_from_filename(self, filename):
         """ Uploads a file from the local filename
 
@@ -447,7 +1239,10 @@ class StorageObject:
         headers['Content-Length'] = "0"
         if 'formatter' not in kwargs:
             kwargs['formatter'] = lambda r: new_obj
-        return self.make_request('COPY', headers=headers, *args, **kwargs)
+        try:
+            return self.make_request('COPY', headers=headers, *args, **kwargs)
+        finally:
+            new_obj._invalidate()
 
     def rename(self, new_obj, *args, **kwargs):
         """ Copies content to a new object existing object and deletes the
@@ -485,7 +1280,12 @@ class StorageObject:
     def make_request(self, method, path=None, *args, **kwargs):
         """ returns a request object """
         path = [self.container, self.name]
-        return self.client.make_request(method, path, *args, **kwargs)
+        if method in ('GET', 'HEAD'):
+            return self.client.make_request(method, path, *args, **kwargs)
+        try:
+            return self.client.make_request(method, path, *args, **kwargs)
+        finally:
+            self._invalidate()
 
     def fileno(self):
         return 1
@@ -7,18 +7,23 @@ from socket import timeout
 
 import sys
 import re
+import select
+import threading
+import time
+from collections import deque
 if sys.version_info.major == 2:
-    from urllib2 import Request, urlopen
     from urlparse import urlparse
     from httplib import HTTPConnection, HTTPSConnection
 else:
-    from urllib.request import Request, urlopen
     from urllib.parse import urlparse
     from http.client import HTTPConnection, HTTPSConnection
 
 from object_storage.errors import ResponseError, NotFound
 from object_storage import consts
 
+import logging
+logger = logging.getLogger('softlayer.transport')
+
 
 class Response(object):
     def __init__(self):
@@ -28,6 +33,12 @@ class Response(object):
         self.headers = {}
         self.content = None
 
+    def iter_content(self, chunk_size=1):
+        """ Iterates over the (already loaded) body in chunks """
+        content = self.content or b''
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
     def raise_for_status(self):
         if self.status_code == 404:
             raise NotFound(self.status_code, "Not Found")
@@ -42,36 +53,265 @@ class Response(object):
                                 '%s Server Error' % self.status_code)
 
 
+class ConnectionPool(object):
+    """
+        Per-host pool of persistent HTTP(S) connections.
+
+        Idle connections are kept for at most `idle_timeout` seconds and at
+        most `maxsize` of them are kept per host. Connections are health
+        checked before they are handed out again.
+    """
+    def __init__(self, maxsize=10, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get(self, scheme, host, port):
+        """ Returns an idle connection to the host or a new one """
+        key = (scheme, host, port)
+        now = time.time()
+        with self.lock:
+            idle = self.pools.get(key)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used > self.idle_timeout or \
+                        not self._is_healthy(conn):
+                    conn.close()
+                    continue
+                return conn
+        return self.connect(scheme, host, port)
+
+    def connect(self, scheme, host, port):
+        """ Returns a new connection to the host, bypassing idle ones """
+        if scheme == 'https':
+            return HTTPSConnection(host, port)
+        return HTTPConnection(host, port)
+
+    def put(self, scheme, host, port, conn):
+        """ Returns a connection to the pool for reuse """
+        key = (scheme, host, port)
+        now = time.time()
+        with self.lock:
+            idle = self.pools.setdefault(key, deque())
+            self._evict(idle, now)
+            if len(idle) >= self.maxsize:
+                conn.close()
+                return
+            idle.append((conn, now))
+
+    def discard(self, conn):
+        """ Closes a connection that can't be reused """
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def clear(self):
+        """ Closes all idle connections """
+        with self.lock:
+            for idle in self.pools.values():
+                while idle:
+                    conn, _ = idle.pop()
+                    conn.close()
+            self.pools = {}
+
+    def _evict(self, idle, now):
+        """ Closes connections that have been idle for too long """
+        while idle and now - idle[0][1] > self.idle_timeout:
+            conn, _ = idle.popleft()
+            conn.close()
+
+    def _is_healthy(self, conn):
+        """ An idle socket should have nothing to read; if it is readable the
+            server has closed it (or sent garbage) """
+        sock = getattr(conn, 'sock', None)
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (select.error, ValueError):
+            return False
+        return not readable
+
+
+def split_url(url):
+    """ Returns (scheme, host, port, path) for the given URL """
+    scheme, netloc, path, params, query, fragment = urlparse(url)
+    match = re.match(r'([a-zA-Z0-9\-\.]+):?([0-9]{2,5})?', netloc)
+
+    if not match:
+        raise ValueError('Invalid URL')
+    (host, port) = match.groups()
+
+    if not port:
+        if scheme == 'https':
+            port = 443
+        else:
+            port = 80
+
+    if query:
+        path = '%s?%s' % (path, query)
+    return scheme, host, int(port), path
+
+
 class BaseAuthenticatedConnection:
+    pool_maxsize = 10
+    pool_idle_timeout = 60
+    # authenticate on the first request instead of in the constructor
+    lazy = False
+
     def _authenticate(self):
         """ Do authentication and set token and storage_url """
         self.auth_headers = self.auth.auth_headers
         self.token = self.auth.auth_token
         self.storage_url = self.auth.storage_url
 
+    def _needs_authentication(self):
+        """ Whether the auth has to authenticate before the first request """
+        return not self.auth.authenticated
+
+    def ensure_authenticated(self):
+        """ Authenticates if the connection hasn't yet. Threads that get
+            here at the same time wait for the first one. """
+        if self.token is not None:
+            return
+        with self.__dict__.setdefault('_auth_lock', threading.Lock()):
+            if self.token is None:
+                if self._needs_authentication() and \
+                        not self.auth.load_cached_token():
+                    self.auth.authenticate()
+                self._authenticate()
+
+    def prewarm(self, connections=1):
+        """ Authenticates and opens keep-alive connections to the storage
+            host in a background thread, so that the first requests don't
+            wait for them. Errors are logged; the first request that needs
+            the connection raises them again.
+
+        @param connections: number of connections to open
+        @return: the started thread
+        """
+        def _prewarm():
+            try:
+                self.ensure_authenticated()
+                self._open_connections(connections)
+            except Exception:
+                logger.exception('Pre-warming the connection failed')
+        thread = threading.Thread(target=_prewarm)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _open_connections(self, count):
+        """ Connects `count` connections to the storage host and adds them
+            to connection_pool """
+        scheme, host, port, _ = split_url(self.storage_url)
+        pool = self.connection_pool
+        conns = [pool.get(scheme, host, port) for _ in range(count)]
+        for conn in conns:
+            if getattr(conn, 'sock', None) is None:
+                conn.connect()
+        for conn in conns:
+            pool.put(scheme, host, port, conn)
+
+    def _reauthenticate(self, stale_token):
+        """ Authenticates again after a request made with stale_token got a
+            401 and returns the new auth headers. Only one thread
+            authenticates at a time; threads that got a 401 with the same
+            token wait for it and reuse the new token. A newer token in the
+            auth's token cache is used without authenticating.
+        """
+        lock = self.__dict__.setdefault('_auth_lock', threading.Lock())
+        with lock:
+            if self.token == stale_token:
+                # another process may have authenticated already
+                if not self.auth.load_cached_token(stale_token):
+                    self.auth.authenticate()
+                self._authenticate()
+        return dict(self.auth_headers)
+
     def get_headers(self):
         """ Get default headers for this connection """
+        if self.lazy:
+            self.ensure_authenticated()
         return dict([('User-Agent', consts.USER_AGENT)] + list(self.auth_headers.items()))
 
+    @property
+    def connection_pool(self):
+        """ Keep-alive connections shared by chunked uploads and downloads """
+        pool = self.__dict__.get('_connection_pool')
+        if pool is None:
+            # setdefault is atomic, so threads racing here share one pool
+            pool = self.__dict__.setdefault('_connection_pool', ConnectionPool(
+                maxsize=self.pool_maxsize,
+                idle_timeout=self.pool_idle_timeout))
+        return pool
+
     def chunk_upload(self, method, url, size=None, headers=None):
         """ Returns new ChunkedConnection """
         headers = headers or {}
         headers.update(self.get_headers())
         return ChunkedUploadConnection(self, method, url, size=size,
-                                       headers=headers)
-
-    def chunk_download(self, url, chunk_size=10 * 1024):
-        """ Returns new ChunkedConnection """
-        headers = self.get_headers()
-        req = Request(url)
-        for k, v in headers.items():
-            req.add_header(k, v)
-        r = urlopen(req)
-        while True:
-            buff = r.read(chunk_size)
-            if not buff:
-                break
-            yield buff
+                                       headers=headers,
+                                       pool=self.connection_pool)
+
+    def chunk_download(self, url, chunk_size=10 * 1024, headers=None):
+        """ Returns a generator that streams the response body of a GET
+            request over a pooled keep-alive connection """
+        _headers = headers or {}
+        pool = self.connection_pool
+        scheme, host, port, path = split_url(url)
+
+        def _get(fresh=False):
+            request_headers = self.get_headers()
+            request_headers.update(_headers)
+            # the token actually sent; self.token may already be a newer one
+            token = request_headers.get('X-Auth-Token')
+            if fresh:
+                conn = pool.connect(scheme, host, port)
+            else:
+                conn = pool.get(scheme, host, port)
+            reused = getattr(conn, 'sock', None) is not None
+            try:
+                conn.request('GET', path, headers=request_headers)
+                res = conn.getresponse()
+            except timeout:
+                pool.discard(conn)
+                raise
+            except Exception as e:
+                pool.discard(conn)
+                if reused:
+                    # the server closed the idle connection, try a new one
+                    return _get(fresh=True)
+                raise ResponseError(0, 'Disconnected: %s' % e)
+            return conn, res, token
+
+        conn, res, token = _get()
+        if res.status == 401:
+            pool.discard(conn)
+            self._reauthenticate(token)
+            conn, res, token = _get()
+
+        if res.status >= 300:
+            pool.discard(conn)
+            r = Response()
+            r.status_code = res.status
+            r.raise_for_status()
+
+        finished = False
+        try:
+            while True:
+                buff = res.read(chunk_size)
+                if not buff:
+                    break
+                yield buff
+            finished = True
+        finally:
+            if finished and not res.will_close:
+                pool.put(scheme, host, port, conn)
+            else:
+                pool.discard(conn)
 
 
 class BaseAuthentication(object):
@@ -82,7 +322,14 @@ class BaseAuthentication(object):
     def __init__(self, auth_url=None,
                  protocol='https',
                  datacenter='dal05',
-                 network='public'):
+                 network='public',
+                 token_cache=None):
+        """
+        @param token_cache: `object_storage.cache.TokenCache` shared with
+            other processes. A cached token is used instead of
+            authenticating, until the server rejects it.
+        """
+        self.token_cache = token_cache
         self.auth_url = auth_url
         self.protocol = protocol or 'https'
         self.datacenter = datacenter or 'dal05'
@@ -110,6 +357,32 @@ class BaseAuthentication(object):
             return storage_urls[self.network]
         return None
 
+    def load_cached_token(self, stale_token=None):
+        """ Uses the token from the token cache, if there is one other than
+            stale_token. stale_token is one the server rejected; it's
+            removed from the cache first so other processes stop using it.
+
+        @return: True if a cached token was loaded
+        """
+        if self.token_cache is None:
+            return False
+        username = getattr(self, 'username', None)
+        if stale_token is not None:
+            self.token_cache.invalidate(self.auth_url, username, stale_token)
+        cached = self.token_cache.get(self.auth_url, username)
+        if not cached or cached[0] == stale_token:
+            return False
+        self.auth_token, self.storage_url = cached
+        self.authenticated = True
+        return True
+
+    def cache_token(self):
+        """ Shares the current token through the token cache """
+        if self.token_cache is not None:
+            self.token_cache.set(self.auth_url,
+                                 getattr(self, 'username', None),
+                                 self.auth_token, self.storage_url)
+
     @property
     def auth_headers(self):
         return {'X-Auth-Token': 'AUTH_TOKEN'}
@@ -122,6 +395,7 @@ class BaseAuthentication(object):
         self.storage_url = 'STORAGE_URL'
         self.auth_token = 'AUTH_TOKEN'
         self.authenticated = True
+        self.cache_token()
 
 
 class ChunkedUploadConnection:
@@ -130,10 +404,12 @@ class ChunkedUploadConnection:
         send_chunk() will send more data.
         finish() will end the request.
     """
-    def __init__(self, conn, method, url, size=None, headers=None):
+    def __init__(self, conn, method, url, size=None, headers=None,
+                 pool=None):
         self.conn = conn
         self.method = method
         self.req = None
+        self.pool = pool
         self._chunked_encoding = True
         headers = headers or {}
 
@@ -146,60 +422,102 @@ class ChunkedUploadConnection:
         if 'ETag' in headers:
             del headers['ETag']
 
-        scheme, netloc, path, params, query, fragment = urlparse(url)
-        match = re.match('([a-zA-Z0-9\-\.]+):?([0-9]{2,5})?', netloc)
-
-        if match:
-            (host, port) = match.groups()
-        else:
-            ValueError('Invalid URL')
-
-        if not port:
-            if scheme == 'https':
-                port = 443
-            else:
-                port = 80
-
-        port = int(port)
-
-        if scheme == 'https':
+        scheme, host, port, self.path = split_url(url)
+        self.key = (scheme, host, port)
+        self.headers = headers
+        # body data has been written, so the request can't be sent again
+        self._sent = False
+        self._connect()
+
+    def _connect(self, fresh=False):
+        """ Starts the request on a pooled connection, or on a new one if
+            fresh is set """
+        scheme, host, port = self.key
+        if self.pool and fresh:
+            self.req = self.pool.connect(scheme, host, port)
+        elif self.pool:
+            self.req = self.pool.get(scheme, host, port)
+        elif scheme == 'https':
             self.req = HTTPSConnection(host, port)
         else:
             self.req = HTTPConnection(host, port)
+        self._reused = getattr(self.req, 'sock', None) is not None
         try:
-            self.req.putrequest('PUT', path)
-            for key, value in headers.items():
+            self.req.putrequest('PUT', self.path)
+            for key, value in self.headers.items():
                 self.req.putheader(key, value)
             self.req.endheaders()
         except Exception as e:
+            self._discard()
+            if self._reused:
+                return self._connect(fresh=True)
             raise ResponseError(0, 'Disconnected: %s' % e)
 
+    def _retry(self):
+        """ Restarts the request on a new connection if it failed on a
+            reused keep-alive connection, which the server may have closed
+            while it was idle, before any body data was sent
+
+        @return: True if the request was restarted
+        """
+        if not self._reused or self._sent:
+            return False
+        self._connect(fresh=True)
+        return True
+
+    def _discard(self):
+        """ Throws away the underlying connection """
+        if self.pool:
+            self.pool.discard(self.req)
+        else:
+            self.req.close()
+
+    def _release(self, res):
+        """ Hands a connection with a fully read response back to the pool """
+        if self.pool and not res.will_close:
+            self.pool.put(self.key[0], self.key[1], self.key[2], self.req)
+        else:
+            self.req.close()
+
     def send(self, chunk):
         """ Sends a chunk of data. """
-        try:
-            if self._chunked_encoding:
-                self.req.send("%X\r\n" % len(chunk))
-                self.req.send(chunk)
-                self.req.send("\r\n")
-            else:
-                self.req.send(chunk)
-        except timeout as err:
-            raise err
-        except:
-            raise ResponseError(0, 'Disconnected')
+        while True:
+            try:
+                if self._chunked_encoding:
+                    self.req.send(("%X\r\n" % len(chunk)).encode('ascii'))
+                    self.req.send(chunk)
+                    self.req.send(b"\r\n")
+                else:
+                    self.req.send(chunk)
+            except timeout as err:
+                self._discard()
+                raise err
+            except Exception:
+                self._discard()
+                if self._retry():
+                    continue
+                raise ResponseError(0, 'Disconnected')
+            self._sent = True
+            return
 
     def finish(self):
         """ Finished the request out and receives a response. """
-        try:
-            if self._chunked_encoding:
-                self.req.send("0\r\n\r\n")
-        except timeout as err:
-            raise err
-        except:
-            raise ResponseError(0, 'Disconnected')
-
-        res = self.req.getresponse()
-        content = res.read()
+        while True:
+            try:
+                if self._chunked_encoding:
+                    self.req.send(b"0\r\n\r\n")
+                res = self.req.getresponse()
+                content = res.read()
+            except timeout as err:
+                self._discard()
+                raise err
+            except Exception as e:
+                self._discard()
+                if self._retry():
+                    continue
+                raise ResponseError(0, 'Disconnected: %s' % e)
+            break
+        self._release(res)
 
         r = Response()
         r.status_code = res.status
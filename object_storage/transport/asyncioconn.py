@@ -0,0 +1,247 @@
+"""
+    asyncio connection type, built on aiohttp. Python 3 only.
+
+    See COPYING for license information
+"""
+import asyncio
+
+import aiohttp
+
+from object_storage.transport import Response, BaseAuthenticatedConnection, \
+    BaseAuthentication
+from object_storage import errors
+from object_storage.utils import json
+
+import logging
+logger = logging.getLogger('softlayer.transport.asyncio')
+
+
+def _check_status(res):
+    """ Raises the errors that the other transports raise for a response """
+    if res.status == 404:
+        raise errors.NotFound('Not found')
+    if res.status >= 300:
+        r = Response()
+        r.status_code = res.status
+        r.raise_for_status()
+
+
+async def _complete_request(res, load_body=True):
+    """ Returns a transport Response for an aiohttp response """
+    r = Response()
+    r.status_code = res.status
+    r.version = res.version
+    r.phrase = res.reason
+    for k, v in res.headers.items():
+        r.headers[k.lower()] = v
+    if load_body:
+        r.content = await res.read()
+    else:
+        r.content = b''
+    return r
+
+
+class AuthenticatedConnection(BaseAuthenticatedConnection):
+    """
+        Connection that will authenticate if it isn't already
+        and retry once if an auth error is returned.
+
+        All requests share one aiohttp session whose connector keeps up to
+        `limit` keep-alive connections (`limit_per_host` per host). The
+        session is created on first use, inside the running event loop.
+    """
+    def __init__(self, auth, limit=100, limit_per_host=0, **kwargs):
+        self.token = None
+        self.storage_url = None
+        self.auth = auth
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session = None
+        self._auth_lock = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.pool_idle_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  auto_decompress=False)
+        return self._session
+
+    async def authenticate(self):
+        await self.auth.authenticate(self.session)
+        self._authenticate()
+
+    async def _reauthenticate(self, stale_token):
+        """ Authenticates again after a 401 with stale_token. Concurrent
+            requests that got a 401 with the same token wait for the first
+            one and reuse the new token. A newer token in the auth's token
+            cache is used without authenticating. """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            if self.token == stale_token:
+                if self.auth.load_cached_token(stale_token):
+                    self._authenticate()
+                else:
+                    await self.authenticate()
+        return dict(self.auth_headers)
+
+    async def close(self):
+        """ Closes the pooled connections """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, url, headers=None, params=None,
+                       data=None, retry=True):
+        """ Sends a request and authenticates again on a 401. Requests with
+            a streamed body can't be replayed, so they aren't retried. """
+        if not self.token:
+            await self._reauthenticate(None)
+        token = self.token
+        request_headers = self.get_headers()
+        request_headers.update(headers or {})
+        res = await self.session.request(method, url, headers=request_headers,
+                                         params=params, data=data)
+        if res.status == 401 and retry:
+            res.release()
+            request_headers.update(await self._reauthenticate(token))
+            res = await self.session.request(method, url,
+                                             headers=request_headers,
+                                             params=params, data=data)
+        return res
+
+    async def make_request(self, method, url=None, headers=None, params=None,
+                           data=None, formatter=None, **kwargs):
+        """ Makes a request. The body is read before the formatter is
+            called; use chunk_download() to stream a body. """
+        res = await self._request(method, url, headers=headers,
+                                  params=params, data=data)
+        try:
+            _check_status(res)
+            r = await _complete_request(
+                res, load_body=method.upper() not in ['HEAD', 'DELETE'])
+        finally:
+            res.release()
+        if formatter:
+            return formatter(r)
+        return r
+
+    async def chunk_download(self, url, chunk_size=10 * 1024, headers=None):
+        """ Async generator that streams the response body of a GET request
+            over a pooled connection """
+        res = await self._request('GET', url, headers=headers)
+        try:
+            _check_status(res)
+            async for chunk in res.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            res.release()
+
+    def chunk_upload(self, method, url, size=None, headers=None):
+        """ Returns new ChunkedUploadConnection """
+        return ChunkedUploadConnection(self, method, url, size=size,
+                                       headers=headers)
+
+
+class ChunkedUploadConnection(object):
+    """
+        Streams a request body from await send(chunk) calls.
+        await finish() ends the request and returns the response.
+
+        At most `queue_size` chunks wait to be written; send() blocks until
+        the connection catches up.
+    """
+    def __init__(self, conn, method, url, size=None, headers=None,
+                 queue_size=4):
+        self.conn = conn
+        self.method = method
+        self.url = url
+        self.size = size
+        self.headers = dict(headers or {})
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+
+    async def _body(self):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    async def _upload(self):
+        headers = dict(self.headers)
+        if self.size is not None:
+            headers['Content-Length'] = str(self.size)
+        res = await self.conn._request(self.method, self.url,
+                                       headers=headers, data=self._body(),
+                                       retry=False)
+        try:
+            _check_status(res)
+            return await _complete_request(res)
+        finally:
+            res.release()
+
+    async def _put(self, item):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._upload())
+        put = asyncio.ensure_future(self.queue.put(item))
+        await asyncio.wait([put, self.task],
+                           return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            # the request failed before reading the whole body
+            put.cancel()
+            self.task.result()
+
+    async def send(self, chunk):
+        """ Sends a chunk of data. """
+        await self._put(chunk)
+
+    async def finish(self):
+        """ Finishes the request and returns the response. """
+        await self._put(None)
+        return await self.task
+
+
+class Authentication(BaseAuthentication):
+    """
+        Authentication class.
+    """
+    def __init__(self, username, api_key, auth_token=None, *args, **kwargs):
+        super(Authentication, self).__init__(*args, **kwargs)
+        self.username = username
+        self.api_key = api_key
+        self.auth_token = auth_token
+        if self.auth_token:
+            self.authenticated = True
+
+    @property
+    def auth_headers(self):
+        return {'X-Auth-Token': self.auth_token}
+
+    async def authenticate(self, session):
+        """ Does authentication """
+        headers = {'X-Storage-User': self.username,
+                   'X-Storage-Pass': self.api_key,
+                   'Content-Length': '0'}
+        async with session.get(self.auth_url, headers=headers) as res:
+            if res.status == 401:
+                raise errors.AuthenticationError('Invalid Credentials')
+            _check_status(res)
+            content = await res.read()
+
+        try:
+            storage_options = json.loads(content.decode('utf8'))['storage']
+        except ValueError:
+            raise errors.StorageURLNotFound("Could not parse services JSON.")
+
+        self.auth_token = res.headers['x-auth-token']
+        self.storage_url = self.get_storage_url(storage_options)
+        if not self.storage_url:
+            self.storage_url = res.headers['x-storage-url']
+        if not self.auth_token or not self.storage_url:
+            raise errors.AuthenticationError('Invalid Authentication Response')
+        self.cache_token()
+        self.authenticated = True
@@ -8,6 +8,7 @@ from object_storage import errors
 from object_storage.transport import BaseAuthentication, \
     BaseAuthenticatedConnection, Response
 import httplib2
+import threading
 
 from object_storage.utils import json, unicode_urlencode
 
@@ -20,23 +21,43 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
         Connection that will authenticate if it isn't already
         and retry once if an auth error is returned.
     """
-    def __init__(self, auth, debug=False, **kwargs):
+    def __init__(self, auth, debug=False, lazy=False, prewarm=0, **kwargs):
+        """
+        @param auth: Authentication instance
+        @param lazy: authenticate on the first request instead of here
+        @param prewarm: authenticate and open this many keep-alive
+            connections for chunked uploads and downloads in the
+            background; implies lazy
+        """
         if debug:
             httplib2.debuglevel = 4
         self.token = None
         self.storage_url = None
-        self.http = httplib2.Http()
-        self.http.disable_ssl_certificate_validation = True
+        self._local = threading.local()
         self.auth = auth
-        if not self.auth.authenticated:
-            self.auth.authenticate()
-        self._authenticate()
+        self.lazy = lazy or bool(prewarm)
+        if prewarm:
+            self.prewarm(prewarm)
+        elif not self.lazy:
+            self.ensure_authenticated()
+
+    @property
+    def http(self):
+        """ httplib2.Http isn't thread-safe, so every thread gets its own """
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = httplib2.Http()
+            http.disable_ssl_certificate_validation = True
+            self._local.http = http
+        return http
 
     def make_request(self, method, url=None, headers=None, formatter=None,
                      params=None, data=None, *args, **kwargs):
         """ Makes a request """
         headers = headers or {}
         headers.update(self.get_headers())
+        # the token actually sent; self.token may already be a newer one
+        token = headers.get('X-Auth-Token')
 
         if params:
             url = "%s?%s" % (url, unicode_urlencode(params))
@@ -55,9 +76,7 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
         response = _make_request(headers)
 
         if response.status_code == 401:
-            self.auth.authenticate()
-            self._authenticate()
-            headers.update(self.auth_headers)
+            headers.update(self._reauthenticate(token))
             response = _make_request(headers)
 
         response.raise_for_status()
@@ -110,3 +129,4 @@ class Authentication(BaseAuthentication):
             self.storage_url = response.headers['x-storage-url']
         if not self.auth_token or not self.storage_url:
             raise errors.AuthenticationError('Invalid Authentication Response')
+        self.cache_token()
@@ -8,7 +8,7 @@ import six
 from object_storage.transport import BaseAuthentication, \
     BaseAuthenticatedConnection
 from object_storage import errors
-from object_storage.utils import json
+from object_storage.utils import json, concurrent_map
 
 import logging
 logger = logging.getLogger('softlayer.transport.requests')
@@ -19,13 +19,35 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
         Connection that will authenticate if it isn't already
         and retry once if an auth error is returned.
     """
-    def __init__(self, auth, **kwargs):
+    def __init__(self, auth, lazy=False, prewarm=0, **kwargs):
+        """
+        @param auth: Authentication instance
+        @param lazy: authenticate on the first request instead of here
+        @param prewarm: authenticate and open this many keep-alive
+            connections in the background; implies lazy
+        """
         self.token = None
         self.storage_url = None
         self.auth = auth
-        self.auth.authenticate()
-        self._authenticate()
         self.session = requests.Session()
+        self.lazy = lazy or bool(prewarm)
+        if prewarm:
+            self.prewarm(prewarm)
+        elif not self.lazy:
+            self.ensure_authenticated()
+
+    def _needs_authentication(self):
+        return True
+
+    def _open_connections(self, count):
+        """ Sends `count` concurrent HEAD requests for the account, which
+            leaves as many connections in the session's pool """
+        def _head(_):
+            self.make_request('HEAD', self.storage_url)
+        for _, _, error in concurrent_map(_head, range(count),
+                                          workers=count):
+            if error is not None:
+                raise error
 
     def make_request(self, method, url=None, *args, **kwargs):
         """ Makes a request """
@@ -34,6 +56,8 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
         if _headers:
             headers.update(_headers)
         kwargs['headers'] = headers
+        # the token actually sent; self.token may already be a newer one
+        token = headers.get('X-Auth-Token')
 
         if 'verify' not in kwargs:
             kwargs['verify'] = True
@@ -45,7 +69,8 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
 
         res = self.session.request(method, url, *args, **kwargs)
         if kwargs.get('return_response', True):
-            res = self._check_success(res)
+            res = self._check_success(res, token,
+                                      stream=kwargs.get('stream', False))
             if res.status_code == 404:
                 raise errors.NotFound('Not found')
             try:
@@ -57,18 +82,42 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
             return formatter(res)
         return res
 
-    def _check_success(self, res):
+    def chunk_download(self, url, chunk_size=10 * 1024, headers=None):
+        """ Returns a generator that streams the response body of a GET
+            request over the session's pooled connections """
+        _headers = self.get_headers()
+        if headers:
+            _headers.update(headers)
+        token = _headers.get('X-Auth-Token')
+
+        res = self.session.get(url, headers=_headers, stream=True,
+                               verify=True)
+        res = self._check_success(res, token, stream=True)
+        try:
+            if res.status_code == 404:
+                raise errors.NotFound('Not found')
+            try:
+                res.raise_for_status()
+            except Exception as ex:
+                raise errors.ResponseError(res.status_code, str(ex))
+
+            for chunk in res.iter_content(chunk_size):
+                yield chunk
+        finally:
+            res.close()
+
+    def _check_success(self, res, token=None, **kwargs):
         """
             Checks for request success. If a 401 is returned, it will
-            authenticate again and retry the request.
+            authenticate again (or wait for the thread that already is) and
+            retry the request once with the new token.
         """
         if res.status_code == 401:
+            res.close()
 
             # Authenticate and try again with a (hopefully) new token
-            self.auth.authenticate()
-            self._authenticate()
-            res.request.headers.update(self.auth_headers)
-            res = self.session.send(res.request)
+            res.request.headers.update(self._reauthenticate(token))
+            res = self.session.send(res.request, **kwargs)
         return res
 
 
@@ -111,3 +160,4 @@ class Authentication(BaseAuthentication):
             self.storage_url = response.headers['x-storage-url']
         if not self.auth_token or not self.storage_url:
             raise errors.AuthenticationError('Invalid Authentication Response')
+        self.cache_token()
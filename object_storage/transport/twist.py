@@ -5,52 +5,77 @@
 """
 from zope import interface
 
-from object_storage.transport import requote_path
 from object_storage.errors import NotFound
 from object_storage.transport import Response, BaseAuthenticatedConnection, \
     BaseAuthentication
 from object_storage import errors
 
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, succeed, fail, \
+    inlineCallbacks
 from twisted.internet.protocol import Protocol
 from twisted.internet.ssl import ClientContextFactory
-from twisted.web.client import Agent
+from twisted.web.client import Agent, HTTPConnectionPool, ResponseDone
+from twisted.web.http import PotentialDataLoss
 from twisted.web.http_headers import Headers
 from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
 
-import urlparse
 import six
+from six.moves.urllib.parse import urlparse, urlunparse, quote
 
 from object_storage.utils import json, unicode_urlencode
 
+import logging
+logger = logging.getLogger('softlayer.transport.twisted')
 
-def complete_request(resp, callback=None, load_body=True):
+# characters left alone when quoting a path; '%' keeps quoted paths as is
+_SAFE_PATH_CHARS = "/%;:@&=+$,!~*'()"
+
+
+def _native(value):
+    """ Header names and values are bytes on Python 3 """
+    if isinstance(value, bytes) and not six.PY2:
+        return value.decode('latin-1')
+    return value
+
+
+def _bytes(value):
+    """ Agent.request() takes the method and URL as bytes """
+    if isinstance(value, six.text_type):
+        return value.encode('ascii')
+    return value
+
+
+def complete_request(resp, callback=None, load_body=True, write=None):
+    """ Builds a Response. The body is read before the status is checked so
+        that the connection can go back to the pool. With `write`, the body
+        is handed to write() as it arrives instead of being kept. """
     r = Response()
     r.status_code = resp.code
     r.version = resp.version
     r.phrase = resp.phrase
 
     for k, v in resp.headers.getAllRawHeaders():
-        r.headers[k.lower()] = v.pop()
-
-    if r.status_code == 404:
-        raise NotFound('Not found')
-    r.raise_for_status()
-
-    if not load_body:
-        if callback:
-            return callback(r)
-        return r
+        r.headers[_native(k).lower()] = _native(v[-1])
 
     def build_response(body):
         r.content = body
+        if r.status_code == 404:
+            raise NotFound('Not found')
+        r.raise_for_status()
         if callback:
             return callback(r)
         return r
 
+    if not load_body:
+        return build_response(b'')
+
     finished = Deferred()
-    resp.deliverBody(FullBodyReader(finished))
+    if write is not None and 200 <= r.status_code < 300:
+        resp.deliverBody(ChunkedBodyReader(finished, write,
+                                           _STREAM_CHUNK_SIZE))
+    else:
+        resp.deliverBody(FullBodyReader(finished))
 
     finished.addCallback(build_response)
     return finished
@@ -60,17 +85,60 @@ def print_error(failure):
     from twisted.web import _newclient
     if failure.check(_newclient.RequestGenerationFailed):
         for f in failure.value.reasons:
-            print f.getTraceback()
+            logger.error(f.getTraceback())
     return failure
 
 
+_STREAM_CHUNK_SIZE = 64 * 1024
+_shared_pool = None
+
+
+def shared_pool():
+    """ Returns the persistent HTTPConnectionPool used by requests that
+        aren't made through an AuthenticatedConnection with its own pool """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = make_pool()
+    return _shared_pool
+
+
+def make_pool(maxsize=None, idle_timeout=None):
+    """ Returns a persistent HTTPConnectionPool keeping up to maxsize idle
+        connections per host for idle_timeout seconds """
+    pool = HTTPConnectionPool(reactor, persistent=True)
+    pool.maxPersistentPerHost = \
+        maxsize or BaseAuthenticatedConnection.pool_maxsize
+    pool.cachedConnectionTimeout = \
+        idle_timeout or BaseAuthenticatedConnection.pool_idle_timeout
+    return pool
+
+
+def make_agent(pool=None):
+    """ Returns an Agent that reuses the connections of pool """
+    return Agent(reactor, WebClientContextFactory(),
+                 pool=pool or shared_pool())
+
+
 class AuthenticatedConnection(BaseAuthenticatedConnection):
-    def __init__(self, auth, **kwargs):
+    def __init__(self, auth, pool=None, **kwargs):
+        """
+        @param auth: Authentication instance
+        @param pool: HTTPConnectionPool to use; defaults to a persistent pool
+            of pool_maxsize connections per host
+        """
         self.token = None
         self.storage_url = None
         self.auth = auth
-
-    def authenticate(self):
+        self.pool = pool or make_pool(self.pool_maxsize,
+                                      self.pool_idle_timeout)
+        self.agent = make_agent(self.pool)
+
+    def authenticate(self, stale_token=None):
+        """ Authenticates, unless the auth's token cache has a token other
+            than stale_token """
+        if self.auth.load_cached_token(stale_token):
+            self._authenticate()
+            return succeed(None)
         d = self.auth.authenticate()
         d.addCallback(lambda r: self._authenticate())
         return d
@@ -78,11 +146,70 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
     def make_request(self, method, url=None, headers=None, *args, **kwargs):
         headers = headers or {}
         headers.update(self.get_headers())
+        kwargs.setdefault('agent', self.agent)
         return make_request(method, url=url, headers=headers, *args, **kwargs)
 
+    def chunk_upload(self, method, url, size=None, headers=None):
+        """ Returns a started ChunkedConnection """
+        _headers = headers or {}
+        conn = ChunkedConnection(self, url, headers=_headers, size=size,
+                                 method=method)
+        conn.setup()
+        return conn
+
+    def chunk_download(self, url, chunk_size=10 * 1024, headers=None,
+                       write=None, consumer=None):
+        """ Streams the body of a GET request to `write` (or to the write()
+            method of `consumer`) in pieces of at most chunk_size bytes.
+            Returns a Deferred that fires once the whole body has been
+            delivered. Without `write` the Deferred fires with the list of
+            chunks. """
+        _headers = headers or {}
+        chunks = []
+        if consumer is not None:
+            write = consumer.write
+        if write is None:
+            write = chunks.append
+
+        def _request(result=None):
+            request_headers = self.get_headers()
+            request_headers.update(_headers)
+            request_headers = Headers(
+                dict([(k, [v]) for k, v in request_headers.items()]))
+            return self.agent.request(b'GET', _bytes(_full_url(url)),
+                                      request_headers, None)
+
+        def _check_auth(resp):
+            if resp.code == 401:
+                # drain the body so the connection can be reused
+                drained = Deferred()
+                resp.deliverBody(FullBodyReader(drained))
+                drained.addCallback(lambda _: self.authenticate(self.token))
+                drained.addCallback(_request)
+                return drained
+            return resp
+
+        def _stream(resp):
+            if not 200 <= resp.code < 300:
+                return complete_request(resp)
+
+            finished = Deferred()
+            resp.deliverBody(ChunkedBodyReader(finished, write, chunk_size))
+            finished.addCallback(lambda _: chunks)
+            return finished
+
+        d = _request()
+        d.addCallback(_check_auth)
+        d.addCallback(_stream)
+        return d
+
 
 def make_request(method, url=None, headers=None, *args, **kwargs):
-    """ Makes a request """
+    """ Makes a request over a persistent connection.
+
+        Takes the `agent` to use (defaults to one using shared_pool()) and an
+        optional `write` callable that receives the body of a successful
+        response as it arrives instead of loading it into memory. """
     headers = Headers(dict([(k, [v]) for k, v in headers.items()]))
 
     formatter = None
@@ -103,21 +230,19 @@ def make_request(method, url=None, headers=None, *args, **kwargs):
     url = _full_url(url, params)
     body = kwargs.get('data')
 
-    # print method, url, headers, body
-
-    contextFactory = WebClientContextFactory()
-    agent = Agent(reactor, contextFactory)
+    agent = kwargs.get('agent') or make_agent()
     d = agent.request(
-        method,
-        url,
+        _bytes(method),
+        _bytes(url),
         headers,
         body)
 
-    load_body = True
-    if method.upper() in ['HEAD', 'DELETE']:
-        load_body = False
+    # every body is read, even when it's not needed, so that the connection
+    # can be reused
+    load_body = method.upper() != 'HEAD'
 
-    d.addCallback(complete_request, formatter, load_body=load_body)
+    d.addCallback(complete_request, formatter, load_body=load_body,
+                  write=kwargs.get('write'))
     d.addErrback(print_error)
     return d
 
@@ -126,23 +251,22 @@ def _full_url(url, _params={}):
     """Build the actual URL to use."""
 
     # Support for unicode domain names and paths.
-    scheme, netloc, path, params, query, fragment = urlparse.urlparse(url)
+    scheme, netloc, path, params, query, fragment = urlparse(url)
 
     if not scheme:
         raise ValueError("Invalid URL %r: No schema supplied" % url)
 
-    netloc = netloc.encode('idna')
+    netloc = netloc.encode('idna').decode('ascii')
 
-    if isinstance(path, unicode):
+    if six.PY2 and isinstance(path, six.text_type):
         path = path.encode('utf-8')
 
-    path = requote_path(path)
+    path = quote(path, safe=_SAFE_PATH_CHARS)
 
-    url = str(urlparse.urlunparse([scheme, netloc, path, params, query,
-                                   fragment]))
+    url = str(urlunparse([scheme, netloc, path, params, query, fragment]))
 
     if _params:
-        if urlparse.urlparse(url).query:
+        if urlparse(url).query:
             return '%s&%s' % (url, _params)
         else:
             return '%s?%s' % (url, _params)
@@ -185,6 +309,7 @@ class Authentication(BaseAuthentication):
                                             "storage URL. Using default.")
         if not self.auth_token or not self.storage_url:
             raise errors.AuthenticationError('Invalid Authentication Response')
+        self.cache_token()
 
     def authenticate(self):
         """ Does authentication """
@@ -202,15 +327,38 @@ class WebClientContextFactory(ClientContextFactory):
 
 
 class FullBodyReader(Protocol):
+    """ Collects the body in a list of pieces, joined once it's complete """
     def __init__(self, finished):
         self.finished = finished
-        self.body = ''
+        self.body = []
+
+    def dataReceived(self, data):
+        self.body.append(data)
+
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(b''.join(self.body))
+        else:
+            self.finished.errback(reason)
+
+
+class ChunkedBodyReader(Protocol):
+    """ Hands the body to `write` as it arrives, in pieces of at most
+        chunk_size bytes. """
+    def __init__(self, finished, write, chunk_size):
+        self.finished = finished
+        self.write = write
+        self.chunk_size = chunk_size
 
     def dataReceived(self, data):
-        self.body += data
+        for i in range(0, len(data), self.chunk_size):
+            self.write(data[i:i + self.chunk_size])
 
     def connectionLost(self, reason):
-        self.finished.callback(self.body)
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(None)
+        else:
+            self.finished.errback(reason)
 
 
 class ChunkedConnection:
@@ -219,15 +367,21 @@ class ChunkedConnection:
         setup() will initiate a HTTP connection.
         send_chunk() will send more data.
         finish() will end the request.
+
+        send_chunk() returns a Deferred that fires once the data has been
+        written and the connection is ready for more; waiting for it keeps
+        memory use bounded. finish() returns a Deferred that fires with the
+        response.
     """
-    def __init__(self, conn, url, headers=None, size=None):
+    def __init__(self, conn, url, headers=None, size=None, method='PUT',
+                 chunk_size=64 * 1024):
         self.conn = conn
         self.url = url
+        self.method = method
         self.req = None
         self.headers = headers
-        self.started = Deferred()
         self.size = size
-        self.body = ChunkedStreamProducer(self.started, self.size)
+        self.body = ChunkedStreamProducer(self.size, chunk_size=chunk_size)
 
     def setup(self, size=None):
         """
@@ -239,61 +393,102 @@ class ChunkedConnection:
         if not self.size:
             self.size = UNKNOWN_LENGTH
         self.body.length = self.size
-        req = self.conn.make_request('PUT', self.url,
-                                     headers=self.headers,
-                                     data=self.body)
-        self.req = req
-        print "ChunkedTwistedConnection: STARTED REQUEST"
+        self.req = self.conn.make_request(self.method, self.url,
+                                          headers=self.headers,
+                                          data=self.body)
 
     def send_chunk(self, chunk):
         """ Sends a chunk of data. """
-        print "ChunkedTwistedConnection: send chunk"
         return self.body.send(chunk)
+    send = send_chunk
+
+    def send_from(self, source):
+        """ Sends everything from a file-like object or from an iterable of
+            data or of Deferreds firing with data, one chunk at a time, and
+            finishes the request. Returns a Deferred that fires with the
+            response. """
+        d = self.body.send_from(source)
+        d.addCallback(lambda _: self.req)
+        return d
 
     def finish(self):
         """ Finished the request out and receives a response. """
-        self.body.finish()
+        d = self.body.finish()
+        d.addCallback(lambda _: self.req)
+        return d
 
 
+@interface.implementer(IBodyProducer)
 class ChunkedStreamProducer(object):
-    interface.implements(IBodyProducer)
+    """
+        IBodyProducer fed by send(). Data is written to the consumer in
+        pieces of at most chunk_size bytes; while the transport has paused
+        the producer, the Deferred returned by send() waits for it to
+        resume.
+    """
 
-    def __init__(self, started, length=UNKNOWN_LENGTH):
+    def __init__(self, length=UNKNOWN_LENGTH, chunk_size=64 * 1024):
         self.length = length
+        self.chunk_size = chunk_size
         self.consumer = None
-        self.started = Deferred()
+        self.paused = False
+        self.stopped = False
         self.finished = Deferred()
+        self._waiting = []
 
     def startProducing(self, consumer):
-        print "ChunkedStreamProducer: START PRODUCING"
         self.consumer = consumer
-        self.started.callback(None)
+        if not self.paused:
+            self.resumeProducing()
         return self.finished
 
-    def _send(self, result, data):
-        print "ChunkedStreamProducer: _SEND"
-        return self.consumer.write(data)
-
+    def _ready(self):
+        """ Returns a Deferred that fires when data can be written """
+        if self.stopped:
+            return fail(errors.ResponseError(0, 'Upload was stopped'))
+        if self.consumer is None or self.paused:
+            d = Deferred()
+            self._waiting.append(d)
+            return d
+        return succeed(None)
+
+    @inlineCallbacks
     def send(self, data):
-        print "ChunkedStreamProducer: SEND"
-        d = Deferred()
-        self.started.chainDeferred(d)
-        d.addCallback(self._send, data)
-        return d
+        for i in range(0, len(data), self.chunk_size):
+            yield self._ready()
+            self.consumer.write(data[i:i + self.chunk_size])
+
+    @inlineCallbacks
+    def send_from(self, source):
+        if hasattr(source, 'read'):
+            while True:
+                data = source.read(self.chunk_size)
+                if not data:
+                    break
+                yield self.send(data)
+        else:
+            for data in source:
+                if isinstance(data, Deferred):
+                    data = yield data
+                yield self.send(data)
+        yield self.finish()
 
+    @inlineCallbacks
     def finish(self):
-        def _finish(result):
-            self.finished.callback(None)
-            return None
-        d = Deferred()
-        self.started.chainDeferred(d)
-        d.addCallback(_finish)
-        return d
+        yield self._ready()
+        self.finished.callback(None)
 
     def pauseProducing(self):
-        print "pause"
-        pass
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
 
     def stopProducing(self):
-        print "STOP"
-        pass
+        self.stopped = True
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.errback(errors.ResponseError(0, 'Upload was stopped'))
@@ -4,8 +4,17 @@
     See COPYING for license information
 """
 
+import calendar
+import codecs
+import os
 import urllib
 import sys
+import threading
+from collections import deque
+from hashlib import md5
+
+import six
+from six.moves import queue
 
 try:
     import json
@@ -24,10 +33,16 @@ except ImportError:
     from collections import MutableMapping as DictMixin
 
 
-__all__ = ['json', 'unicode_quote', 'get_path', 'Model']
+__all__ = ['json', 'unicode_quote', 'get_path', 'Model', 'concurrent_map',
+           'concurrent_chain',
+           'iter_pages', 'split_keyspace', 'iter_json_array',
+           'iter_json_response', 'pwrite', 'preallocate', 'listing_time',
+           'file_md5']
 
 
 class Model(DictMixin):
+    __slots__ = ()
+
     def __getitem__(self, key):
         return self.properties[key]
 
@@ -71,3 +86,350 @@ def get_path(parts=None):
         else:
             path = '/'.join(map(unicode_quote, path.split('/')))
     return path
+
+
+def concurrent_map(func, items, workers=4, ordered=True, pending=None):
+    """
+        Calls func on every item using at most `workers` threads and yields
+        (item, result, error) tuples, either in input order or as they
+        complete. Items are pulled lazily; no more than `pending` items
+        (2 * workers by default) are outstanding at a time.
+    """
+    tasks = queue.Queue()
+    results = queue.Queue()
+    cancelled = threading.Event()
+
+    def _worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, item = task
+            if cancelled.is_set():
+                continue
+            try:
+                results.put((index, item, func(item), None))
+            except Exception as e:
+                results.put((index, item, None, e))
+
+    threads = []
+    for _ in range(max(1, workers)):
+        thread = threading.Thread(target=_worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    pending = max(1, pending or len(threads) * 2)
+    items = iter(items)
+    exhausted = False
+    submitted = 0
+    yielded = 0
+    done = {}
+    try:
+        while True:
+            while not exhausted and submitted - yielded < pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tasks.put((submitted, item))
+                submitted += 1
+            if yielded == submitted:
+                break
+            index, item, result, error = results.get()
+            if not ordered:
+                yielded += 1
+                yield item, result, error
+                continue
+            done[index] = (item, result, error)
+            while yielded in done:
+                result = done.pop(yielded)
+                yielded += 1
+                yield result
+    finally:
+        cancelled.set()
+        for _ in threads:
+            tasks.put(None)
+
+
+def concurrent_chain(func, items, workers=4, buffer_size=1):
+    """
+        Yields the values of func(item) for every item, item after item,
+        like itertools.chain. The iterators of up to `workers` items are
+        consumed ahead in background threads, each holding at most
+        buffer_size values that haven't been yielded yet.
+    """
+    stopped = threading.Event()
+
+    def _put(values, message):
+        while not stopped.is_set():
+            try:
+                values.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(item, values):
+        try:
+            for value in func(item):
+                if not _put(values, (True, value)):
+                    return
+        except Exception as e:
+            _put(values, (False, e))
+        else:
+            _put(values, (False, None))
+
+    def _start(item):
+        values = queue.Queue(maxsize=buffer_size)
+        thread = threading.Thread(target=_produce, args=(item, values))
+        thread.daemon = True
+        thread.start()
+        return values
+
+    items = iter(items)
+    running = deque()
+    try:
+        for item in items:
+            running.append(_start(item))
+            if len(running) >= workers:
+                break
+        while running:
+            values = running.popleft()
+            for item in items:
+                running.append(_start(item))
+                break
+            while True:
+                ok, value = values.get()
+                if not ok:
+                    if value is not None:
+                        raise value
+                    break
+                yield value
+    finally:
+        stopped.set()
+
+
+def iter_pages(fetch_page, marker=None, page_size=10000, prefetch=True):
+    """
+        Follows marker pagination of a listing and yields its entries in
+        order. fetch_page(marker) returns an iterable of (marker, entry)
+        tuples for up to page_size entries; a shorter page is the last one,
+        so page_size must not exceed the server's listing limit.
+        With prefetch, a background thread fetches the next page while the
+        caller handles the current one; at most about two pages are held
+        in memory.
+    """
+    def _entries():
+        _marker = marker
+        while True:
+            count = 0
+            for _marker, entry in fetch_page(_marker):
+                count += 1
+                yield entry
+            if count < page_size:
+                return
+
+    if not prefetch:
+        for entry in _entries():
+            yield entry
+        return
+
+    entries = queue.Queue(maxsize=page_size)
+    stopped = threading.Event()
+
+    def _put(message):
+        while not stopped.is_set():
+            try:
+                entries.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _producer():
+        try:
+            for entry in _entries():
+                if not _put((True, entry)):
+                    return
+        except Exception as e:
+            _put((False, e))
+        else:
+            _put((False, None))
+
+    thread = threading.Thread(target=_producer)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            ok, entry = entries.get()
+            if not ok:
+                if entry is not None:
+                    raise entry
+                return
+            yield entry
+    finally:
+        stopped.set()
+
+
+_CHARACTER_CLASSES = [u'0123456789',
+                      u'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                      u'abcdefghijklmnopqrstuvwxyz']
+_PRINTABLE = u''.join(six.unichr(c) for c in range(32, 127))
+
+
+def split_keyspace(low, high, count, depth=3, sample=()):
+    """
+        Returns up to count - 1 sorted names between low and high that split
+        the names in between into roughly even ranges. Every returned name
+        is greater than low, so (low, s0], (s0, s1], ... (sN, ) covers
+        everything after low.
+
+        The depth characters following the common prefix of low and high
+        are read as digits of a number. The digits used at each position are
+        the characters seen there in sample (names from the same listing),
+        widened to the whole character class (digits, upper or lower case
+        letters) of any character seen, so that e.g. date-stamped names are
+        split over dates rather than over all of printable ASCII. Without a
+        sample every printable ASCII character is used.
+    """
+    prefix = os.path.commonprefix([low, high])
+    names = list(sample) + [low, high]
+
+    def _alphabet(position):
+        offset = len(prefix) + position
+        seen = set(name[offset] for name in names if len(name) > offset)
+        if not sample:
+            seen.update(_PRINTABLE)
+        for characters in _CHARACTER_CLASSES:
+            if seen.intersection(characters):
+                seen.update(characters)
+        # digit 0 stands for the end of a shorter name
+        return [u''] + sorted(seen)
+
+    alphabets = [_alphabet(i) for i in range(depth)]
+
+    def _value(name):
+        value = 0
+        for i, alphabet in enumerate(alphabets):
+            char = name[len(prefix) + i:len(prefix) + i + 1]
+            value = value * len(alphabet) + alphabet.index(char)
+        return value
+
+    def _name(value):
+        chars = []
+        for alphabet in reversed(alphabets):
+            value, digit = divmod(value, len(alphabet))
+            chars.append(alphabet[digit])
+        chars.reverse()
+        if u'' in chars:
+            chars = chars[:chars.index(u'')]
+        return prefix + u''.join(chars)
+
+    start, end = _value(low), _value(high)
+    points = []
+    for i in range(1, count):
+        name = _name(start + (end - start) * i // count)
+        if name > low and (not points or name > points[-1]):
+            points.append(name)
+    return points
+
+
+def iter_json_array(chunks):
+    """
+        Incrementally parses a JSON array from an iterable of text or UTF-8
+        encoded chunks and yields each element as soon as it is complete,
+        so the whole document is never held in memory. Elements are
+        expected to be objects, as in Object Storage listings.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buff = ''
+    pos = 0
+    started = False
+    for chunk in chunks:
+        if isinstance(chunk, six.binary_type):
+            chunk = text.decode(chunk)
+        buff = buff[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buff) and buff[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buff):
+                break
+            if not started:
+                if buff[pos] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buff[pos] == ']':
+                return
+            try:
+                entry, pos = decoder.raw_decode(buff, pos)
+            except ValueError:
+                # Incomplete element; wait for more data
+                break
+            yield entry
+    if buff[pos:].strip():
+        raise ValueError('Truncated JSON array')
+
+
+def iter_json_response(res, chunk_size=64 * 1024):
+    """ Parses the JSON array in a response body as it is read """
+    return iter_json_array(res.iter_content(chunk_size))
+
+
+_pwrite_lock = threading.Lock()
+
+
+def pwrite(fd, data, offset):
+    """ Writes data to the file descriptor at the given offset without
+        moving a shared file position. Falls back to seek + write under a
+        lock where os.pwrite isn't available. """
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        while len(view):
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+    with _pwrite_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def preallocate(fd, size):
+    """ Reserves size bytes for the file behind the file descriptor """
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+def listing_time(value):
+    """ Returns a listing's last_modified as seconds since the epoch """
+    # parsed by hand: time.strptime isn't thread-safe on Python 2
+    seconds, _, fraction = value.partition('.')
+    day, _, clock = seconds.partition('T')
+    fields = [int(field) for field in day.split('-') + clock.split(':')]
+    return calendar.timegm(fields) + float('0.' + (fraction or '0'))
+
+
+def file_md5(filename, hash_cache=None):
+    """ Returns the hex MD5 of a file, from hash_cache
+        (`object_storage.cache.HashCache`) if given """
+    if hash_cache is not None:
+        return hash_cache.md5(filename)
+    checksum = md5()
+    f = open(filename, 'rb')
+    try:
+        for buff in iter(lambda: f.read(64 * 1024), b''):
+            checksum.update(buff)
+    finally:
+        f.close()
+    return checksum.hexdigest()
@@ -33,5 +33,6 @@ setup(
     test_suite='tests',
     packages=find_packages(exclude=['tests']),
     install_requires=requirements,
+    extras_require={'aio': ['aiohttp']},
     **extra_args
 )
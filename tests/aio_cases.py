@@ -0,0 +1,231 @@
+"""
+    asyncio client tests, imported by test_aio on Python 3.5+
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+from hashlib import md5
+from mock import Mock
+from object_storage.aio import AsyncClient, AsyncStorageObject
+from object_storage.errors import NotFound, ObjectStorageError
+from object_storage.transport import Response
+from object_storage.utils import json
+
+
+def _response(content=b'', headers=None):
+    res = Response()
+    res.status_code = 200
+    res.content = content
+    res.headers = headers or {}
+    return res
+
+
+class FakeConnection(object):
+    storage_url = 'http://storage'
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.uploaded = []
+
+    async def make_request(self, method, url=None, headers=None, params=None,
+                           data=None, formatter=None, **kwargs):
+        self.requests.append((method, url, params, headers))
+        res = self.responses.pop(0)
+        if isinstance(res, Exception):
+            raise res
+        return formatter(res) if formatter else res
+
+    async def chunk_download(self, url, chunk_size=10 * 1024, headers=None):
+        for chunk in self.responses.pop(0):
+            yield chunk
+
+    def chunk_upload(self, method, url, size=None, headers=None):
+        upload = Mock()
+        conn = self
+
+        async def send(chunk):
+            conn.uploaded.append(chunk)
+
+        async def finish():
+            return _response(headers={
+                'etag': md5(b''.join(conn.uploaded)).hexdigest()})
+        upload.send = send
+        upload.finish = finish
+        return upload
+
+
+class AsyncClientTest(unittest.TestCase):
+    def _run(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def _client(self, *responses):
+        self.conn = FakeConnection(responses)
+        return AsyncClient('username', 'api_key', connection=self.conn)
+
+    def test_iter_listing(self):
+        client = self._client(
+            _response(json.dumps([{'name': 'a'}, {'name': 'b'}]).encode()),
+            _response(b'[{"name": "c"}]'))
+
+        async def _list():
+            return [obj.name async for obj in
+                    client.container('c').iter_objects(page_size=2)]
+        self.assertEqual(self._run(_list()), ['a', 'b', 'c'])
+        self.assertEqual(self.conn.requests[1][2]['marker'], 'b')
+
+    def test_inherited_methods_are_awaitable(self):
+        client = self._client(_response(b'[{"name": "a"}]'))
+        objects = self._run(client.container('c').objects())
+        self.assertTrue(isinstance(objects[0], AsyncStorageObject))
+
+    def test_exists(self):
+        client = self._client(_response(headers={'content-length': '3'}),
+                              NotFound('Not found'))
+        obj = client.storage_object('c', 'o')
+        self.assertTrue(self._run(obj.exists()))
+        self.assertEqual(obj.model['size'], 3)
+        self.assertFalse(self._run(obj.exists()))
+
+    def test_streaming_read_and_send(self):
+        client = self._client([b'ab', b'c'])
+        obj = client.storage_object('c', 'o')
+
+        async def _read():
+            return [chunk async for chunk in obj.chunk_download()]
+        self.assertEqual(self._run(_read()), [b'ab', b'c'])
+
+        self._run(obj.send(b'data'))
+        self.assertEqual(b''.join(self.conn.uploaded), b'data')
+        self.assertEqual(obj.model['size'], 4)
+
+    def test_read_objects(self):
+        client = self._client(_response(b'a'), NotFound('Not found'))
+        results = self._run(client.read_objects([('c', 'a'), ('c', 'b')],
+                                                limit=1))
+        self.assertEqual(results[0], (('c', 'a'), b'a', None))
+        self.assertTrue(isinstance(results[1][2], NotFound))
+
+    def test_delete_container_recursive(self):
+        client = self._client(
+            _response(b'[{"name": "a"}, {"name": "b"}]'),
+            _response(), NotFound('Not found'), _response())
+        self.assertTrue(self._run(client.delete_container('c',
+                                                          recursive=True)))
+        self.assertEqual([(method, url) for method, url, _, _ in
+                          self.conn.requests[1:]],
+                         [('DELETE', 'http://storage/c/a'),
+                          ('DELETE', 'http://storage/c/b'),
+                          ('DELETE', 'http://storage/c')])
+
+    def test_sync_only_methods_are_absent(self):
+        client = self._client()
+        container = client.container('c')
+        obj = client.storage_object('c', 'o')
+        for owner, name in [(container, 'walk'),
+                            (container, 'download_prefix'),
+                            (obj, 'read_parallel'), (obj, 'send_segments'),
+                            (obj, 'upload_directory'),
+                            (client, 'iter_listing_partitioned'),
+                            (client, 'container_index')]:
+            self.assertFalse(hasattr(owner, name), name)
+        self.assertRaises(TypeError, obj.save_to_filename, 'file',
+                          workers=4)
+
+    def test_save_to_filename(self):
+        client = self._client([b'ab', b'c'])
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'file')
+            self._run(client.storage_object('c', 'o').save_to_filename(
+                filename))
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), b'abc')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_model_needs_load(self):
+        client = self._client(_response(headers={
+            'content-length': '3', 'content-type': 'text/directory'}))
+        obj = client.storage_object('c', 'o')
+        for read in (lambda: obj.properties, lambda: obj.headers,
+                     lambda: obj.meta, lambda: len(obj)):
+            self.assertRaises(ObjectStorageError, read)
+        self.assertTrue(self._run(obj.is_dir()))
+        self.assertEqual(len(obj), 3)
+        self.assertEqual(obj.properties['size'], 3)
+        self.assertEqual(self._run(obj.get_info())['size'], 3)
+        self.assertEqual(len(self.conn.requests), 1)
+
+    def test_listings_are_async_iterators(self):
+        client = self._client(_response(b'[{"name": "o/a"}]'))
+        obj = client.storage_object('c', 'o')
+        self.assertRaises(TypeError, iter, obj)
+        self.assertRaises(TypeError, iter, client.container('c'))
+        self.assertRaises(TypeError, iter, client)
+
+        async def _list():
+            return [child.name async for child in obj.iter_list()]
+        self.assertEqual(self._run(_list()), ['o/a'])
+        self.assertEqual(self.conn.requests[0][2]['prefix'], 'o/')
+
+    def test_container_rename_and_account_metadata(self):
+        client = self._client(_response(), _response(), _response())
+        self._run(client.container('a').rename(client.container('b')))
+        self._run(client.set_metadata({'key': 'value'}))
+        self.assertEqual([(method, url) for method, url, _, _ in
+                          self.conn.requests],
+                         [('DELETE', 'http://storage/a'),
+                          ('PUT', 'http://storage/b'),
+                          ('POST', 'http://storage')])
+        self.assertEqual(self.conn.requests[2][3],
+                         {'x-account-meta-key': 'value'})
+
+    def test_delete_all_objects_in_batches(self):
+        client = self._client(
+            _response(b'[{"name": "a"}, {"name": "b"}]'),
+            _response(), _response(),
+            _response(b'[{"name": "c"}]'),
+            NotFound('Not found'))
+        client.listing_limit = 2
+        client.bulk_delete_size = 2
+        result = self._run(client.container('c').delete_all_objects())
+        self.assertEqual(result, {'deleted': 2, 'not_found': 1,
+                                  'errors': []})
+        # the first page is deleted before the second one is listed
+        self.assertEqual([(method, url) for method, url, _, _ in
+                          self.conn.requests],
+                         [('GET', 'http://storage/c'),
+                          ('DELETE', 'http://storage/c/a'),
+                          ('DELETE', 'http://storage/c/b'),
+                          ('GET', 'http://storage/c'),
+                          ('DELETE', 'http://storage/c/c')])
+
+    def test_gather_cancels_on_unexpected_error(self):
+        client = self._client()
+        cancelled = []
+
+        async def _func(item):
+            if item == 'fail':
+                raise asyncio.TimeoutError()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(item)
+                raise
+        self.assertRaises(asyncio.TimeoutError, self._run,
+                          client._gather(_func, ['a', 'fail', 'b'], 10))
+        self.assertEqual(sorted(cancelled), ['a', 'b'])
+
+
+if __name__ == "__main__":
+    unittest.main()
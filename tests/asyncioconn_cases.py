@@ -0,0 +1,139 @@
+"""
+    aiohttp transport tests, imported by test_asyncioconn on Python 3.5+
+    when aiohttp is installed
+"""
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import asyncio
+from hashlib import md5
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from object_storage.errors import NotFound, ResponseError
+from object_storage.transport.asyncioconn import AuthenticatedConnection, \
+    Authentication
+from object_storage.utils import json
+
+
+class FakeSwift(object):
+    """ Just enough of the auth and object API, with tokens that can be
+        expired """
+    def __init__(self):
+        self.tokens = 0
+        self.objects = {'c/o': b'0123456789'}
+        self.app = web.Application()
+        self.app.router.add_get('/auth', self.auth)
+        self.app.router.add_route('*', '/v1/{path:.*}', self.storage)
+
+    @property
+    def token(self):
+        return 'TOKEN%d' % self.tokens
+
+    async def auth(self, request):
+        self.tokens += 1
+        url = str(request.url.with_path('/v1'))
+        return web.Response(
+            headers={'x-auth-token': self.token},
+            text=json.dumps({'storage': {'default': 'public',
+                                         'public': url}}))
+
+    async def storage(self, request):
+        if request.headers.get('X-Auth-Token') != self.token:
+            return web.Response(status=401)
+        path = request.match_info['path']
+        if request.method == 'PUT':
+            body = await request.read()
+            self.objects[path] = body
+            return web.Response(status=201,
+                                headers={'etag': md5(body).hexdigest()})
+        if path not in self.objects:
+            return web.Response(status=404)
+        return web.Response(body=self.objects[path])
+
+
+class AuthenticatedConnectionTest(unittest.TestCase):
+    def _run(self, test):
+        loop = asyncio.new_event_loop()
+
+        async def _test():
+            server = TestServer(self.swift.app)
+            await server.start_server()
+            auth = Authentication('username', 'api_key',
+                                  auth_url=str(server.make_url('/auth')))
+            conn = AuthenticatedConnection(auth)
+            try:
+                return await test(conn)
+            finally:
+                await conn.close()
+                await server.close()
+        try:
+            return loop.run_until_complete(_test())
+        finally:
+            loop.close()
+
+    def test_make_request(self):
+        async def _get(conn):
+            await conn.authenticate()
+            res = await conn.make_request('GET', conn.storage_url + '/c/o',
+                                          formatter=lambda r: r.content)
+            head = await conn.make_request('HEAD', conn.storage_url + '/c/o')
+            return res, head
+        content, head = self._run(_get)
+        self.assertEqual(content, b'0123456789')
+        self.assertEqual(head.headers['content-length'], '10')
+        self.assertEqual(self.swift.tokens, 1)
+
+    def test_not_found(self):
+        async def _get(conn):
+            await conn.authenticate()
+            await conn.make_request('GET', conn.storage_url + '/c/missing')
+        self.assertRaises(NotFound, self._run, _get)
+
+    def test_retries_after_expired_token(self):
+        async def _get(conn):
+            await conn.authenticate()
+            self.swift.tokens += 1
+            return await asyncio.gather(*[
+                conn.make_request('GET', conn.storage_url + '/c/o')
+                for _ in range(5)])
+        results = self._run(_get)
+        self.assertEqual([r.content for r in results], [b'0123456789'] * 5)
+        # the five 401s were answered by a single authentication
+        self.assertEqual(self.swift.tokens, 3)
+
+    def test_chunk_download(self):
+        async def _get(conn):
+            await conn.authenticate()
+            return [chunk async for chunk in conn.chunk_download(
+                conn.storage_url + '/c/o', chunk_size=4)]
+        chunks = self._run(_get)
+        self.assertEqual(b''.join(chunks), b'0123456789')
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+
+    def test_chunk_upload(self):
+        async def _put(conn):
+            await conn.authenticate()
+            upload = conn.chunk_upload('PUT', conn.storage_url + '/c/new',
+                                       size=6)
+            for chunk in [b'ab', b'cd', b'ef']:
+                await upload.send(chunk)
+            return await upload.finish()
+        res = self._run(_put)
+        self.assertEqual(res.headers['etag'], md5(b'abcdef').hexdigest())
+        self.assertEqual(self.swift.objects['c/new'], b'abcdef')
+
+    def test_chunk_upload_is_not_retried(self):
+        async def _put(conn):
+            await conn.authenticate()
+            self.swift.tokens += 1
+            upload = conn.chunk_upload('PUT', conn.storage_url + '/c/new')
+            await upload.send(b'data')
+            return await upload.finish()
+        self.assertRaises(ResponseError, self._run, _put)
+        self.assertFalse('c/new' in self.swift.objects)
+
+    def setUp(self):
+        self.swift = FakeSwift()
@@ -0,0 +1,8 @@
+"""
+    The asyncio client uses Python 3.5+ syntax, so its tests are only
+    imported there.
+"""
+import sys
+
+if sys.version_info >= (3, 5):
+    from tests.aio_cases import *  # NOQA
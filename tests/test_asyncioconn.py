@@ -0,0 +1,13 @@
+"""
+    The aiohttp transport needs Python 3.5+ and aiohttp, so its tests are
+    only imported where both are available.
+"""
+import sys
+
+if sys.version_info >= (3, 5):
+    try:
+        import aiohttp  # NOQA
+    except ImportError:
+        pass
+    else:
+        from tests.asyncioconn_cases import *  # NOQA
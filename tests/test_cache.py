@@ -0,0 +1,309 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import os
+import shutil
+import tempfile
+from mock import Mock
+from hashlib import md5
+from object_storage.cache import MetadataCache, ContentCache, HashCache, \
+    TokenCache
+from object_storage.errors import NotFound, ResponseError
+from object_storage.storage_object import StorageObject
+from object_storage.transport import Response, BaseAuthentication, \
+    BaseAuthenticatedConnection
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_fetch_caches(self):
+        head = Mock(return_value=(200, {'etag': 'abc'}))
+        self.assertEqual(self.cache.fetch('key', head), {'etag': 'abc'})
+        self.assertEqual(self.cache.fetch('key', head), {'etag': 'abc'})
+        head.assert_called_once_with({})
+
+    def test_fetch_revalidates_expired(self):
+        self.cache.ttl = -1
+        self.cache.set('key', {'etag': 'abc'})
+        head = Mock(side_effect=ResponseError(304, 'Not Modified'))
+        self.assertEqual(self.cache.fetch('key', head), {'etag': 'abc'})
+        head.assert_called_once_with({'If-None-Match': 'abc'})
+
+    def test_fetch_revalidate_status(self):
+        self.cache.ttl = -1
+        self.cache.set('key', {'etag': 'abc'})
+        head = Mock(return_value=(304, {}))
+        self.assertEqual(self.cache.fetch('key', head), {'etag': 'abc'})
+
+    def test_negative_entry(self):
+        head = Mock(side_effect=NotFound('Not found'))
+        self.assertRaises(NotFound, self.cache.fetch, 'key', head)
+        self.assertRaises(NotFound, self.cache.fetch, 'key', head)
+        self.assertEqual(head.call_count, 1)
+
+    def test_lru(self):
+        self.cache.set('a', {})
+        self.cache.set('b', {})
+        self.cache.get('a')
+        self.cache.set('c', {})
+        self.assertEqual(list(self.cache.entries), ['a', 'c'])
+
+    def test_invalidate(self):
+        self.cache.set('a', {})
+        self.cache.invalidate('a')
+        self.assertTrue(self.cache.get('a') is None)
+
+    def test_storage_object(self):
+        client = Mock()
+        client.metadata_cache = self.cache
+        client.make_request.return_value = (200, {'content-length': '5'})
+        obj = StorageObject('CONTAINER', 'NAME', client=client)
+        self.assertTrue(obj.exists())
+        obj.model = None
+        self.assertEqual(len(obj), 5)
+        self.assertEqual(client.make_request.call_count, 1)
+
+        obj.set_metadata({'a': 'b'})
+        self.assertTrue(self.cache.get(('CONTAINER', 'NAME')) is None)
+
+    def setUp(self):
+        self.cache = MetadataCache(max_entries=2, ttl=60)
+
+
+class ContentCacheTest(unittest.TestCase):
+    def _response(self, status, body=b'', etag=None):
+        res = Response()
+        res.status_code = status
+        res.headers = {'etag': etag} if etag else {}
+        res.content = body
+        return res
+
+    def _get(self, res):
+        def make_request(method, path, **kwargs):
+            self.requests.append(kwargs.get('headers'))
+            if isinstance(res, Exception):
+                raise res
+            return kwargs['formatter'](res)
+        self.client.make_request = make_request
+
+    def test_miss_then_revalidate(self):
+        self._get(self._response(200, b'data', etag='abc'))
+        self.assertEqual(self.obj.read(), b'data')
+        self.assertEqual(self.requests, [{}])
+
+        self._get(ResponseError(304, 'Not Modified'))
+        self.assertEqual(self.obj.read(), b'data')
+        self.assertEqual(self.requests[1], {'If-None-Match': 'abc'})
+
+    def test_changed_object(self):
+        self.cache.store('CONTAINER', 'NAME', 'abc', [b'old'])
+        self._get(self._response(200, b'new', etag='def'))
+        self.assertEqual(self.obj.read(), b'new')
+        self.assertEqual(self.cache.lookup('CONTAINER', 'NAME')['etag'],
+                         'def')
+
+    def test_chunk_download(self):
+        self.cache.store('CONTAINER', 'NAME', 'abc', [b'0123456789'])
+        self._get(self._response(304))
+        chunks = list(self.obj.chunk_download(chunk_size=4))
+        self.assertEqual(chunks, [b'0123', b'4567', b'89'])
+        self.assertTrue(all(isinstance(c, bytes) for c in chunks))
+
+    def test_evicted_after_not_modified(self):
+        self.cache.store('CONTAINER', 'NAME', 'abc', [b'old'])
+        responses = [ResponseError(304, 'Not Modified'),
+                     self._response(200, b'new', etag='def')]
+
+        def make_request(method, path, **kwargs):
+            self.requests.append(kwargs.get('headers'))
+            res = responses.pop(0)
+            if isinstance(res, Exception):
+                # another process evicts the entry meanwhile
+                os.remove(self.cache._path('CONTAINER', 'NAME'))
+                raise res
+            return kwargs['formatter'](res)
+        self.client.make_request = make_request
+
+        self.assertEqual(self.obj.read(), b'new')
+        self.assertEqual(self.requests, [{'If-None-Match': 'abc'}, {}])
+
+    def test_writes_invalidate(self):
+        self.client.make_request.return_value = True
+        for write in (lambda: self.obj.update({'X-Test': '1'}),
+                      lambda: self.obj.set_metadata({'test': '1'}),
+                      lambda: self.obj.chunk_upload()):
+            self.cache.store('CONTAINER', 'NAME', 'abc', [b'old'])
+            write()
+            self.assertTrue(self.cache.lookup('CONTAINER', 'NAME') is None)
+
+    def test_range_read_bypasses_cache(self):
+        self._get(self._response(206, b'01'))
+        self.assertEqual(self.obj.read(size=2), b'01')
+        self.assertTrue(self.cache.lookup('CONTAINER', 'NAME') is None)
+
+    def test_eviction(self):
+        self.cache.max_bytes = 10
+        self.cache.store('C', 'a', 'a', [b'x' * 6])
+        os.utime(self.cache._path('C', 'a'), (0, 0))
+        self.cache.store('C', 'b', 'b', [b'x' * 6])
+        self.assertTrue(self.cache.lookup('C', 'a') is None)
+        self.assertEqual(self.cache.lookup('C', 'b')['size'], 6)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ContentCache(self.directory, max_bytes=1024)
+        self.requests = []
+        self.client = Mock()
+        self.client.metadata_cache = None
+        self.client.content_cache = self.cache
+        self.obj = StorageObject('CONTAINER', 'NAME', client=self.client)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class HashCacheTest(unittest.TestCase):
+    def _write(self, data):
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+
+    def test_md5_cached_until_file_changes(self):
+        self._write(b'data')
+        self.assertEqual(self.cache.md5(self.filename),
+                         md5(b'data').hexdigest())
+        self.assertEqual(self.cache.get(self.filename),
+                         md5(b'data').hexdigest())
+        self._write(b'other')
+        self.assertTrue(self.cache.get(self.filename) is None)
+        self.assertEqual(self.cache.md5(self.filename),
+                         md5(b'other').hexdigest())
+
+    def test_compact(self):
+        self._write(b'data')
+        self.cache.md5(self.filename)
+        self.assertEqual(self.cache.compact(), 0)
+        os.remove(self.filename)
+        self.assertEqual(self.cache.compact(), 1)
+
+    def test_send_caches_md5(self):
+        self._write(b'data')
+        client = Mock()
+        client.hash_cache = self.cache
+        conn = client.chunk_upload.return_value
+        del conn.send_from
+        conn.finish.return_value.headers = {
+            'etag': md5(b'data').hexdigest()}
+        obj = StorageObject('CONTAINER', 'NAME', client=client)
+        with open(self.filename, 'rb') as f:
+            obj.send(f)
+        self.assertEqual(self.cache.get(self.filename),
+                         md5(b'data').hexdigest())
+
+    def test_send_file_changed_while_uploading(self):
+        self._write(b'data')
+        client = Mock()
+        client.hash_cache = self.cache
+        conn = client.chunk_upload.return_value
+        del conn.send_from
+        res = Mock()
+        res.headers = {'etag': md5(b'data').hexdigest()}
+
+        def _finish():
+            # rewritten after it was read but before the upload finished
+            self._write(b'changed')
+            return res
+        conn.finish.side_effect = _finish
+        obj = StorageObject('CONTAINER', 'NAME', client=client)
+        with open(self.filename, 'rb') as f:
+            obj.send(f)
+        # the MD5 of the old content isn't cached for the new content
+        self.assertTrue(self.cache.get(self.filename) is None)
+
+    def test_send_uses_cached_md5(self):
+        self._write(b'data')
+        self.cache.set(self.filename, md5(b'data').hexdigest())
+        client = Mock()
+        client.hash_cache = self.cache
+        conn = client.chunk_upload.return_value
+        del conn.send_from
+        conn.finish.return_value.headers = {
+            'etag': md5(b'data').hexdigest()}
+        obj = StorageObject('CONTAINER', 'NAME', client=client)
+        with open(self.filename, 'rb') as f:
+            obj.send(f)
+        conn.send.assert_called_once_with(b'data')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'file')
+        self.cache = HashCache(os.path.join(self.directory, 'hashes.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+
+class TokenCacheTest(unittest.TestCase):
+    def test_set_get_invalidate(self):
+        self.assertTrue(self.cache.get('auth_url', 'user') is None)
+        self.cache.set('auth_url', 'user', 'TOKEN', 'STORAGE_URL')
+        self.cache.set('auth_url', 'other', 'OTHER', 'STORAGE_URL')
+        self.assertEqual(TokenCache(self.path).get('auth_url', 'user'),
+                         ('TOKEN', 'STORAGE_URL'))
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+        self.cache.invalidate('auth_url', 'user', 'STALE')
+        self.assertEqual(self.cache.get('auth_url', 'user'),
+                         ('TOKEN', 'STORAGE_URL'))
+        self.cache.invalidate('auth_url', 'user', 'TOKEN')
+        self.assertTrue(self.cache.get('auth_url', 'user') is None)
+        self.assertEqual(self.cache.get('auth_url', 'other'),
+                         ('OTHER', 'STORAGE_URL'))
+
+    def test_authentication_shares_token(self):
+        auth = BaseAuthentication(auth_url='auth_url', token_cache=self.cache)
+        self.assertFalse(auth.load_cached_token())
+        auth.authenticate()
+
+        other = BaseAuthentication(auth_url='auth_url',
+                                   token_cache=TokenCache(self.path))
+        self.assertTrue(other.load_cached_token())
+        self.assertTrue(other.authenticated)
+        self.assertEqual(other.auth_token, 'AUTH_TOKEN')
+        self.assertEqual(other.storage_url, 'STORAGE_URL')
+        self.assertFalse(other.load_cached_token('AUTH_TOKEN'))
+
+    def test_get_does_not_create_file(self):
+        self.assertTrue(self.cache.get('auth_url', 'user') is None)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_rejected_token_invalidated_before_authenticating(self):
+        auth = BaseAuthentication(auth_url='auth_url', token_cache=self.cache)
+        auth.authenticate()
+        conn = BaseAuthenticatedConnection()
+        conn.auth = auth
+        conn._authenticate()
+
+        cached = []
+
+        def _authenticate():
+            cached.append(self.cache.get('auth_url', None))
+            auth.auth_token = 'NEW_TOKEN'
+            auth.cache_token()
+        auth.authenticate = _authenticate
+        conn._reauthenticate('AUTH_TOKEN')
+        self.assertEqual(cached, [None])
+        self.assertEqual(self.cache.get('auth_url', None),
+                         ('NEW_TOKEN', 'STORAGE_URL'))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tokens.json')
+        self.cache = TokenCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,11 @@ except ImportError:
     import unittest
 from mock import Mock
 from object_storage.client import Client
-from object_storage.errors import ResponseError, ContainerNotEmpty
+from object_storage.transport import Response
+from object_storage.utils import iter_json_array, json, split_keyspace, \
+    concurrent_chain, listing_time
+from object_storage.errors import ResponseError, ContainerNotEmpty, \
+    NotFound
 
 
 class ClientTest(unittest.TestCase):
@@ -73,6 +77,192 @@ class ClientTest(unittest.TestCase):
                           self.client.delete_container,
                           'container')
 
+    def test_delete_objects_bulk(self):
+        self.client.bulk_delete_size = 2
+        self.client._bulk_delete = Mock(side_effect=[
+            {'deleted': 2, 'not_found': 0, 'errors': []},
+            {'deleted': 0, 'not_found': 1, 'errors': [('/c/d', '500')]}])
+        result = self.client.delete_objects('c', ['a', 'b', 'c'])
+        self.assertEqual(result, {'deleted': 2, 'not_found': 1,
+                                  'errors': [('/c/d', '500')]})
+        self.assertEqual([c[0][1] for c in
+                          self.client._bulk_delete.call_args_list],
+                         [['a', 'b'], ['c']])
+
+    def test_delete_objects_fallback(self):
+        self.client._bulk_delete = Mock(return_value=None)
+        self.client.delete_object = Mock(
+            side_effect=[True, NotFound('Not found'), True])
+        result = self.client.delete_objects('c', ['a', 'b', 'c'])
+        self.assertEqual(result, {'deleted': 2, 'not_found': 1,
+                                  'errors': []})
+        self.assertEqual(self.client._bulk_delete.call_count, 1)
+
+    def test_delete_object_invalidates_content_cache(self):
+        self.client.content_cache = Mock()
+        self.client.make_request = Mock(return_value=True)
+        self.assertTrue(self.client.delete_object('c', 'o'))
+        self.client.content_cache.invalidate.assert_called_once_with('c', 'o')
+
+    def test_get_objects(self):
+        def _get_object(container, name):
+            if name == 'b':
+                raise NotFound('Not found')
+            return name
+        self.client.get_object = Mock(side_effect=_get_object)
+        results = list(self.client.get_objects([('c', 'a'), ('c', 'b'),
+                                                ('c', 'c')], workers=2))
+        self.assertEqual([r[0] for r in results],
+                         [('c', 'a'), ('c', 'b'), ('c', 'c')])
+        self.assertEqual([r[1] for r in results], ['a', None, 'c'])
+        self.assertTrue(isinstance(results[1][2], NotFound))
+
+    def test_read_objects(self):
+        obj = Mock()
+        obj.read.return_value = b'data'
+        self.client.storage_object = Mock(return_value=obj)
+        results = list(self.client.read_objects([('c', 'a')],
+                                                ordered=False))
+        self.assertEqual(results, [(('c', 'a'), b'data', None)])
+        self.client.storage_object.assert_called_once_with('c', 'a')
+
+    def test_bulk_delete_request(self):
+        self.client.make_request = Mock()
+        self.client._bulk_delete('c', ['a', 'b c'])
+        kwargs = self.client.make_request.call_args[1]
+        self.assertEqual(kwargs['data'], '/c/a\n/c/b%20c')
+        self.assertEqual(kwargs['params'], {'bulk-delete': ''})
+
+    def test_bulk_delete_unsupported(self):
+        for error in [NotFound('Not found'),
+                      ResponseError(405, '405 Client Error')]:
+            self.client.make_request = Mock(side_effect=error)
+            self.assertTrue(self.client._bulk_delete('c', ['a']) is None)
+
+    def test_bulk_delete_errors_raise(self):
+        for status in [401, 413, 503]:
+            self.client.make_request = Mock(
+                side_effect=ResponseError(status, 'Error'))
+            self.assertRaises(ResponseError, self.client._bulk_delete,
+                              'c', ['a'])
+
+    def _pages(self, *pages):
+        responses = []
+        for page in pages:
+            response = Response()
+            response.content = page.encode('utf8')
+            responses.append(response)
+
+        def _make_request(*args, **kwargs):
+            return kwargs['formatter'](responses.pop(0))
+        self.client.make_request = Mock(side_effect=_make_request)
+
+    def test_iter_listing(self):
+        for prefetch in (False, True):
+            self._pages('[{"name": "a"}, {"subdir": "b/"}]',
+                        '[{"name": "c"}]')
+            items = list(self.client.iter_listing(['c'], page_size=2,
+                                                  params={'delimiter': '/'},
+                                                  prefetch=prefetch))
+            self.assertEqual(items, [{'name': 'a'}, {'subdir': 'b/'},
+                                     {'name': 'c'}])
+            params = [c[1]['params'] for c in
+                      self.client.make_request.call_args_list]
+            self.assertEqual(params, [
+                {'format': 'json', 'limit': 2, 'delimiter': '/'},
+                {'format': 'json', 'limit': 2, 'delimiter': '/',
+                 'marker': 'b/'}])
+
+    def test_iter_listing_page_size_capped(self):
+        self.client.listing_limit = 2
+        self._server(['a', 'b', 'c', 'd', 'e'])
+        items = list(self.client.iter_listing(['c'], page_size=10000))
+        self.assertEqual([item['name'] for item in items],
+                         ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(
+            [c[1]['params']['limit'] for c in
+             self.client.make_request.call_args_list], [2, 2, 2])
+
+    def test_iter_listing_error(self):
+        self.client.make_request = Mock(side_effect=ResponseError(500, ''))
+        self.assertRaises(ResponseError, list,
+                          self.client.iter_listing(['c']))
+
+    def _server(self, names, reverse=True):
+        def _make_request(method, path, params=None, **kwargs):
+            found = [n for n in names
+                     if n > params.get('marker', '') and
+                     n < params.get('end_marker', u'\uffff')]
+            if reverse and params.get('reverse'):
+                found.reverse()
+            response = Response()
+            response.content = json.dumps(
+                [{'name': n} for n in found[:params['limit']]]).encode('utf8')
+            return kwargs['formatter'](response)
+        self.client.make_request = Mock(side_effect=_make_request)
+
+    def test_iter_listing_partitioned(self):
+        names = sorted(['%05d' % i for i in range(0, 2000, 7)] +
+                       ['12P', '24h', 'z', u'\u00e9'])
+        for reverse in (True, False):
+            self._server(names, reverse=reverse)
+            items = list(self.client.iter_listing_partitioned(
+                ['c'], page_size=10, partitions=5, workers=3))
+            self.assertEqual([item['name'] for item in items], names)
+
+    def test_iter_listing_partitioned_single_page(self):
+        self._server(['a', 'b'])
+        items = list(self.client.iter_listing_partitioned(['c'],
+                                                          page_size=10))
+        self.assertEqual(items, [{'name': 'a'}, {'name': 'b'}])
+        self.assertEqual(self.client.make_request.call_count, 1)
+
+    def test_iter_listing_partitioned_marker(self):
+        names = ['%03d' % i for i in range(100)]
+        self._server(names)
+        items = list(self.client.iter_listing_partitioned(
+            ['c'], marker='049', page_size=10, partitions=4, workers=2))
+        self.assertEqual([item['name'] for item in items], names[50:])
+
+    def test_listing_time(self):
+        self.assertEqual(listing_time('2024-04-01T12:30:15.250000'),
+                         1711974615.25)
+        self.assertEqual(listing_time('1970-01-02T00:00:00'), 86400)
+
+    def test_split_keyspace(self):
+        self.assertEqual(split_keyspace('logs/2020', 'logs/2024', 4),
+                         ['logs/2021', 'logs/2022', 'logs/2023'])
+        self.assertEqual(split_keyspace('a', 'a', 4), [])
+
+    def test_split_keyspace_sample(self):
+        sample = ['logs/2024-01-%02d' % day for day in range(1, 32)]
+        self.assertEqual(split_keyspace('logs/2024-01-31', 'logs/2024-12-31',
+                                        4, sample=sample),
+                         ['logs/2024-04-', 'logs/2024-07-', 'logs/2024-1'])
+
+    def test_concurrent_chain(self):
+        def _values(item):
+            for i in range(3):
+                yield (item, i)
+        self.assertEqual(list(concurrent_chain(_values, 'abcd', workers=2)),
+                         [(item, i) for item in 'abcd' for i in range(3)])
+
+        def _fail(item):
+            yield item
+            raise ValueError(item)
+        self.assertRaises(ValueError, list,
+                          concurrent_chain(_fail, 'ab', workers=2))
+
+    def test_iter_json_array(self):
+        body = u'[{"name": "a\u00e9"}, {"name": "b", "bytes": 10}]'
+        encoded = body.encode('utf8')
+        chunks = [encoded[i:i + 3] for i in range(0, len(encoded), 3)]
+        self.assertEqual(list(iter_json_array(chunks)),
+                         [{'name': u'a\u00e9'}, {'name': 'b', 'bytes': 10}])
+        self.assertEqual(list(iter_json_array([])), [])
+        self.assertRaises(ValueError, list,
+                          iter_json_array([b'[{"name": "a"}, {"na']))
+
     def test_list_containers(self):
         self.connection.storage_url = 'storage_url'
         s = '[{"name":"container_name","count":10,"bytes":100}]'
@@ -157,6 +347,14 @@ class ClientTest(unittest.TestCase):
                                                              headers=_headers,
                                                              size=_size)
 
+    def test_chunk_download(self):
+        _headers = Mock()
+        _url = Mock()
+        self.client.get_url = Mock(return_value=_url)
+        self.client.chunk_download('path', chunk_size=10, headers=_headers)
+        self.connection.chunk_download.assert_called_once_with(
+            _url, chunk_size=10, headers=_headers)
+
     def test_getitem(self):
         _container = Mock()
         self.client.container = Mock(return_value=_container)
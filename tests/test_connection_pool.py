@@ -0,0 +1,319 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import threading
+import time
+from mock import Mock, patch
+from object_storage.transport import ConnectionPool, split_url, \
+    BaseAuthenticatedConnection, BaseAuthentication, ChunkedUploadConnection
+from object_storage.errors import ResponseError
+from object_storage.transport import httplib2conn
+try:
+    from object_storage.transport import requestsconn
+except ImportError:
+    requestsconn = None
+from object_storage.client import Client
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_reuses_idle_connection(self):
+        conn = Mock()
+        self.pool._is_healthy = Mock(return_value=True)
+        self.pool.put('https', 'host', 443, conn)
+        self.assertTrue(self.pool.get('https', 'host', 443) is conn)
+
+    def test_new_connection_when_empty(self):
+        with patch('object_storage.transport.HTTPSConnection') as https:
+            result = self.pool.get('https', 'host', 443)
+        https.assert_called_once_with('host', 443)
+        self.assertTrue(result is https.return_value)
+
+    def test_unhealthy_connection_discarded(self):
+        conn = Mock()
+        self.pool._is_healthy = Mock(return_value=False)
+        self.pool.put('http', 'host', 80, conn)
+        with patch('object_storage.transport.HTTPConnection') as http:
+            result = self.pool.get('http', 'host', 80)
+        conn.close.assert_called_once_with()
+        self.assertTrue(result is http.return_value)
+
+    def test_idle_connection_evicted(self):
+        conn = Mock()
+        self.pool.idle_timeout = -1
+        self.pool.put('http', 'host', 80, conn)
+        with patch('object_storage.transport.HTTPConnection'):
+            self.pool.get('http', 'host', 80)
+        conn.close.assert_called_once_with()
+
+    def test_maxsize(self):
+        conns = [Mock(), Mock(), Mock()]
+        for conn in conns:
+            self.pool.put('http', 'host', 80, conn)
+        conns[2].close.assert_called_once_with()
+        self.assertEqual(len(self.pool.pools[('http', 'host', 80)]), 2)
+
+    def test_split_url(self):
+        self.assertEqual(split_url('https://host/v1/AUTH/c/o'),
+                         ('https', 'host', 443, '/v1/AUTH/c/o'))
+        self.assertEqual(split_url('http://host:8080/v1?a=b'),
+                         ('http', 'host', 8080, '/v1?a=b'))
+
+    def setUp(self):
+        self.pool = ConnectionPool(maxsize=2, idle_timeout=60)
+
+
+class PooledUploadTest(unittest.TestCase):
+    def _upload(self):
+        return ChunkedUploadConnection(None, 'PUT', 'http://host/c/o',
+                                       size=4, headers={}, pool=self.pool)
+
+    def test_retries_stale_connection(self):
+        self.http.send.side_effect = IOError('Broken pipe')
+        fresh = Mock()
+        fresh.getresponse.return_value.status = 201
+        fresh.getresponse.return_value.getheaders.return_value = []
+        self.pool.connect.return_value = fresh
+        upload = self._upload()
+        upload.send(b'data')
+        upload.finish()
+        fresh.putrequest.assert_called_once_with('PUT', '/c/o')
+        fresh.send.assert_called_once_with(b'data')
+        self.pool.discard.assert_called_once_with(self.http)
+
+    def test_no_retry_after_data_was_sent(self):
+        self.http.getresponse.side_effect = IOError('Connection reset')
+        upload = self._upload()
+        upload.send(b'data')
+        self.assertRaises(ResponseError, upload.finish)
+        self.assertFalse(self.pool.connect.called)
+
+    def setUp(self):
+        self.http = Mock()
+        self.pool = Mock()
+        self.pool.get.return_value = self.http
+
+
+class PooledDownloadTest(unittest.TestCase):
+    def _response(self, status, body=b''):
+        res = Mock()
+        res.status = status
+        res.will_close = False
+        res.read.side_effect = [body, b'']
+        return res
+
+    def test_streams_and_releases(self):
+        self.http.getresponse.return_value = self._response(200, b'data')
+        chunks = list(self.conn.chunk_download('http://host/c/o',
+                                               headers={'Range': 'bytes=0-'}))
+        self.assertEqual(chunks, [b'data'])
+        self.assertEqual(
+            self.http.request.call_args[1]['headers']['Range'], 'bytes=0-')
+        self.pool.put.assert_called_once_with('http', 'host', 80, self.http)
+
+    def test_retries_stale_connection(self):
+        self.http.request.side_effect = IOError('Broken pipe')
+        fresh = Mock()
+        fresh.getresponse.return_value = self._response(200, b'data')
+        self.pool.connect.return_value = fresh
+        chunks = list(self.conn.chunk_download('http://host/c/o'))
+        self.assertEqual(chunks, [b'data'])
+        self.pool.discard.assert_called_once_with(self.http)
+        self.pool.connect.assert_called_once_with('http', 'host', 80)
+
+    def test_new_connection_is_not_retried(self):
+        self.http.sock = None
+        self.http.request.side_effect = IOError('Connection refused')
+        self.assertRaises(ResponseError, list,
+                          self.conn.chunk_download('http://host/c/o'))
+        self.assertFalse(self.pool.connect.called)
+
+    def test_connection_pool_created_once(self):
+        conn = BaseAuthenticatedConnection()
+        pools = []
+        threads = [threading.Thread(
+            target=lambda: pools.append(conn.connection_pool))
+            for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(pool) for pool in pools)), 1)
+
+    def test_reauthenticates_on_401(self):
+        self.http.getresponse.side_effect = [self._response(401),
+                                             self._response(200, b'data')]
+        self.conn.auth.authenticate = Mock()
+        chunks = list(self.conn.chunk_download('http://host/c/o'))
+        self.assertEqual(chunks, [b'data'])
+        self.conn.auth.authenticate.assert_called_once_with()
+
+    def test_401_after_another_thread_reauthenticated(self):
+        # the request went out with the old token, but another thread has
+        # authenticated since, so this 401 needs no new authentication
+        self.conn.get_headers = Mock(
+            return_value={'X-Auth-Token': 'OLD_TOKEN'})
+        self.conn.token = 'NEW_TOKEN'
+        self.http.getresponse.side_effect = [self._response(401),
+                                             self._response(200, b'data')]
+        self.conn.auth.authenticate = Mock()
+        chunks = list(self.conn.chunk_download('http://host/c/o'))
+        self.assertEqual(chunks, [b'data'])
+        self.assertFalse(self.conn.auth.authenticate.called)
+
+    @unittest.skipIf(requestsconn is None, 'requires requests')
+    def test_requests_reauthenticates_with_the_sent_token(self):
+        conn = requestsconn.AuthenticatedConnection(
+            BaseAuthentication(auth_url='auth_url'), lazy=True)
+        conn.token = 'NEW_TOKEN'
+        conn.get_headers = Mock(return_value={'X-Auth-Token': 'OLD_TOKEN'})
+        conn._reauthenticate = Mock(
+            return_value={'X-Auth-Token': 'NEW_TOKEN'})
+        conn.session = Mock()
+        unauthorized = Mock(status_code=401)
+        unauthorized.request.headers = {}
+        conn.session.request.return_value = unauthorized
+        conn.session.send.return_value = Mock(status_code=200)
+        conn.make_request('GET', 'http://host/c/o')
+        conn._reauthenticate.assert_called_once_with('OLD_TOKEN')
+
+    def test_httplib2_reauthenticates_with_the_sent_token(self):
+        conn = httplib2conn.AuthenticatedConnection(
+            BaseAuthentication(auth_url='auth_url'), lazy=True)
+        conn.token = 'NEW_TOKEN'
+        conn.get_headers = Mock(return_value={'X-Auth-Token': 'OLD_TOKEN'})
+        conn._reauthenticate = Mock(
+            return_value={'X-Auth-Token': 'NEW_TOKEN'})
+        conn._local = threading.local()
+        conn._local.http = Mock()
+        conn._local.http.request.side_effect = [
+            (Mock(status=401), b''), (Mock(status=200), b'data')]
+        conn.make_request('GET', 'http://host/c/o')
+        conn._reauthenticate.assert_called_once_with('OLD_TOKEN')
+
+    def test_reauthenticate_single_flight(self):
+        stale = self.conn.token
+        calls = []
+
+        def _authenticate():
+            calls.append(1)
+            time.sleep(0.05)
+            self.conn.auth.auth_token = 'NEW_TOKEN'
+        self.conn.auth.authenticate = _authenticate
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.conn._reauthenticate(stale)))
+            for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.conn.token, 'NEW_TOKEN')
+        self.assertEqual(len(results), 10)
+
+    def test_reauthenticate_uses_newer_cached_token(self):
+        self.conn.auth.token_cache = Mock()
+        self.conn.auth.token_cache.get.return_value = ('NEW_TOKEN',
+                                                       'STORAGE_URL')
+        self.conn.auth.authenticate = Mock()
+        self.conn._reauthenticate(self.conn.token)
+        self.assertFalse(self.conn.auth.authenticate.called)
+        self.assertEqual(self.conn.token, 'NEW_TOKEN')
+
+        # the cached token is the one that was rejected
+        self.conn._reauthenticate('NEW_TOKEN')
+        self.conn.auth.authenticate.assert_called_once_with()
+
+    def setUp(self):
+        self.http = Mock()
+        self.pool = Mock()
+        self.pool.get.return_value = self.http
+        self.conn = BaseAuthenticatedConnection()
+        self.conn.auth = BaseAuthentication(auth_url='auth_url')
+        self.conn.auth.authenticate()
+        self.conn._authenticate()
+        self.conn._connection_pool = self.pool
+
+
+class LazyAuthenticationTest(unittest.TestCase):
+    def _authenticate(self):
+        self.calls.append(1)
+        self.conn.auth.auth_token = 'AUTH_TOKEN'
+        self.conn.auth.storage_url = 'http://host/v1/AUTH_account'
+        self.conn.auth.authenticated = True
+
+    def test_authenticates_on_first_request(self):
+        self.assertEqual(self.calls, [])
+        headers = self.conn.get_headers()
+        self.assertEqual(headers['X-Auth-Token'], 'AUTH_TOKEN')
+        self.conn.get_headers()
+        self.assertEqual(self.calls, [1])
+
+    def test_client_url_authenticates(self):
+        client = Client(connection=self.conn)
+        self.assertEqual(client.get_url('c'),
+                         'http://host/v1/AUTH_account/c')
+        self.assertEqual(self.calls, [1])
+
+    def test_concurrent_first_requests_authenticate_once(self):
+        def _authenticate():
+            time.sleep(0.05)
+            self._authenticate()
+        self.conn.auth.authenticate = _authenticate
+
+        headers = []
+        threads = [threading.Thread(
+            target=lambda: headers.append(self.conn.get_headers()))
+            for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, [1])
+        self.assertEqual([h['X-Auth-Token'] for h in headers],
+                         ['AUTH_TOKEN'] * 10)
+
+    @unittest.skipIf(requestsconn is None, 'requires requests')
+    def test_requests_constructor_makes_no_request(self):
+        auth = requestsconn.Authentication('username', 'api_key',
+                                           auth_url='http://host/auth')
+        with patch.object(requestsconn.requests, 'get') as get, \
+                patch.object(requestsconn.requests.Session,
+                             'request') as request:
+            conn = requestsconn.AuthenticatedConnection(auth, lazy=True)
+        self.assertFalse(get.called)
+        self.assertFalse(request.called)
+        self.assertTrue(conn.token is None)
+
+    def test_httplib2_constructor_makes_no_request(self):
+        auth = httplib2conn.Authentication('username', 'api_key',
+                                           auth_url='http://host/auth')
+        with patch.object(httplib2conn.httplib2.Http, 'request') as request:
+            conn = httplib2conn.AuthenticatedConnection(auth, lazy=True)
+        self.assertFalse(request.called)
+        self.assertTrue(conn.token is None)
+
+    def test_prewarm(self):
+        self.conn._connection_pool = ConnectionPool()
+        with patch('object_storage.transport.HTTPConnection') as http:
+            http.side_effect = lambda host, port: Mock(sock=None)
+            self.conn.prewarm(3).join()
+        self.assertEqual(self.calls, [1])
+        idle = self.conn.connection_pool.pools[('http', 'host', 80)]
+        self.assertEqual(len(idle), 3)
+        for conn, _ in idle:
+            conn.connect.assert_called_once_with()
+
+    def setUp(self):
+        self.calls = []
+        self.conn = BaseAuthenticatedConnection()
+        self.conn.token = self.conn.storage_url = None
+        self.conn.lazy = True
+        self.conn.auth = BaseAuthentication(auth_url='auth_url')
+        self.conn.auth.authenticate = self._authenticate
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,9 +2,14 @@ try:
     import unittest2 as unittest
 except ImportError:
     import unittest
-from mock import Mock
+from mock import Mock, patch
+from hashlib import md5
+import os
+import shutil
+import tempfile
 from object_storage.container import Container
 from object_storage.storage_object import StorageObject
+from object_storage.transport import Response
 
 
 class ContainerTest(unittest.TestCase):
@@ -29,12 +34,14 @@ class ContainerTest(unittest.TestCase):
 
     def test_delete_all_objects(self):
         _item1 = Mock()
+        _item1.name = 'a'
         _item2 = Mock()
-        self.container.objects = Mock(return_value=[_item1, _item2])
-        self.container.delete_all_objects()
-        self.container.objects.called_once_with()
-        _item1.delete.assert_called_once_with()
-        _item2.delete.assert_called_once_with()
+        _item2.name = 'b'
+        self.container.iter_objects = Mock(return_value=[_item1, _item2])
+        self.container.delete_all_objects(workers=2)
+        names = self.client.delete_objects.call_args[0][1]
+        self.assertEqual(list(names), ['a', 'b'])
+        self.container.iter_objects.assert_called_once_with()
 
     def test_delete_object(self):
         self.container.delete_object('OBJECT')
@@ -47,7 +54,19 @@ class ContainerTest(unittest.TestCase):
         self.client.delete_object.called_once_with(self.container, 'OBJECT')
 
     def test_list(self):
-        pass
+        response = Response()
+        response.content = b'[{"name": "b"}, {"subdir": "a/"}, {"name": "c"}]'
+        self.client.make_request.return_value = response
+        self.client.make_request.side_effect = (
+            lambda *args, **kwargs: kwargs['formatter'](
+                self.client.make_request.return_value))
+        self.container.objects(base_only=True)
+        self.assertEqual([c[0][0] for c in
+                          self.client.storage_object.call_args_list],
+                         ['CONTAINER', 'CONTAINER', 'CONTAINER'])
+        self.assertEqual([c[0][1] for c in
+                          self.client.storage_object.call_args_list],
+                         ['b', 'a', 'c'])
 
     def test_search(self, *args, **kwargs):
         self.container.search('query')
@@ -99,6 +118,108 @@ class ContainerTest(unittest.TestCase):
         self.assertTrue(obj == _obj, "Object returns from container.object()")
         self.container.storage_object.assert_called_once_with('OBJECT')
 
+    def _tree(self, tree):
+        def _iter_listing(path, params=None, **kwargs):
+            return [dict(entry) for entry in tree[params.get('prefix', '')]]
+        self.client.delimiter = '/'
+        self.client.iter_listing = Mock(side_effect=_iter_listing)
+        self.client.storage_object = lambda container, name: Mock(name=name)
+
+    def test_walk(self):
+        self._tree({
+            '': [{'subdir': 'a/'}, {'subdir': 'b/'}, {'name': 'top'}],
+            'a/': [{'subdir': 'a/c/'}, {'name': 'a/x'}],
+            'b/': [],
+            'a/c/': [{'name': 'a/c/y'}],
+        })
+        result = [(path, dirs, len(objs))
+                  for path, dirs, objs in self.container.walk(workers=2)]
+        self.assertEqual(result, [('', ['a', 'b'], 1),
+                                  ('a', ['c'], 1),
+                                  ('b', [], 0),
+                                  ('a/c', [], 1)])
+
+    def test_walk_depth_and_prune(self):
+        self._tree({
+            '': [{'subdir': 'a/'}, {'subdir': 'b/'}],
+            'a/': [{'subdir': 'a/c/'}],
+        })
+        result = [path for path, _, _ in self.container.walk(
+            max_depth=1, prune=lambda path: path == 'b')]
+        self.assertEqual(result, ['', 'a'])
+
+    def test_walk_prune_dirnames(self):
+        self._tree({
+            'a/': [{'subdir': 'a/b/'}, {'subdir': 'a/c/'}],
+            'a/c/': [],
+        })
+        result = []
+        for path, dirnames, _ in self.container.walk('a/'):
+            result.append(path)
+            if 'b' in dirnames:
+                dirnames.remove('b')
+        self.assertEqual(result, ['a', 'a/c'])
+
+    def test_download_prefix(self):
+        dest = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(dest, 'same'), 'wb') as f:
+                f.write(b'same')
+            with open(os.path.join(dest, 'edited'), 'wb') as f:
+                f.write(b'edit')
+            content = {'p/same': b'same', 'p/edited': b'EDIT',
+                       'p/sub/new': b'new'}
+            self.client.hash_cache = None
+            self.client.storage_object = \
+                lambda container, name: StorageObject(container, name,
+                                                      client=self.client)
+            self.client.iter_listing.return_value = [
+                {'name': name, 'bytes': len(data),
+                 'hash': md5(data).hexdigest(),
+                 'last_modified': '2001-09-09T01:46:40.000000'}
+                for name, data in sorted(content.items())]
+
+            def _save_to_filename(obj, filename):
+                with open(filename, 'wb') as f:
+                    f.write(content[obj.name])
+            with patch.object(StorageObject, 'save_to_filename',
+                              _save_to_filename):
+                result = self.container.download_prefix('p/', dest,
+                                                        set_mtime=True)
+
+            self.assertEqual(sorted(result['downloaded']),
+                             ['p/edited', 'p/sub/new'])
+            self.assertEqual(result['skipped'], ['p/same'])
+            with open(os.path.join(dest, 'sub', 'new'), 'rb') as f:
+                self.assertEqual(f.read(), b'new')
+            self.assertEqual(
+                os.path.getmtime(os.path.join(dest, 'edited')), 1000000000)
+            self.assertEqual(sorted(os.listdir(dest)),
+                             ['edited', 'same', 'sub'])
+        finally:
+            shutil.rmtree(dest)
+
+    def test_download_prefix_rejects_unsafe_names(self):
+        parent = tempfile.mkdtemp()
+        dest = os.path.join(parent, 'dest')
+        try:
+            self.client.hash_cache = None
+            self.client.storage_object = \
+                lambda container, name: StorageObject(container, name,
+                                                      client=self.client)
+            self.client.iter_listing.return_value = [
+                {'name': name, 'bytes': 1, 'hash': 'h',
+                 'last_modified': '2001-09-09T01:46:40.000000'}
+                for name in ['p/../escape', 'p/a/../../../escape', 'p/..']]
+            with patch.object(StorageObject, 'save_to_filename') as save:
+                result = self.container.download_prefix('p/', dest)
+            self.assertFalse(save.called)
+            self.assertEqual([name for name, _ in result['errors']],
+                             ['p/../escape', 'p/a/../../../escape', 'p/..'])
+            self.assertEqual(os.listdir(parent), [])
+        finally:
+            shutil.rmtree(parent)
+
     def setUp(self):
         self.client = Mock()
         self.container = Container('CONTAINER', client=self.client)
@@ -0,0 +1,75 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+from mock import Mock
+from object_storage.client import Client
+from object_storage.errors import NotFound
+
+
+class ContainerIndexTest(unittest.TestCase):
+    def _listing(self, *names):
+        return [{'name': name, 'bytes': len(name), 'hash': 'h',
+                 'last_modified': '2014-01-01T00:00:00.000000',
+                 'content_type': 'text/plain'} for name in names]
+
+    def test_refresh_and_query(self):
+        self.client.iter_listing.return_value = self._listing(
+            'a/1.gz', 'a/22.txt', 'b/333.gz')
+        self.assertEqual(self.index.refresh(), 3)
+        self.assertEqual([e['name'] for e in self.index.query(prefix='a/')],
+                         ['a/1.gz', 'a/22.txt'])
+        self.assertEqual([e['name'] for e in self.index.query(glob='*.gz')],
+                         ['a/1.gz', 'b/333.gz'])
+        self.assertEqual([e['name'] for e in
+                          self.index.query(min_size=7, max_size=8)],
+                         ['a/22.txt', 'b/333.gz'])
+        self.assertEqual(self.index.stats(prefix='a'),
+                         {'count': 2, 'bytes': 14})
+
+    def test_incremental_refresh(self):
+        self.client.iter_listing.return_value = self._listing('a', 'b')
+        self.index.refresh()
+        self.client.iter_listing.return_value = self._listing('c')
+        self.assertEqual(self.index.refresh(), 1)
+        self.assertEqual(self.client.iter_listing.call_args[1]['marker'],
+                         'b')
+        self.assertEqual(self.index.stats()['count'], 3)
+
+        self.client.iter_listing.return_value = self._listing('d')
+        self.index.refresh(full=True)
+        self.assertEqual(self.client.iter_listing.call_args[1]['marker'],
+                         None)
+        self.assertEqual(self.index.query(), self._listing('d'))
+
+    def test_client_writes(self):
+        model = {'size': 5, 'hash': 'abc', 'content_type': 'text/plain',
+                 'last_modified': 'Wed, 01 Jan 2014 00:00:00 GMT'}
+        self.client._index_add('CONTAINER', 'new', model)
+        self.client._index_add('OTHER', 'ignored', model)
+        self.assertEqual(self.index.query(), [{
+            'name': 'new', 'bytes': 5, 'hash': 'abc',
+            'last_modified': '2014-01-01T00:00:00.000000',
+            'content_type': 'text/plain'}])
+
+        self.client.make_request = Mock(side_effect=NotFound('Not found'))
+        self.assertRaises(NotFound, self.client.delete_object, 'CONTAINER',
+                          'new')
+        self.assertEqual(self.index.query(), [])
+
+    def test_bulk_delete(self):
+        self.client.iter_listing.return_value = self._listing('a', 'b')
+        self.index.refresh()
+        self.client._bulk_delete = Mock(return_value={
+            'deleted': 1, 'not_found': 0,
+            'errors': [('/CONTAINER/b', '500 Internal Error')]})
+        self.client.delete_objects('CONTAINER', ['a', 'b'])
+        self.assertEqual([e['name'] for e in self.index.query()], ['b'])
+
+    def setUp(self):
+        self.client = Client('username', 'api_key', connection=Mock())
+        self.client.iter_listing = Mock()
+        self.index = self.client.container_index('CONTAINER')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,16 @@ try:
     import unittest2 as unittest
 except ImportError:
     import unittest
-from mock import Mock
-from object_storage.storage_object import StorageObject
+from mock import Mock, patch
+from hashlib import md5
+import os
+import shutil
+import six
+import tempfile
+from object_storage.storage_object import StorageObject, \
+    StorageObjectModel, ListingModel, listing_object
+from object_storage.errors import ChecksumMismatch
+from object_storage.utils import json
 
 
 class ClientTest(unittest.TestCase):
@@ -105,6 +113,27 @@ class ClientTest(unittest.TestCase):
         self.assertTrue(legacy_dir_object.is_dir())
         self.assertFalse(file_object.is_dir())
 
+    def test_listing_model(self):
+        controller = Mock()
+        model = ListingModel(controller, 'CONTAINER', 'NAME',
+                             {'name': 'NAME', 'bytes': 10, 'hash': 'abc',
+                              'content_type': 'text/plain'})
+        if six.PY3:
+            # the old-style DictMixin of Python 2 ignores __slots__
+            self.assertFalse(hasattr(model, '__dict__'))
+        self.assertEqual(model['size'], 10)
+        self.assertEqual(model['hash'], 'abc')
+        self.assertFalse(model._properties)
+        self.assertEqual(controller.mock_calls, [])
+        self.assertEqual(model.properties['url'], controller.url)
+        self.assertEqual(model.properties['meta'], {})
+        self.assertEqual(sorted(model.keys()), sorted(model.properties))
+
+    def test_listing_object_subdir(self):
+        obj = listing_object(self.client, 'CONTAINER', {'subdir': 'dir/'})
+        self.client.storage_object.assert_called_once_with('CONTAINER', 'dir')
+        self.assertEqual(obj.model['content_type'], 'application/directory')
+
     def test_rename(self):
         self.obj.copy_to = Mock()
         self.obj.delete = Mock()
@@ -114,8 +143,334 @@ class ClientTest(unittest.TestCase):
         self.obj.copy_to.called_once_with(_new_obj, 1, 2, a1=1, a2=2)
         self.obj.delete.called_once_with()
 
+    def _chunk_upload(self, etag=None):
+        uploads = {}
+
+        def _chunk_upload(path, size=None, headers=None):
+            conn = Mock()
+            sent = []
+            uploads[path[1]] = sent
+            conn.send.side_effect = sent.append
+
+            def _finish():
+                res = Mock()
+                res.headers = {
+                    'etag': etag or md5(b''.join(sent)).hexdigest()}
+                return res
+            conn.finish.side_effect = _finish
+            return conn
+        self.client.chunk_upload.side_effect = _chunk_upload
+        return uploads
+
+    def test_send_segments(self):
+        uploads = self._chunk_upload()
+        self.obj.make_request = Mock()
+        self.obj.send_segments(b'0123456789', segment_size=4, workers=2)
+
+        self.client.container.assert_called_once_with('CONTAINER_segments')
+        names = sorted(uploads)
+        self.assertEqual(len(names), 3)
+        self.assertEqual([b''.join(uploads[n]) for n in names],
+                         [b'0123', b'4567', b'89'])
+        headers = self.obj.make_request.call_args[1]['headers']
+        self.assertTrue(headers['X-Object-Manifest'].startswith(
+            'CONTAINER_segments/NAME/'))
+        self.assertEqual(headers['Content-Length'], '0')
+
+    def test_send_segments_file(self):
+        uploads = self._chunk_upload()
+        self.obj.make_request = Mock()
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.write(b'xx0123456789')
+        f.close()
+        try:
+            with open(f.name, 'rb') as data:
+                data.read(2)
+                self.obj.send_segments(data, segment_size=4)
+        finally:
+            os.remove(f.name)
+        names = sorted(uploads)
+        self.assertTrue(names[0].endswith('/10/4/00000000'))
+        self.assertEqual([b''.join(uploads[n]) for n in names],
+                         [b'0123', b'4567', b'89'])
+
+    def test_send_segments_static(self):
+        self._chunk_upload()
+        self.obj.make_request = Mock()
+        self.obj.send_segments(b'0123456789', segment_size=4, static=True)
+        kwargs = self.obj.make_request.call_args[1]
+        self.assertEqual(kwargs['params'], {'multipart-manifest': 'put'})
+        manifest = json.loads(kwargs['data'])
+        self.assertEqual([m['size_bytes'] for m in manifest], [4, 4, 2])
+        self.assertEqual(manifest[0]['etag'], md5(b'0123').hexdigest())
+
+    def test_send_segments_checksum_mismatch(self):
+        self._chunk_upload(etag='bad')
+        self.obj.make_request = Mock()
+        self.assertRaises(ChecksumMismatch, self.obj.send_segments,
+                          b'0123456789', segment_size=4)
+        self.assertFalse(self.obj.make_request.called)
+        names = self.client.delete_objects.call_args[0][1]
+        self.assertEqual([n.rsplit('/', 1)[1] for n in names],
+                         ['00000000', '00000001', '00000002'])
+
+    def test_send_segments_checksum_mismatch_keeps_journaled(self):
+        self._chunk_upload(etag='bad')
+        self.obj.make_request = Mock()
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.close()
+        os.remove(f.name)
+        try:
+            self.assertRaises(ChecksumMismatch, self.obj.send_segments,
+                              b'0123456789', segment_size=4, journal=f.name)
+            self.assertTrue(os.path.exists(f.name))
+        finally:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+        self.assertFalse(self.client.delete_objects.called)
+
+    def test_send_segments_buffers_workers_segments(self):
+        data = six.BytesIO(b'0123456789ab')
+        read = []
+
+        def _chunk_upload(path, size=None, headers=None):
+            read.append(data.tell())
+            sent = []
+            conn = Mock()
+            conn.send.side_effect = sent.append
+            conn.finish.side_effect = lambda: Mock(
+                headers={'etag': md5(b''.join(sent)).hexdigest()})
+            return conn
+        self.client.chunk_upload.side_effect = _chunk_upload
+        self.obj.make_request = Mock()
+        self.obj.send_segments(data, segment_size=4, workers=1)
+        # the next segment isn't read before the previous one is uploaded
+        self.assertEqual(read, [4, 8, 12])
+
+    def test_send_segments_journal(self):
+        self._send_segments_journaled(b'0123456789')
+
+    def test_send_segments_journal_seekable_stream(self):
+        # like a Python 2 file or StringIO: seekable, but not an io.IOBase
+        class Stream(object):
+            def __init__(self, data):
+                self._data = six.BytesIO(data)
+                self.read = self._data.read
+                self.seek = self._data.seek
+                self.tell = self._data.tell
+        self._send_segments_journaled(Stream(b'0123456789'))
+
+    def _send_segments_journaled(self, data):
+        uploads = self._chunk_upload()
+        self.obj.make_request = Mock()
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.close()
+        with open(f.name, 'w') as journal:
+            json.dump({'container': 'CONTAINER', 'name': 'NAME',
+                       'segment_container': 'CONTAINER_segments',
+                       'segment_size': 4, 'size': 10, 'prefix': 'NAME/p',
+                       'segments': [
+                           {'index': 0, 'offset': 0, 'length': 4,
+                            'etag': md5(b'0123').hexdigest()},
+                           {'index': 1, 'offset': 4, 'length': 4,
+                            'etag': md5(b'4567').hexdigest()}]}, journal)
+        self.client.iter_listing.return_value = [
+            {'name': 'NAME/p/00000000', 'bytes': 4,
+             'hash': md5(b'0123').hexdigest()}]
+        try:
+            self.obj.send_segments(data, segment_size=4,
+                                   static=True, journal=f.name)
+            self.assertFalse(os.path.exists(f.name))
+        finally:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+        self.assertEqual(sorted(uploads), ['NAME/p/00000001',
+                                           'NAME/p/00000002'])
+        manifest = json.loads(self.obj.make_request.call_args[1]['data'])
+        self.assertEqual([m['path'] for m in manifest],
+                         ['/CONTAINER_segments/NAME/p/00000000',
+                          '/CONTAINER_segments/NAME/p/00000001',
+                          '/CONTAINER_segments/NAME/p/00000002'])
+
+    def test_send_segments_journal_with_different_data(self):
+        uploads = self._chunk_upload()
+        self.obj.make_request = Mock()
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.close()
+        with open(f.name, 'w') as journal:
+            json.dump({'container': 'CONTAINER', 'name': 'NAME',
+                       'segment_container': 'CONTAINER_segments',
+                       'segment_size': 4, 'size': 10, 'prefix': 'NAME/p',
+                       'segments': [
+                           {'index': 0, 'offset': 0, 'length': 4,
+                            'etag': md5(b'0123').hexdigest()}]}, journal)
+        self.client.iter_listing.return_value = [
+            {'name': 'NAME/p/00000000', 'bytes': 4,
+             'hash': md5(b'0123').hexdigest()}]
+        try:
+            self.obj.send_segments(b'abcdefghij', segment_size=4,
+                                   static=True, journal=f.name)
+        finally:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+        self.assertEqual(b''.join(uploads['NAME/p/00000000']), b'abcd')
+        manifest = json.loads(self.obj.make_request.call_args[1]['data'])
+        self.assertEqual(manifest[0]['etag'], md5(b'abcd').hexdigest())
+
+    def _ranged_object(self, data, headers=None):
+        _headers = {'content-length': len(data)}
+        _headers.update(headers or {})
+
+        def _load():
+            self.obj.model = StorageObjectModel(
+                self.obj, self.obj.container, self.obj.name, _headers)
+        self.obj.load = Mock(side_effect=_load)
+
+        def _chunk_download(path, chunk_size=None, headers=None):
+            start, end = headers['Range'][6:].split('-')
+            return [data[int(start):int(end) + 1]]
+        self.client.chunk_download.side_effect = _chunk_download
+
+    def test_read_parallel(self):
+        self._ranged_object(b'0123456789')
+        result = self.obj.read_parallel(workers=3, range_size=3)
+        self.assertEqual(result, bytearray(b'0123456789'))
+        self.assertEqual(self.client.chunk_download.call_count, 4)
+
+    def test_read_parallel_dynamic_manifest(self):
+        self._ranged_object(b'01234',
+                            {'x-object-manifest': 'SEGMENTS/NAME/'})
+        self.client.iter_listing.return_value = [
+            {'name': 'NAME/0', 'bytes': 3}, {'name': 'NAME/1', 'bytes': 2}]
+        self.obj.read_parallel(workers=2, range_size=10)
+        paths = sorted(c[0][0] for c in
+                       self.client.chunk_download.call_args_list)
+        self.assertEqual(paths, [['SEGMENTS', 'NAME/0'],
+                                 ['SEGMENTS', 'NAME/1']])
+
+    def test_save_to_filename_parallel(self):
+        self._ranged_object(b'0123456789')
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.close()
+        try:
+            self.obj.save_to_filename(f.name, workers=2, range_size=4)
+            with open(f.name, 'rb') as saved:
+                self.assertEqual(saved.read(), b'0123456789')
+        finally:
+            os.remove(f.name)
+
+    def _resume(self, etag):
+        self._ranged_object(b'0123456789', {'etag': 'ETAG'})
+        f = tempfile.NamedTemporaryFile(delete=False)
+        f.write(b'0123______')
+        f.close()
+        with open(f.name + '.checkpoint', 'w') as checkpoint:
+            json.dump({'etag': etag, 'last_modified': None, 'size': 10,
+                       'completed': [[0, 4]]}, checkpoint)
+        try:
+            self.obj.save_to_filename(f.name, range_size=4, resume=True)
+            with open(f.name, 'rb') as saved:
+                self.assertEqual(saved.read(), b'0123456789')
+            self.assertFalse(os.path.exists(f.name + '.checkpoint'))
+        finally:
+            os.remove(f.name)
+        return sorted(c[1]['headers']['Range'] for c in
+                      self.client.chunk_download.call_args_list)
+
+    def test_save_to_filename_resume(self):
+        self.assertEqual(self._resume('ETAG'),
+                         ['bytes=4-7', 'bytes=8-9'])
+
+    def test_save_to_filename_resume_changed(self):
+        self.assertEqual(self._resume('OLD'),
+                         ['bytes=0-3', 'bytes=4-7', 'bytes=8-9'])
+
+    def test_upload_directory_sync(self):
+        cwd = os.getcwd()
+        tmp = tempfile.mkdtemp()
+        try:
+            os.chdir(tmp)
+            os.makedirs(os.path.join('dir', 'sub'))
+            for name, data in (('same', b'aaa'), ('touched', b'bbb'),
+                               ('edited', b'ccc'), ('grown', b'dddd'),
+                               ('new', b'e')):
+                with open(os.path.join('dir', name), 'wb') as f:
+                    f.write(data)
+            os.utime(os.path.join('dir', 'same'), (0, 0))
+
+            def _item(name, data, last_modified):
+                return {'name': 'dir/' + name, 'bytes': len(data),
+                        'hash': md5(data).hexdigest(),
+                        'last_modified': last_modified}
+            # 'same' was uploaded after it was last modified; 'touched'
+            # was modified since but its content matches
+            uploaded, epoch = '2000-01-01T00:00:00.000000', \
+                '1970-01-01T00:00:00.000000'
+            self.client.iter_listing.return_value = [
+                _item('same', b'aaa', uploaded),
+                _item('touched', b'bbb', epoch),
+                _item('edited', b'xxx', epoch),
+                _item('grown', b'ddd', uploaded),
+                _item('orphan', b'', uploaded)]
+            self.client.delete_objects.return_value = {
+                'deleted': 1, 'not_found': 0, 'errors': []}
+
+            with patch.object(StorageObject, 'send') as send, \
+                    patch.object(StorageObject, 'create') as create:
+                result = self.obj.upload_directory('dir', sync=True,
+                                                   delete=True)
+            self.assertEqual(sorted(result['uploaded']),
+                             ['dir/edited', 'dir/grown', 'dir/new'])
+            self.assertEqual(sorted(result['skipped']),
+                             ['dir/same', 'dir/touched'])
+            self.assertEqual(result['deleted'], ['dir/orphan'])
+            self.assertEqual(send.call_count, 3)
+            self.assertEqual(create.call_count, 1)
+            self.assertEqual(
+                self.client.iter_listing.call_args[1]['params'],
+                {'prefix': 'dir/'})
+            self.client.delete_objects.assert_called_once_with(
+                'CONTAINER', ['dir/orphan'], workers=4)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmp)
+
+    def test_upload_directory_sync_checksum_mismatch(self):
+        cwd = os.getcwd()
+        tmp = tempfile.mkdtemp()
+        try:
+            os.chdir(tmp)
+            os.makedirs('dir')
+            for name in ('bad', 'good'):
+                with open(os.path.join('dir', name), 'wb') as f:
+                    f.write(b'data')
+            self.client.iter_listing.return_value = []
+
+            def _send(f):
+                if f.name.endswith('bad'):
+                    raise ChecksumMismatch('md5 hashes do not match')
+            with patch.object(StorageObject, 'send', side_effect=_send):
+                result = self.obj.upload_directory('dir', sync=True)
+            self.assertEqual(result['uploaded'], ['dir/good'])
+            self.assertEqual(result['errors'],
+                             [('dir/bad', 'md5 hashes do not match')])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmp)
+
+    def test_send_checksum_mismatch(self):
+        conn = Mock()
+        del conn.send_from
+        conn.finish.return_value.headers = {'etag': 'bad'}
+        self.client.chunk_upload.return_value = conn
+        self.assertRaises(ChecksumMismatch, self.obj.send, b'data')
+
     def setUp(self):
         self.client = Mock()
+        self.client.content_cache = None
+        self.client.hash_cache = None
         self.obj = StorageObject('CONTAINER', 'NAME', client=self.client)
 
 if __name__ == "__main__":
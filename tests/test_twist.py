@@ -0,0 +1,151 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+from hashlib import md5
+
+import six
+from mock import Mock
+try:
+    from twisted.internet import reactor
+    from twisted.internet.defer import Deferred
+    from twisted.trial.unittest import TestCase
+    from twisted.web.resource import Resource
+    from twisted.web.server import Site
+    from object_storage.transport import twist
+except ImportError:
+    TestCase = unittest.TestCase
+    twist = None
+from object_storage.errors import NotFound
+from object_storage.storage_object import StorageObject
+from object_storage.transport import BaseAuthentication, Response
+
+
+if twist is not None:
+    class _Object(Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            if request.path.endswith(b'/missing'):
+                request.setResponseCode(404)
+                return b'not here'
+            return b'0123456789'
+
+    class _CountingSite(Site):
+        def __init__(self, *args, **kwargs):
+            Site.__init__(self, *args, **kwargs)
+            self.connections = 0
+
+        def buildProtocol(self, addr):
+            self.connections += 1
+            return Site.buildProtocol(self, addr)
+
+
+@unittest.skipIf(twist is None, 'requires twisted')
+class AuthenticatedConnectionTest(TestCase):
+    def test_reuses_connections(self):
+        url = 'http://127.0.0.1:%d/v1/c/o' % self.port.getHost().port
+
+        def _get(_=None):
+            return self.conn.make_request('GET', url)
+
+        def _check(res):
+            self.assertEqual(res.content, b'0123456789')
+            return res
+
+        d = _get()
+        for _ in range(3):
+            d.addCallback(_check)
+            d.addCallback(_get)
+        d.addCallback(_check)
+        d.addCallback(lambda _: self.assertEqual(self.site.connections, 1))
+        return d
+
+    def test_error_response_keeps_connection(self):
+        base = 'http://127.0.0.1:%d/v1/c/' % self.port.getHost().port
+        d = self.conn.make_request('GET', base + 'missing')
+        d = self.assertFailure(d, NotFound)
+        d.addCallback(lambda _: self.conn.make_request('GET', base + 'o'))
+        d.addCallback(lambda _: self.assertEqual(self.site.connections, 1))
+        return d
+
+    def test_chunk_download(self):
+        url = 'http://127.0.0.1:%d/v1/c/o' % self.port.getHost().port
+        d = self.conn.chunk_download(url, chunk_size=4)
+        d.addCallback(lambda chunks: self.assertEqual(
+            chunks, [b'0123', b'4567', b'89']))
+        return d
+
+    def setUp(self):
+        self.site = _CountingSite(_Object())
+        self.port = reactor.listenTCP(0, self.site, interface='127.0.0.1')
+        auth = BaseAuthentication(auth_url='auth_url')
+        auth.authenticate()
+        self.conn = twist.AuthenticatedConnection(auth)
+        self.conn._authenticate()
+
+    def tearDown(self):
+        d = self.conn.pool.closeCachedConnections()
+        d.addCallback(lambda _: self.port.stopListening())
+        return d
+
+
+@unittest.skipIf(twist is None, 'requires twisted')
+class ChunkedStreamProducerTest(unittest.TestCase):
+    def test_send_waits_while_paused(self):
+        written = []
+        consumer = type('Consumer', (object, ),
+                        {'write': lambda self, data: written.append(data)})()
+        producer = twist.ChunkedStreamProducer(chunk_size=4)
+        producer.startProducing(consumer)
+
+        producer.pauseProducing()
+        sent = []
+        producer.send(b'0123456789').addCallback(sent.append)
+        self.assertEqual(written, [])
+        self.assertEqual(sent, [])
+
+        producer.resumeProducing()
+        self.assertEqual(written, [b'0123', b'4567', b'89'])
+        self.assertEqual(sent, [None])
+
+    def test_stop_fails_pending_sends(self):
+        producer = twist.ChunkedStreamProducer()
+        failures = []
+        producer.send(b'data').addErrback(failures.append)
+        self.assertEqual(failures, [])
+        producer.stopProducing()
+        self.assertEqual(len(failures), 1)
+
+    def test_storage_object_send_waits_for_writes(self):
+        req = Deferred()
+        conn = Mock()
+        conn.make_request.return_value = req
+        upload = twist.ChunkedConnection(conn, 'http://host/c/o', size=10000)
+        upload.setup()
+        client = Mock()
+        client.hash_cache = None
+        client.chunk_upload.return_value = upload
+        data = six.BytesIO(b'x' * 10000)
+
+        obj = StorageObject('c', 'o', client=client)
+        sent = []
+        obj.send(data).addCallback(sent.append)
+        # nothing more is read until the transport asks for data
+        self.assertEqual(data.tell(), 4096)
+
+        written = []
+        consumer = Mock()
+        consumer.write.side_effect = written.append
+        upload.body.startProducing(consumer)
+        self.assertEqual(len(b''.join(written)), 10000)
+
+        res = Response()
+        res.headers = {'etag': md5(b'x' * 10000).hexdigest()}
+        req.callback(res)
+        self.assertEqual(sent, [obj])
+        self.assertEqual(obj.model['size'], 10000)
+
+
+if __name__ == "__main__":
+    unittest.main()